@@ -3,6 +3,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from routes import documents, analyze, tts, visualizations, auto_reader, image_generation
 from services.mongodb_service import get_mongodb_service
+from services.pdf_extractor import shutdown_executor
+from services.gemini_client import shutdown_gemini_client
+from services.enrichment_jobs import get_enrichment_job_service
+from services.visualization_scheduler import get_visualization_scheduler
 import os
 from dotenv import load_dotenv
 
@@ -45,6 +49,9 @@ async def startup_event():
         print(f"Warning: MongoDB connection failed: {e}")
         print("App will continue without MongoDB functionality")
 
+    # Start enrichment workers, resuming jobs interrupted by the last shutdown
+    await get_enrichment_job_service().start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
@@ -54,6 +61,10 @@ async def shutdown_event():
         print("MongoDB connection closed")
     except Exception as e:
         print(f"Error closing MongoDB connection: {e}")
+    await get_enrichment_job_service().stop()
+    await get_visualization_scheduler().shutdown()
+    shutdown_executor()
+    shutdown_gemini_client()
 
 @app.get("/")
 def root():
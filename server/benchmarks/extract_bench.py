@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""Benchmark layout extraction on a deterministic synthetic corpus.
+
+Run from the server directory:
+
+    python -m benchmarks.extract_bench
+    python -m benchmarks.extract_bench --quick --compare benchmarks/results/extract-<commit>.json
+
+Every case is generated with PyMuPDF (or as plain text) from a fixed seed,
+so numbers are comparable across commits. Results are written as JSON.
+
+Each case is timed on two paths: the synchronous ``extract_layout(bytes)``,
+and the path the upload routes take, where the file is spooled to disk and
+pages come from ``aiter_pages(path)`` (with the process pool for large
+PDFs), once with full word models and once with compact word columns. The pool follows the app's settings, so on a single-core host set
+e.g. ``PDF_EXTRACT_WORKERS=4`` to benchmark it. ``tracemalloc`` only sees
+Python allocations, so peak RSS of the production path is also measured, in
+a fresh process per case: that of the process itself and of its largest
+extraction worker. RSS figures need a Unix ``resource`` module and are
+omitted elsewhere.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import fitz
+from fastapi import UploadFile
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from models import WordDetail  # noqa: E402
+from services.pdf_extractor import (EXTRACT_WORKERS, EXTRACTOR_VERSION, aiter_pages,  # noqa: E402
+                                    extract_layout, shutdown_executor)
+from services.upload_spool import spool_upload  # noqa: E402
+
+
+VOCABULARY = (
+    "the a and of to in was he she it said his her that with for on as at "
+    "Alice Bob garden river castle dragon teacher forest quickly slowly "
+    "wonderful mysterious adventure remember believe whisper thunder "
+    "comprehension photosynthesis extraordinary responsibility"
+).split()
+
+# name, pages, columns, font size, words per line
+PDF_CASES = [
+    ("pdf-small", 5, 1, 11, 10),
+    ("pdf-book", 100, 1, 11, 12),
+    ("pdf-dense", 20, 1, 6, 24),
+    ("pdf-two-column", 40, 2, 9, 7),
+    ("pdf-large-print", 40, 1, 18, 6),
+]
+
+# name, lines
+TEXT_CASES = [
+    ("text-short", 500),
+    ("text-novel", 20000),
+]
+
+
+def make_pdf(pages: int, columns: int, font_size: float, words_per_line: int, seed: int = 0) -> bytes:
+    rnd = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        column_width = (page.rect.width - 72) / columns
+        for column in range(columns):
+            y = 36 + font_size
+            while y < page.rect.height - 36:
+                words = [rnd.choice(VOCABULARY) for _ in range(words_per_line)]
+                page.insert_text((36 + column * column_width, y), " ".join(words), fontsize=font_size)
+                y += font_size * 1.4
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_text(lines: int, seed: int = 0) -> bytes:
+    rnd = random.Random(seed)
+    out = []
+    for i in range(lines):
+        out.append(" ".join(rnd.choice(VOCABULARY) for _ in range(rnd.randint(4, 16))))
+        if i % 9 == 8:
+            out.append("")
+    return "\n".join(out).encode()
+
+
+def _max_rss_bytes(who) -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _peak_rss_bytes() -> int:
+    """Peak RSS of this process"""
+    # Linux keeps ru_maxrss across exec, so a fresh child would report its
+    # parent's peak; the VmHWM high-water mark starts over
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return _max_rss_bytes(resource.RUSAGE_SELF)
+
+
+async def _spool(data: bytes, name: str):
+    return await spool_upload(UploadFile(io.BytesIO(data), filename=name), max_size=len(data))
+
+
+async def _extract_spooled(path: str, words: WordDetail = WordDetail.FULL):
+    """Seconds to the first page and to the last, and the page count"""
+    start = time.perf_counter()
+    first_page = None
+    pages = 0
+    async for _ in aiter_pages(path, words):
+        if first_page is None:
+            first_page = time.perf_counter() - start
+        pages += 1
+    return first_page, time.perf_counter() - start, pages
+
+
+def measure_spooled(name: str, data: bytes, repeats: int) -> dict:
+    """Time the upload path: spool to disk, then ``aiter_pages`` on the file"""
+    spool_timings, first_timings, timings, compact_timings = [], [], [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        upload = asyncio.run(_spool(data, name))
+        spool_timings.append(time.perf_counter() - start)
+        try:
+            first_page, total, pages = asyncio.run(_extract_spooled(upload.path))
+            compact_timings.append(asyncio.run(_extract_spooled(upload.path, WordDetail.COMPACT))[1])
+        finally:
+            upload.close()
+        first_timings.append(first_page)
+        timings.append(total)
+    best = min(timings)
+    return {
+        "spool_seconds": min(spool_timings),
+        "aiter_seconds": best,
+        "aiter_first_page_seconds": min(first_timings),
+        "aiter_pages_per_sec": pages / best,
+        "aiter_compact_seconds": min(compact_timings),
+        "aiter_compact_pages_per_sec": pages / min(compact_timings),
+    }
+
+
+def measure_rss(name: str, data: bytes) -> dict:
+    """Peak RSS of the upload path, from a fresh process"""
+    if resource is None:
+        return {}
+    fd, path = tempfile.mkstemp(prefix="bench_")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        output = subprocess.check_output(
+            [sys.executable, "-m", "benchmarks.extract_bench", "--rss-case", path, "--rss-name", name],
+            cwd=SERVER_DIR, text=True)
+    finally:
+        os.unlink(path)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def rss_case(path: str, name: str):
+    """Child process entry point for ``measure_rss``"""
+    with open(path, "rb") as fp:
+        data = fp.read()
+    idle = _peak_rss_bytes()
+    upload = asyncio.run(_spool(data, name))
+    try:
+        asyncio.run(_extract_spooled(upload.path))
+    finally:
+        upload.close()
+    # Workers are only counted in RUSAGE_CHILDREN once they have exited
+    shutdown_executor(wait=True)
+    print(json.dumps({
+        "idle_rss_bytes": idle,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "worker_peak_rss_bytes": _max_rss_bytes(resource.RUSAGE_CHILDREN) or None,
+    }))
+
+
+def measure(name: str, kind: str, data: bytes, repeats: int) -> dict:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        layout = extract_layout(data)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+
+    tracemalloc.start()
+    extract_layout(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    dump_timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        serialized = layout.model_dump_json()
+        dump_timings.append(time.perf_counter() - start)
+
+    pages = len(layout.pages)
+    lines = sum(len(page.lines) for page in layout.pages)
+    words = sum(len(line.words) for page in layout.pages for line in page.lines)
+    return {
+        "case": name,
+        "kind": kind,
+        "input_bytes": len(data),
+        "pages": pages,
+        "lines": lines,
+        "words": words,
+        "extract_seconds": best,
+        "pages_per_sec": pages / best,
+        "words_per_sec": words / best if words else None,
+        "lines_per_sec": lines / best,
+        "peak_memory_bytes": peak,
+        "dump_json_seconds": min(dump_timings),
+        "layout_json_bytes": len(serialized),
+        **measure_spooled(name, data, repeats),
+        **measure_rss(name, data),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def load_baseline(path: str) -> dict:
+    with open(path) as fp:
+        return {r["case"]: r for r in json.load(fp)["results"]}
+
+
+def compare(results: dict, baseline: dict, baseline_path: str):
+    print(f"\nCompared with {baseline_path}:")
+    for r in results["results"]:
+        old = baseline.get(r["case"])
+        if not old:
+            continue
+        speed = old["extract_seconds"] / r["extract_seconds"]
+        memory = r["peak_memory_bytes"] / old["peak_memory_bytes"]
+        line = f"  {r['case']:<18} speedup x{speed:.2f}  peak memory x{memory:.2f}"
+        # Results from before the upload path was measured lack these
+        if old.get("aiter_seconds"):
+            line += f"  upload path speedup x{old['aiter_seconds'] / r['aiter_seconds']:.2f}"
+        if old.get("aiter_compact_seconds"):
+            line += f"  compact speedup x{old['aiter_compact_seconds'] / r['aiter_compact_seconds']:.2f}"
+        if old.get("peak_rss_bytes") and r.get("peak_rss_bytes"):
+            line += f"  peak RSS x{r['peak_rss_bytes'] / old['peak_rss_bytes']:.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="JSON results path (default: benchmarks/results/extract-<commit>.json)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="only run the small cases")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--rss-case", help=argparse.SUPPRESS)
+    parser.add_argument("--rss-name", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.rss_case:
+        rss_case(args.rss_case, args.rss_name)
+        return
+    # Read the baseline first: it may be the file this run overwrites
+    baseline = load_baseline(args.compare) if args.compare else None
+
+    cases = [(name, "pdf", lambda spec=spec: make_pdf(*spec)) for name, *spec in PDF_CASES]
+    cases += [(name, "text", lambda lines=lines: make_text(lines)) for name, lines in TEXT_CASES]
+    if args.quick:
+        cases = [case for case in cases if case[0] in ("pdf-small", "text-short")]
+
+    commit = git_commit()
+    results = {
+        "meta": {
+            "commit": commit,
+            "extractor_version": EXTRACTOR_VERSION,
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "extract_workers": EXTRACT_WORKERS,
+            "pymupdf": fitz.VersionBind,
+        },
+        "results": [],
+    }
+    for name, kind, build in cases:
+        result = measure(name, kind, build(), args.repeats)
+        results["results"].append(result)
+        rss = result.get("peak_rss_bytes")
+        print(f"{name:<18} {result['pages']:>5} pages  {result['pages_per_sec']:>9.1f} pages/s  "
+              f"{(result['words_per_sec'] or 0):>11.0f} words/s  "
+              f"upload path {result['aiter_pages_per_sec']:>9.1f} pages/s  "
+              f"compact {result['aiter_compact_pages_per_sec']:>9.1f} pages/s  "
+              f"peak {result['peak_memory_bytes'] / 1e6:>7.1f} MB  "
+              f"rss {(rss or 0) / 1e6:>7.1f} MB  "
+              f"json {result['layout_json_bytes'] / 1e6:>7.2f} MB")
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", f"extract-{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump(results, fp, indent=2)
+    print(f"\nResults written to {output}")
+
+    if baseline is not None:
+        compare(results, baseline, args.compare)
+
+
+if __name__ == "__main__":
+    main()
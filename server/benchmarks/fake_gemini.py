@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Deterministic fake Gemini API for offline load and latency testing.
+
+Serves ``POST /v1beta/models/{model}:generateContent`` with the request and
+response shapes of the real API, so the app talks to it through the normal
+SDK and ``GeminiClient`` code paths. Run from the server directory:
+
+    python -m benchmarks.fake_gemini --port 8090 --latency lognormal:0.8,0.4 --error-rate 0.02 --rpm 300
+
+and start the app against it:
+
+    GEMINI_API_KEY=fake GEMINI_API_ENDPOINT=http://localhost:8090 uvicorn app:app
+
+Responses are canned JSON derived from a hash of the prompt, so the same
+document always gets the same analysis. Latency, injected errors and
+random throttling are drawn from a generator seeded with the prompt and the
+number of times that prompt was seen, so a run is reproducible regardless
+of how concurrent requests interleave, and retries can succeed. Quota
+throttling (``--rpm``, ``--max-concurrency``) depends on timing like the
+real service. ``GET /stats`` reports what the server saw; ``POST /reset``
+clears it.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.rate_limiter import TokenBucket, estimate_tokens  # noqa: E402
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Parse a latency distribution: ``fixed:S``, ``uniform:LO,HI``,
+    ``normal:MEAN,SD``, ``lognormal:MEDIAN,SIGMA`` or ``exp:MEAN`` (seconds)."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    distributions = {
+        "fixed": (1, lambda rnd, s: s),
+        "uniform": (2, lambda rnd, lo, hi: rnd.uniform(lo, hi)),
+        "normal": (2, lambda rnd, mean, sd: rnd.gauss(mean, sd)),
+        "lognormal": (2, lambda rnd, median, sigma: median * rnd.lognormvariate(0.0, sigma)),
+        "exp": (1, lambda rnd, mean: rnd.expovariate(1.0 / mean) if mean > 0 else 0.0),
+    }
+    if kind not in distributions or len(values) != distributions[kind][0]:
+        raise ValueError(f"Invalid latency distribution: {spec}")
+    sample = distributions[kind][1]
+    return lambda rnd: max(0.0, sample(rnd, *values))
+
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+def _unit(text: str, salt: str) -> float:
+    """Deterministic value in [0, 1) for a text"""
+    return _digest(f"{salt}:{text}") / 2.0 ** 64
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[A-Za-z][A-Za-z']+", text)
+
+
+def line_analysis(text: str) -> Dict[str, Any]:
+    words = _words(text)
+    keywords = sorted(set(words), key=lambda w: (-len(w), w))[:3]
+    names = [w for w in words[1:] if w[0].isupper()]
+    return {
+        "importance_score": round(_unit(text, "importance"), 3),
+        "character": names[0] if names and '"' in text else None,
+        "key_concepts": list(dict.fromkeys(names))[:3],
+        "reading_difficulty": round(_unit(text, "difficulty"), 3),
+        "keywords": keywords,
+    }
+
+
+def _quoted(prompt: str, label: str) -> str:
+    match = re.search(rf'{label}: "(.*)"', prompt)
+    return match.group(1) if match else ""
+
+
+def canned_response(prompt: str) -> str:
+    """Response text for one of the app's prompts, derived from the prompt"""
+    if "Lines (JSON array of objects with index and text):" in prompt:
+        lines = json.loads(prompt.split("index and text):", 1)[1].strip().splitlines()[0])
+        return json.dumps([{"index": line["index"], **line_analysis(line["text"])} for line in lines])
+    if "Analyze this text line" in prompt:
+        return json.dumps(line_analysis(_quoted(prompt, "Text")))
+    if "may belong to characters:" in prompt:
+        names = re.search(r"may belong to characters: (.*)", prompt).group(1)
+        return json.dumps([{"name": name, "aliases": []} for name in names.split(", ") if name])
+    if "determine:" in prompt and "Genre" in prompt:
+        sample = _quoted(prompt, "Text")
+        return json.dumps({
+            "genre": "fiction" if _unit(sample, "genre") < 0.7 else "non-fiction",
+            "reading_level": "elementary" if len(sample) < 400 else "middle school",
+            "target_age": "8-12 years",
+        })
+    if "Find connections" in prompt:
+        current = _quoted(prompt, "Current line")
+        return json.dumps([{
+            "type": "plot_progression",
+            "description": f"Continues the earlier passage: {current[:60]}",
+            "importance": round(_unit(current, "connection"), 3),
+            "visual_cue": "arrow",
+        }])
+    if "Create a detailed visual description" in prompt:
+        return f"A colorful cartoon scene showing {_quoted(prompt, 'Text')[:120]}"
+    if "description for this text" in prompt:
+        text = _quoted(prompt, "Text")
+        return json.dumps({
+            "description": f"A simple picture of {text[:100]}",
+            "style": "cartoon",
+            "colors": ["blue", "green", "yellow"],
+            "objects": _words(text)[:3],
+            "mood": "calm" if _unit(text, "mood") < 0.5 else "exciting",
+        })
+    return "{}"
+
+
+def _error(code: int, status: str, message: str) -> JSONResponse:
+    return JSONResponse({"error": {"code": code, "message": message, "status": status}}, status_code=code)
+
+
+class FakeGemini:
+    """Request handling and fault injection for the fake API"""
+
+    def __init__(self, latency: str = "fixed:0", latency_per_1k_tokens: float = 0.0,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, hang_rate: float = 0.0,
+                 hang_seconds: float = 120.0, rpm: float = 0.0, max_concurrency: int = 0,
+                 seed: int = 0):
+        self.sample_latency = parse_latency(latency)
+        self.latency_per_1k_tokens = latency_per_1k_tokens
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.rpm = rpm
+        self.max_concurrency = max_concurrency
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        self.quota = TokenBucket(self.rpm)
+        self.seen: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_latency = 0.0
+
+    async def generate(self, model: str, body: Dict[str, Any]) -> JSONResponse:
+        prompt = "".join(part.get("text", "") for content in body.get("contents", [])
+                         for part in content.get("parts", []))
+        key = _digest(f"{model}:{prompt}")
+        attempt = self.seen[key]
+        self.seen[key] += 1
+        rnd = random.Random(f"{self.seed}:{key}:{attempt}")
+
+        if not self.quota.try_acquire():
+            return self._finish(_error(429, "RESOURCE_EXHAUSTED", "Requests per minute quota exceeded"))
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            return self._finish(_error(429, "RESOURCE_EXHAUSTED", "Too many concurrent requests"))
+        if rnd.random() < self.throttle_rate:
+            return self._finish(_error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted"))
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.monotonic()
+        try:
+            tokens = estimate_tokens(prompt)
+            delay = self.sample_latency(rnd) + self.latency_per_1k_tokens * tokens / 1000
+            if rnd.random() < self.hang_rate:
+                delay = self.hang_seconds
+            await asyncio.sleep(delay)
+            if rnd.random() < self.error_rate:
+                return self._finish(_error(500, "INTERNAL", "An internal error has occurred"))
+            text = canned_response(prompt)
+            return self._finish(JSONResponse({
+                "candidates": [{
+                    "content": {"parts": [{"text": text}], "role": "model"},
+                    "finishReason": "STOP",
+                    "index": 0,
+                }],
+                "usageMetadata": {
+                    "promptTokenCount": tokens,
+                    "candidatesTokenCount": estimate_tokens(text),
+                    "totalTokenCount": tokens + estimate_tokens(text),
+                },
+                "modelVersion": model,
+            }))
+        finally:
+            self.in_flight -= 1
+            self.total_latency += time.monotonic() - start
+
+    def _finish(self, response: JSONResponse) -> JSONResponse:
+        self.statuses[response.status_code] += 1
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        requests = sum(self.statuses.values())
+        return {
+            "requests": requests,
+            "statuses": dict(self.statuses),
+            "distinct_prompts": len(self.seen),
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "avg_latency": self.total_latency / requests if requests else 0.0,
+        }
+
+
+def create_app(fake: Optional[FakeGemini] = None) -> FastAPI:
+    fake = fake or FakeGemini()
+    app = FastAPI(title="Fake Gemini API")
+    app.state.fake = fake
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, request: Request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return _error(400, "INVALID_ARGUMENT", "Invalid JSON payload")
+        return await fake.generate(model, body)
+
+    @app.get("/stats")
+    async def get_stats():
+        return fake.get_stats()
+
+    @app.post("/reset")
+    async def reset():
+        fake.reset()
+        return {"status": "reset"}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", default="fixed:0",
+                        help="fixed:S, uniform:LO,HI, normal:MEAN,SD, lognormal:MEDIAN,SIGMA or exp:MEAN")
+    parser.add_argument("--latency-per-1k-tokens", type=float, default=0.0,
+                        help="extra seconds per 1000 prompt tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests rejected with 429")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="share of requests that stall")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    parser.add_argument("--rpm", type=float, default=0.0, help="requests per minute quota (0 = none)")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="concurrent request quota (0 = none)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    fake = FakeGemini(args.latency, args.latency_per_1k_tokens, args.error_rate, args.throttle_rate,
+                      args.hang_rate, args.hang_seconds, args.rpm, args.max_concurrency, args.seed)
+    uvicorn.run(create_app(fake), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
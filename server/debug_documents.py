@@ -20,19 +20,18 @@ app.add_middleware(
 
 @app.post("/debug-documents")
 async def debug_upload(file: UploadFile = File(...), user_id: str = "demo_user"):
+    upload = None
     try:
         print(f"Received file: {file.filename}")
-        content = await file.read()
-        print(f"File size: {len(content)}")
-        
-        if not content:
-            raise HTTPException(400, "Empty file")
+        from services.upload_spool import spool_upload
+        upload = await spool_upload(file)
+        print(f"File size: {upload.size}")
         
         # Test PDF extractor
         try:
-            from services.pdf_extractor import extract_layout
+            from services.pdf_extractor import extract_layout_async
             print("PDF extractor imported successfully")
-            layout = extract_layout(content)
+            layout = await extract_layout_async(upload.path)
             print(f"Extracted layout with {len(layout.pages)} pages")
             
             # Test Gemini service
@@ -52,7 +51,7 @@ async def debug_upload(file: UploadFile = File(...), user_id: str = "demo_user")
                     return {
                         "status": "success",
                         "filename": file.filename,
-                        "file_size": len(content),
+                        "file_size": upload.size,
                         "pages": len(layout.pages),
                         "total_lines": sum(len(page.lines) for page in layout.pages),
                         "message": "All services working correctly"
@@ -67,8 +66,13 @@ async def debug_upload(file: UploadFile = File(...), user_id: str = "demo_user")
         except Exception as e:
             return {"error": f"PDF extractor error: {str(e)}"}
             
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": f"General error: {str(e)}"}
+    finally:
+        if upload is not None:
+            upload.close()
 
 if __name__ == "__main__":
     import uvicorn
@@ -19,6 +19,12 @@ class VisualizationType(str, Enum):
     ANIMATION = "animation"
 
 
+class WordDetail(str, Enum):
+    FULL = "full"        # one Word model per token
+    COMPACT = "compact"  # columnar word boxes in Page.words_compact
+    NONE = "none"        # lines only, no per-word data
+
+
 class Word(BaseModel):
     t: str
     bbox: Optional[BBox] = None
@@ -46,6 +52,9 @@ class Page(BaseModel):
     height: Optional[float] = None
     lines: List[Line] = Field(default_factory=list)
     background_image: Optional[str] = None
+    # Base64 columnar word data (see services.compact_layout) when the
+    # page was requested with WordDetail.COMPACT; lines then have no words
+    words_compact: Optional[str] = None
 
 
 class DocumentLayout(BaseModel):
@@ -55,6 +64,11 @@ class DocumentLayout(BaseModel):
     reading_level: Optional[str] = None
 
 
+class DocumentUploadResponse(DocumentLayout):
+    """Extracted layout plus the id of the job enriching it, if any"""
+    job_id: Optional[str] = None
+
+
 class TTSRequest(BaseModel):
     text: str
     voice: Optional[str] = "narrator"
@@ -1,5 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from models import DocumentLayout
+from services.analysis_cache import get_analysis_cache
+from services.gemini_client import get_gemini_client
+from services.gemini_service import get_gemini_service
+import asyncio
 
 router = APIRouter(prefix="/analyze", tags=["analyze"])
 
@@ -14,4 +18,31 @@ async def keyphrases(doc: DocumentLayout):
                     phrases.append(token)
     # Dedup and cap
     phrases = sorted(list({p.strip(',.;:') for p in phrases}))[:25]
-    return {"keyphrases": phrases}
\ No newline at end of file
+    return {"keyphrases": phrases}
+
+@router.get("/cache/stats")
+async def get_analysis_cache_stats():
+    """Get line analysis cache statistics"""
+    cache = get_analysis_cache()
+    if cache is None:
+        raise HTTPException(503, "Analysis cache unavailable")
+    return await asyncio.to_thread(cache.get_stats)
+
+@router.delete("/cache")
+async def clear_analysis_cache():
+    """Clear the line analysis cache"""
+    cache = get_analysis_cache()
+    if cache is None:
+        raise HTTPException(503, "Analysis cache unavailable")
+    await asyncio.to_thread(cache.clear)
+    return {"message": "Analysis cache cleared"}
+
+@router.get("/gemini/stats")
+async def get_gemini_stats():
+    """Get Gemini request, throttling and queue statistics"""
+    return get_gemini_client().get_stats()
+
+@router.get("/triage/stats")
+async def get_triage_stats():
+    """Get how many lines the local scorer kept away from Gemini"""
+    return get_gemini_service().get_triage_stats()
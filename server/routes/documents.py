@@ -1,81 +1,217 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from models import DocumentLayout, ADHDReadingSettings
-from services.pdf_extractor import extract_layout
-from services.gemini_service import get_gemini_service
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Any, AsyncIterator, Dict, Optional
+from models import DocumentLayout, DocumentUploadResponse, Line, Page, WordDetail, ADHDReadingSettings
+from services.pdf_extractor import aiter_pages, is_pdf
 from services.enhanced_tts import get_tts_service
 from services.solana_service import get_solana_service
 from services.mongodb_service import get_mongodb_service
+from services.layout_cache import get_layout_cache
+from services.upload_spool import SpooledUpload, spool_upload
+from services.compact_layout import set_word_detail
+from services.context_index import ContextIndex
+from services.gemini_service import get_gemini_service
+from services.enrichment_jobs import (document_event, enrich_layout, get_enrichment_job_service,
+                                      persist_document, save_document)
+from services.ws_manager import manager
+from services.visualization_scheduler import document_topic, get_visualization_scheduler
+from services.page_renderer import ZOOM_LEVELS, get_page_renderer_service, page_image_url, zoom_for_scale
+import asyncio
+import json
 import uuid
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 
-@router.post("", response_model=DocumentLayout)
-async def upload(file: UploadFile = File(...), user_id: str = "demo_user"):
-    content = await file.read()
-    if not content:
-        raise HTTPException(400, "Empty file")
-    
-    # Extract basic layout
-    layout = extract_layout(content)
-    
+# Upper bound on the page slice returned by GET /documents/{id}/pages
+MAX_PAGES_PER_REQUEST = 50
+
+async def _process_upload(upload: SpooledUpload, layout: DocumentLayout,
+                          user_id: str,
+                          words: WordDetail = WordDetail.FULL,
+                          enrich: bool = True) -> AsyncIterator[Dict[str, Any]]:
+    """Extract and enrich an upload, yielding progress events as they happen.
+
+    Each page is emitted as soon as the extractor produces it, followed by
+    per-page analysis patches and document-level metadata. Visualizations
+    are generated later, as the document is read.
+    Repeat uploads of the same file are served from the layout cache.
+    ``layout`` is filled in place so callers can return the final document;
+    ``words`` selects the per-word representation of its pages. Without
+    ``enrich`` the generator stops after extraction (unless the layout cache
+    already had the enriched document, which ends with a ``done`` event).
+    """
+    # Keep the original PDF so pages can be rendered as background images
+    source_id = None
+    if await asyncio.to_thread(is_pdf, upload.path):
+        source_id = upload.sha256
+        await asyncio.to_thread(get_page_renderer_service().store_source, upload.path, source_id)
+
+    cache = get_layout_cache()
+    cache_key = upload.sha256
+    cached = await asyncio.to_thread(cache.get, cache_key)
+    if cached is not None:
+        await asyncio.to_thread(set_word_detail, cached.pages, words)
+        for page in cached.pages:
+            layout.pages.append(page)
+            yield {"type": "page", "page": page.model_dump(mode="json")}
+        layout.characters = cached.characters
+        layout.genre = cached.genre
+        layout.reading_level = cached.reading_level
+        yield document_event(layout)
+        document_id = await save_document(layout, upload.filename, upload.size, user_id)
+        yield {"type": "done", "document_id": document_id, "cached": True}
+        return
+
+    async for page in aiter_pages(upload.path, words):
+        if source_id is not None and page.width is not None:
+            page.background_image = page_image_url(source_id, page.index, "thumbnail")
+        layout.pages.append(page)
+        yield {"type": "page", "page": page.model_dump(mode="json")}
+
+    if not enrich:
+        return
+
     # Enhance with Gemini AI analysis
     try:
-        gemini = get_gemini_service()
-        
-        # Analyze all lines for ADHD-friendly features
-        all_lines = []
-        for page in layout.pages:
-            all_lines.extend(page.lines)
-        
-        enhanced_lines = await gemini.analyze_document_content(all_lines)
-        
-        # Identify characters and genre
-        characters = await gemini.identify_characters(enhanced_lines)
-        genre_info = await gemini.determine_genre_and_reading_level(enhanced_lines)
-        
-        # Update layout with enhanced data
-        layout.characters = characters
-        layout.genre = genre_info.get("genre")
-        layout.reading_level = genre_info.get("reading_level")
-        
-        # Update pages with enhanced lines
-        line_index = 0
-        for page in layout.pages:
-            page_lines = []
-            for _ in page.lines:
-                if line_index < len(enhanced_lines):
-                    page_lines.append(enhanced_lines[line_index])
-                    line_index += 1
-            page.lines = page_lines
-        
-        # Generate visualizations for important lines
-        for page in layout.pages:
-            for line in page.lines:
-                if line.importance_score > 0.7:  # High importance lines
-                    visualization = await gemini.generate_visualization(
-                        line.text, line.index
-                    )
-                    line.visualization = visualization
-        
-        # Save to MongoDB
-        try:
-            mongodb = await get_mongodb_service()
-            document_id = await mongodb.save_document(
-                user_id=user_id,
-                document=layout,
-                file_name=file.filename,
-                file_size=len(content)
-            )
-            print(f"Document saved to MongoDB with ID: {document_id}")
-        except Exception as db_error:
-            print(f"Error saving to MongoDB: {db_error}")
-            # Continue without failing the upload
-        
+        failures = {}
+        async for event in enrich_layout(layout, words, failures=failures):
+            yield event
+        document_id = await persist_document(layout, cache_key, words,
+                                             upload.filename, upload.size, user_id, failures)
+        yield {"type": "done", "document_id": document_id}
+
     except Exception as e:
         print(f"Error enhancing document with AI: {e}")
-        # Return basic layout if AI enhancement fails
-    
-    return layout
+        # The basic layout has already been delivered
+        yield {"type": "done", "document_id": None, "error": str(e)}
+
+@router.post("", response_model=DocumentUploadResponse)
+async def upload(file: UploadFile = File(...), user_id: str = "demo_user",
+                 words: WordDetail = WordDetail.FULL, wait: bool = False,
+                 session_id: Optional[str] = None):
+    """Upload a document and return its extracted layout.
+
+    AI enrichment runs as a background job whose id is returned with the
+    layout; its progress is published to WebSocket sessions subscribed to the
+    job (``session_id`` subscribes a connected one). With ``wait`` the
+    request instead returns only once the document is fully enriched.
+    """
+    upload = await spool_upload(file)
+    layout = DocumentLayout(pages=[])
+    finished = False
+    try:
+        async for event in _process_upload(upload, layout, user_id, words, enrich=wait):
+            finished = event["type"] == "done"
+    finally:
+        upload.close()
+
+    job_id = None
+    if not finished:
+        jobs = get_enrichment_job_service()
+        job_id = await jobs.submit(layout, user_id, words, file_name=upload.filename,
+                                   file_size=upload.size, cache_key=upload.sha256)
+        if session_id:
+            manager.subscribe(session_id, jobs.topic(job_id))
+
+    return DocumentUploadResponse(**layout.model_dump(), job_id=job_id)
+
+@router.post("/stream")
+async def upload_stream(file: UploadFile = File(...), user_id: str = "demo_user",
+                        words: WordDetail = WordDetail.FULL):
+    """Upload a document and stream its layout as newline-delimited JSON.
+
+    Emits ``page`` events as pages are extracted, then ``lines`` and
+    ``document`` patches as enrichment completes, and a final ``done``.
+    """
+    upload = await spool_upload(file)
+
+    async def events():
+        layout = DocumentLayout(pages=[])
+        async for event in _process_upload(upload, layout, user_id, words):
+            yield json.dumps(event) + "\n"
+
+    # Removed once the response is over, even if the client left before
+    # the stream started
+    return StreamingResponse(events(), media_type="application/x-ndjson",
+                             background=BackgroundTask(upload.close))
+
+@router.get("/jobs/{job_id}")
+async def get_enrichment_job(job_id: str, include_layout: bool = False):
+    """Get the state of an enrichment job, optionally with its latest layout checkpoint"""
+    job = await get_enrichment_job_service().get_job(job_id, include_layout)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
+@router.delete("/jobs/{job_id}")
+async def cancel_enrichment_job(job_id: str):
+    """Cancel a queued or running enrichment job"""
+    jobs = get_enrichment_job_service()
+    if await jobs.get_job(job_id) is None:
+        raise HTTPException(404, "Job not found")
+    if not await jobs.cancel(job_id):
+        raise HTTPException(409, "Job already finished")
+    return {"status": "cancelled"}
+
+@router.websocket("/jobs/{job_id}/ws")
+async def enrichment_job_websocket(websocket: WebSocket, job_id: str):
+    """WebSocket streaming the events of one enrichment job"""
+    jobs = get_enrichment_job_service()
+    session_id = f"job_{uuid.uuid4().hex}"
+    await manager.connect(session_id, websocket)
+    manager.subscribe(session_id, jobs.topic(job_id))
+    try:
+        await manager.send_json(session_id, {"type": "job", "job": await jobs.get_job(job_id)})
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await manager.disconnect(session_id)
+
+@router.get("/cache/stats")
+async def get_layout_cache_stats():
+    """Get layout cache statistics"""
+    return get_layout_cache().get_stats()
+
+@router.delete("/cache")
+async def clear_layout_cache():
+    """Clear the layout cache"""
+    await asyncio.to_thread(get_layout_cache().clear)
+    return {"status": "cache_cleared"}
+
+@router.get("/sources/{source_id}/pages/{page_index}/image")
+async def get_page_image(source_id: str, page_index: int, zoom: Optional[str] = None,
+                         scale: Optional[float] = Query(None, gt=0)):
+    """Render a page of the original PDF as WebP.
+
+    ``zoom`` picks one of the fixed levels (thumbnail, medium, full); a
+    ``scale`` is snapped to the smallest level that covers it.
+    """
+    if zoom is None:
+        zoom = zoom_for_scale(scale) if scale is not None else "medium"
+    if zoom not in ZOOM_LEVELS:
+        raise HTTPException(400, f"Unknown zoom level: {zoom}")
+
+    renderer = get_page_renderer_service()
+    try:
+        path = await renderer.render(source_id, page_index, zoom)
+    except Exception as e:
+        raise HTTPException(500, f"Page rendering failed: {str(e)}")
+    if path is None:
+        raise HTTPException(404, "Page not found")
+
+    return FileResponse(path, media_type="image/webp", headers={
+        # Renders are addressed by content hash, so they never change
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{source_id}-{page_index}-{zoom}"',
+    })
+
+@router.get("/sources/render/stats")
+async def get_render_stats():
+    """Get page render cache statistics"""
+    return get_page_renderer_service().get_stats()
 
 @router.post("/{document_id}/settings")
 async def update_reading_settings(document_id: str, settings: ADHDReadingSettings):
@@ -123,6 +259,123 @@ async def get_document(document_id: str, user_id: str):
         print(f"Error getting document: {e}")
         return {"document_id": document_id, "document": None}
 
+@router.get("/{document_id}/manifest")
+async def get_document_manifest(document_id: str, user_id: str):
+    """Get page count, per-page line counts and characters without loading pages"""
+    mongodb = await get_mongodb_service()
+    manifest = await mongodb.get_document_manifest(document_id, user_id)
+    if manifest is None:
+        raise HTTPException(404, "Document not found")
+    return {"document_id": document_id, "manifest": manifest}
+
+@router.get("/{document_id}/pages")
+async def get_document_pages(document_id: str, user_id: str,
+                             start: int = Query(0, ge=0),
+                             count: int = Query(5, ge=1, le=MAX_PAGES_PER_REQUEST),
+                             words: Optional[WordDetail] = None):
+    """Get a slice of a document's pages, optionally converting the word representation.
+
+    Fetching pages has no side effects; readers report their position with
+    ``/position`` (or the document WebSocket) to get visualizations.
+    """
+    mongodb = await get_mongodb_service()
+    document = await mongodb.get_document_pages(document_id, user_id, start, count)
+    if document is None:
+        raise HTTPException(404, "Document not found")
+
+    pages = document["pages"]
+    if words is not None:
+        models = [Page.model_validate(page) for page in pages]
+        set_word_detail(models, words)
+        pages = [page.model_dump() for page in models]
+
+    return {
+        "document_id": document_id,
+        "start": start,
+        "count": len(pages),
+        "page_count": document["page_count"],
+        "pages": pages,
+    }
+
+async def _update_reading_position(document_id: str, user_id: str, page: int,
+                                   session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    window = await get_visualization_scheduler().update_position(document_id, user_id, page, session_id)
+    if window is not None and session_id:
+        manager.subscribe(session_id, document_topic(document_id))
+    return window
+
+@router.post("/{document_id}/position")
+async def update_reading_position(document_id: str, user_id: str, page: int = Query(..., ge=0),
+                                  session_id: Optional[str] = None):
+    """Report the page being read.
+
+    Visualizations are generated for the important lines of the pages
+    around it; work on pages the reader has moved away from is cancelled.
+    Results are saved on the document and published to ``session_id`` (or
+    the document WebSocket) as ``visualization`` events.
+    """
+    window = await _update_reading_position(document_id, user_id, page, session_id)
+    if window is None:
+        raise HTTPException(404, "Document not found")
+    return {"document_id": document_id, "page": page, **window}
+
+@router.websocket("/{document_id}/ws")
+async def document_websocket(websocket: WebSocket, document_id: str, user_id: str):
+    """WebSocket for reading a document.
+
+    The client sends ``{"page": n}`` as the reader moves and receives
+    ``visualization`` events for the pages around it.
+    """
+    scheduler = get_visualization_scheduler()
+    session_id = f"reader_{uuid.uuid4().hex}"
+    await manager.connect(session_id, websocket)
+    try:
+        while True:
+            message = await websocket.receive_json()
+            page = message.get("page") if isinstance(message, dict) else None
+            if not isinstance(page, int) or page < 0:
+                await manager.send_json(session_id, {"type": "error", "error": "Expected {\"page\": n}"})
+                continue
+            window = await _update_reading_position(document_id, user_id, page, session_id)
+            if window is None:
+                await manager.send_json(session_id, {"type": "error", "error": "Document not found"})
+            else:
+                await manager.send_json(session_id, {"type": "position", "page": page, **window})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        scheduler.leave(document_id, session_id)
+        await manager.disconnect(session_id)
+
+@router.get("/visualizations/stats")
+async def get_visualization_stats():
+    """Get lazy visualization scheduling statistics"""
+    return get_visualization_scheduler().get_stats()
+
+@router.get("/{document_id}/pages/{page_index}/lines/{line_index}/connections")
+async def get_reading_connections(document_id: str, page_index: int, line_index: int, user_id: str):
+    """Connections between a line and the earlier passages most relevant to it"""
+    mongodb = await get_mongodb_service()
+    document = await mongodb.get_document_context(document_id, user_id)
+    if document is None:
+        raise HTTPException(404, "Document not found")
+
+    pages = document["pages"]
+    page_position = next((i for i, page in enumerate(pages) if page["index"] == page_index), None)
+    if page_position is None or not 0 <= line_index < len(pages[page_position]["lines"]):
+        raise HTTPException(404, "Line not found")
+    # The index addresses lines by position in document order
+    position = sum(len(page["lines"]) for page in pages[:page_position]) + line_index
+    lines = [Line.model_validate(line) for page in pages for line in page["lines"]]
+
+    context_index = None
+    if document.get("context_index"):
+        context_index = await asyncio.to_thread(ContextIndex.from_base64, document["context_index"])
+    connections = await get_gemini_service().generate_reading_connections(
+        lines[position], lines[:position], context_index)
+    return {"document_id": document_id, "page_index": page_index, "line_index": line_index,
+            "connections": connections}
+
 @router.get("/user/{user_id}/stats")
 async def get_user_stats(user_id: str):
     """Get user statistics"""
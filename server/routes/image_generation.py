@@ -13,6 +13,7 @@ class ImageGenerationRequest(BaseModel):
     line_index: int
     context: str = None
     style: str = "cartoon"
+    document_id: str = None
 
 @router.post("/generate")
 async def generate_image_for_line(request: ImageGenerationRequest):
@@ -23,7 +24,8 @@ async def generate_image_for_line(request: ImageGenerationRequest):
             line_text=request.line_text,
             line_index=request.line_index,
             context=request.context,
-            style=request.style
+            style=request.style,
+            document_id=request.document_id
         )
         return result
         
@@ -89,6 +91,7 @@ async def image_generation_websocket(websocket: WebSocket, session_id: str):
                     line_index = data.get('line_index', 0)
                     context = data.get('context')
                     style = data.get('style', 'cartoon')
+                    document_id = data.get('document_id')
                     
                     # Generate image
                     image_service = get_image_generator_service()
@@ -96,7 +99,8 @@ async def image_generation_websocket(websocket: WebSocket, session_id: str):
                         line_text=line_text,
                         line_index=line_index,
                         context=context,
-                        style=style
+                        style=style,
+                        document_id=document_id
                     )
                     
                     # Send result back to client
@@ -1,9 +1,26 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import Any, Dict, List
 from models import VisualizationRequest, VisualizationResponse
 from services.gemini_service import get_gemini_service
+from services.near_duplicates import get_visualization_reuse_index
+import asyncio
+import json
+import os
 
 router = APIRouter(prefix="/visualizations", tags=["visualizations"])
 
+# Items of one batch generated at the same time
+VISUALIZATION_BATCH_CONCURRENCY = int(os.getenv("VISUALIZATION_BATCH_CONCURRENCY", "8"))
+
+def _visualization_response(visualization_data: Dict[str, Any]) -> VisualizationResponse:
+    return VisualizationResponse(
+        image_url=visualization_data.get("image_url"),
+        video_url=visualization_data.get("video_url"),
+        description=visualization_data.get("description", ""),
+        confidence=visualization_data.get("confidence", 0.5)
+    )
+
 @router.post("", response_model=VisualizationResponse)
 async def generate_visualization(req: VisualizationRequest):
     """Generate visual content to help with comprehension"""
@@ -13,39 +30,72 @@ async def generate_visualization(req: VisualizationRequest):
             req.text, req.line_index, req.visualization_type, req.context
         )
         
-        return VisualizationResponse(
-            image_url=visualization_data.get("image_url"),
-            video_url=visualization_data.get("video_url"),
-            description=visualization_data.get("description", ""),
-            confidence=visualization_data.get("confidence", 0.5)
-        )
+        return _visualization_response(visualization_data)
         
     except Exception as e:
         raise HTTPException(500, f"Visualization generation failed: {str(e)}")
 
 @router.post("/batch")
-async def generate_batch_visualizations(requests: list[VisualizationRequest]):
-    """Generate multiple visualizations in batch"""
+async def generate_batch_visualizations(requests: list[VisualizationRequest], stream: bool = False):
+    """Generate multiple visualizations in batch.
+
+    Items run concurrently and identical requests are generated once. With
+    ``stream``, each result is sent as a line of NDJSON (``index`` plus
+    ``visualization``, or ``error``) as soon as it completes.
+    """
+    if stream:
+        async def events():
+            async for indices, result in _run_batch(requests):
+                for index in indices:
+                    if isinstance(result, Exception):
+                        event = {"index": index, "error": str(result)}
+                    else:
+                        event = {"index": index, "visualization": result.model_dump()}
+                    yield json.dumps(event) + "\n"
+
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    results: List[Any] = [None] * len(requests)
+    async for indices, result in _run_batch(requests):
+        for index in indices:
+            results[index] = result
+    for result in results:
+        if isinstance(result, Exception):
+            raise HTTPException(500, f"Batch visualization generation failed: {str(result)}")
+    return {"visualizations": results}
+
+async def _run_batch(requests: List[VisualizationRequest]):
+    """Yield ``(indices, response or exception)`` per distinct request, in completion order"""
+    gemini = get_gemini_service()
+    semaphore = asyncio.Semaphore(VISUALIZATION_BATCH_CONCURRENCY)
+    groups: Dict[tuple, List[int]] = {}
+    for index, req in enumerate(requests):
+        groups.setdefault((req.text, req.visualization_type, req.context), []).append(index)
+
+    async def run(indices: List[int]):
+        req = requests[indices[0]]
+        try:
+            async with semaphore:
+                visualization_data = await gemini.generate_visualization(
+                    req.text, req.line_index, req.visualization_type, req.context
+                )
+            return indices, _visualization_response(visualization_data)
+        except Exception as e:
+            return indices, e
+
+    tasks = [asyncio.ensure_future(run(indices)) for indices in groups.values()]
     try:
-        gemini = get_gemini_service()
-        results = []
-        
-        for req in requests:
-            visualization_data = await gemini.generate_visualization(
-                req.text, req.line_index, req.visualization_type, req.context
-            )
-            
-            results.append(VisualizationResponse(
-                image_url=visualization_data.get("image_url"),
-                video_url=visualization_data.get("video_url"),
-                description=visualization_data.get("description", ""),
-                confidence=visualization_data.get("confidence", 0.5)
-            ))
-        
-        return {"visualizations": results}
-        
-    except Exception as e:
-        raise HTTPException(500, f"Batch visualization generation failed: {str(e)}")
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Only left early when the client went away
+        for task in tasks:
+            task.cancel()
+
+@router.get("/reuse/stats")
+async def get_visualization_reuse_stats():
+    """How often near-duplicate lines reused an existing visualization"""
+    return get_visualization_reuse_index().get_stats()
 
 @router.get("/styles")
 async def get_visualization_styles():
@@ -0,0 +1,198 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", "cache/analysis.sqlite3")
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+ANALYSIS_CACHE_HOT_ENTRIES = int(os.getenv("ANALYSIS_CACHE_HOT_ENTRIES", "10000"))
+
+# SQLite limits the number of host parameters in one statement
+_LOOKUP_CHUNK = 500
+
+
+def normalize_line_text(text: str) -> str:
+    """Normalize line text so trivially different copies share an entry"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def analysis_key(text: str, model_name: str, prompt_version: str) -> str:
+    """Cache key for the analysis of one line of text"""
+    material = f"{model_name}\0{prompt_version}\0{normalize_line_text(text)}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class AnalysisCacheService:
+    """Persistent cache of per-line analysis results.
+
+    Entries live in a SQLite table with least-recently-used eviction once the
+    stored bytes exceed the limit, and expire after a TTL. A small in-memory
+    LRU in front of it serves repeated lines without touching the disk.
+    """
+
+    def __init__(self, path: str = ANALYSIS_CACHE_PATH,
+                 max_bytes: int = ANALYSIS_CACHE_MAX_BYTES,
+                 ttl: int = ANALYSIS_CACHE_TTL_SECONDS,
+                 hot_entries: int = ANALYSIS_CACHE_HOT_ENTRIES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hot_entries = hot_entries
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.hot_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS analyses_accessed ON analyses (accessed)")
+        self._db.commit()
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+
+    def _remember(self, key: str, value: Dict[str, Any], created: float):
+        self._hot[key] = (created, value)
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Look up several keys at once; returns only the keys that were found"""
+        found = {}
+        with self._lock:
+            now = time.time()
+            oldest = now - self.ttl
+            cold = []
+            for key in dict.fromkeys(keys):
+                entry = self._hot.get(key)
+                if entry is None or entry[0] < oldest:
+                    cold.append(key)
+                else:
+                    self._hot.move_to_end(key)
+                    found[key] = entry[1]
+                    self.hot_hits += 1
+
+            for start in range(0, len(cold), _LOOKUP_CHUNK):
+                chunk = cold[start:start + _LOOKUP_CHUNK]
+                rows = self._db.execute(
+                    f"SELECT key, value, created FROM analyses WHERE created >= ? AND key IN ({','.join('?' * len(chunk))})",
+                    [oldest, *chunk]).fetchall()
+                for key, value, created in rows:
+                    found[key] = json.loads(value)
+                    self._remember(key, found[key], created)
+                self._db.executemany("UPDATE analyses SET accessed = ? WHERE key = ?",
+                                     [(now, row[0]) for row in rows])
+                self.hits += len(rows)
+                self.misses += len(chunk) - len(rows)
+            if cold:
+                self._db.commit()
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Store analysis results and evict old entries if over the limit"""
+        rows = []
+        now = time.time()
+        with self._lock:
+            for key, value in items:
+                data = json.dumps(value, ensure_ascii=False)
+                rows.append((key, data, len(data), now, now))
+                self._remember(key, value, now)
+            if not rows:
+                return
+            keys = [row[0] for row in rows]
+            for start in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[start:start + _LOOKUP_CHUNK]
+                self._bytes -= self._db.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM analyses WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchone()[0]
+            self._db.executemany("INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?)", rows)
+            self._bytes += sum(row[2] for row in rows)
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float):
+        """Drop expired entries, then least recently used ones over the limit"""
+        expired = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analyses WHERE created < ?",
+                                   (now - self.ttl,)).fetchone()
+        if expired[0]:
+            self._db.execute("DELETE FROM analyses WHERE created < ?", (now - self.ttl,))
+            self.evictions += expired[0]
+            self._bytes -= expired[1]
+
+        if self._bytes <= self.max_bytes:
+            return
+        # Trim to 90% of the limit so eviction does not run on every insert
+        target = self._bytes - int(self.max_bytes * 0.9)
+        victims: List[str] = []
+        freed = 0
+        for key, size in self._db.execute("SELECT key, size FROM analyses ORDER BY accessed"):
+            victims.append(key)
+            freed += size
+            if freed >= target:
+                break
+        self._db.executemany("DELETE FROM analyses WHERE key = ?", [(key,) for key in victims])
+        for key in victims:
+            self._hot.pop(key, None)
+        self.evictions += len(victims)
+        self._bytes -= freed
+
+    def clear(self):
+        """Remove all cached analyses"""
+        with self._lock:
+            self._db.execute("DELETE FROM analyses")
+            self._db.commit()
+            self._hot.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            lookups = self.hits + self.hot_hits + self.misses
+            return {
+                "entries": entries,
+                "hot_entries": len(self._hot),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits + self.hot_hits,
+                "hot_hits": self.hot_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.hot_hits) / lookups if lookups else 0.0,
+            }
+
+
+# Global instance
+analysis_cache_service = None
+
+def get_analysis_cache() -> Optional[AnalysisCacheService]:
+    """Get the analysis cache, or None if it could not be opened"""
+    global analysis_cache_service
+    if analysis_cache_service is None:
+        try:
+            analysis_cache_service = AnalysisCacheService()
+        except sqlite3.Error as e:
+            print(f"Analysis cache disabled: {e}")
+            return None
+    return analysis_cache_service
@@ -0,0 +1,103 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def json_size(value: Any) -> int:
+    """Approximate memory cost of a value: the length of its JSON encoding"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class BoundedCache:
+    """Thread-safe in-memory LRU cache bounded by entries and bytes, with a TTL.
+
+    Each entry's size is computed once on insert (``sizeof``, or the size
+    passed to ``put``). Entries older than ``ttl`` seconds are treated as
+    missing and dropped when seen. A limit of 0 or None disables it.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, sizeof: Callable[[Any], int] = json_size):
+        self.max_entries = max_entries or None
+        self.max_bytes = max_bytes or None
+        self.ttl = ttl or None
+        self.sizeof = sizeof
+        # key -> (created, size, value)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and entry[0] < time.time() - self.ttl:
+                self._discard(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None,
+            created: Optional[float] = None):
+        """Store a value; ``created`` backdates it for TTL purposes (wall-clock time)"""
+        size = self.sizeof(value) if size is None else size
+        with self._lock:
+            self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Would evict everything else and still not fit
+                return
+            self._entries[key] = (time.time() if created is None else created, size, value)
+            self._bytes += size
+            while ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                   or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._discard(key)
+            return default if entry is None else entry[2]
+
+    def _discard(self, key: Hashable) -> Optional[tuple]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,195 @@
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Set
+
+from services.rate_limiter import estimate_tokens
+from services.readability import familiar_words
+
+
+# Character identification reads the document in chunks of about this many
+# tokens; a chunk is only sent to Gemini when it names someone new
+CHARACTER_CHUNK_TOKENS = int(os.getenv("CHARACTER_CHUNK_TOKENS", "3000"))
+
+_TITLES = {"mr", "mrs", "ms", "miss", "dr", "sir", "madam", "lady", "lord", "aunt", "uncle",
+           "captain", "professor", "king", "queen", "prince", "princess", "mister"}
+_NOT_NAMES = {"i", "chapter", "part", "book", "the", "a", "an", "and", "but", "or", "he", "she",
+              "it", "they", "we", "you", "his", "her", "their", "our", "my", "this", "that",
+              "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+              "january", "february", "march", "april", "june", "july", "august",
+              "september", "october", "november", "december"}
+_SPEECH_VERBS = "said|asked|replied|shouted|whispered|cried|called|answered|exclaimed|muttered"
+_NAME_RUN = r"[A-Z][a-z]+(?:\.?\s+[A-Z][a-z]+)*"
+
+_SENTENCE = re.compile(r"(?<!Mr\.)(?<!Mrs\.)(?<!Ms\.)(?<!Dr\.)(?<=[.!?])[\"”']?\s+")
+_CAPITALIZED_RUN = re.compile(_NAME_RUN)
+_SPEAKER = re.compile(rf"\b(?:{_SPEECH_VERBS})\s+({_NAME_RUN})|({_NAME_RUN})\s+(?:{_SPEECH_VERBS})\b")
+_LEADING_PUNCTUATION = " \"“'‘(—-"
+
+
+def _name_words(name: str) -> List[str]:
+    return [w.strip(".").lower() for w in name.split()]
+
+
+def name_tokens(name: str) -> frozenset:
+    """Lowercase words of a name, without titles"""
+    return frozenset(w for w in _name_words(name) if w not in _TITLES)
+
+
+def _is_name(words: List[str]) -> bool:
+    """Whether a run of capitalized words can be a name rather than a common word"""
+    known = familiar_words()
+    rest = [w for w in words if w not in _TITLES]
+    if not rest or any(w in _NOT_NAMES for w in rest):
+        return False
+    return len(words) > len(rest) or len(rest) > 1 or rest[0] not in known
+
+
+def _clean(name: str) -> str:
+    return " ".join(name.split())
+
+
+class Candidates(NamedTuple):
+    """Locally found names: per line, plus document-wide mention counts.
+
+    ``strong`` names were seen mid-sentence, after a title or next to a
+    speech verb. A capitalized word that starts a sentence is only trusted
+    when the same name also appears as a strong candidate somewhere.
+    """
+    strong: List[Set[str]]
+    weak: List[Set[str]]
+    mentions: Counter
+
+
+def find_candidates(texts: List[str]) -> Candidates:
+    """Cheap, regex-only pass for names that may be characters"""
+    strong: List[Set[str]] = []
+    weak: List[Set[str]] = []
+    mentions: Counter = Counter()
+    for text in texts:
+        line_strong, line_weak = set(), set()
+        for match in _SPEAKER.finditer(text):
+            name = _clean(match.group(1) or match.group(2))
+            if _is_name(_name_words(name)):
+                line_strong.add(name)
+        for sentence in _SENTENCE.split(text):
+            sentence = sentence.lstrip(_LEADING_PUNCTUATION)
+            for match in _CAPITALIZED_RUN.finditer(sentence):
+                name = _clean(match.group())
+                words = _name_words(name)
+                if match.start() == 0 and words[0] not in _TITLES:
+                    # A sentence-initial capital proves nothing about the first word
+                    if len(words) == 1:
+                        if _is_name(words):
+                            line_weak.add(name)
+                        continue
+                    if words[0] in familiar_words():
+                        name = _clean(name.split(None, 1)[1])
+                        words = words[1:]
+                if _is_name(words):
+                    line_strong.add(name)
+        for name in line_strong | line_weak:
+            mentions[name] += 1
+        strong.append(line_strong)
+        weak.append(line_weak)
+    return Candidates(strong, weak, mentions)
+
+
+class CharacterChunk(NamedTuple):
+    """A window of consecutive lines and the candidate names found in it"""
+    texts: List[str]
+    names: Set[str]
+    new_names: Set[str]
+
+
+def character_chunks(texts: List[str], candidates: Candidates,
+                     max_tokens: int = CHARACTER_CHUNK_TOKENS) -> List[CharacterChunk]:
+    """Split a document into chunks, keeping only those that introduce a name.
+
+    Chunks are considered in reading order; one whose candidate names were
+    all seen in an earlier chunk adds nothing for the model and is dropped,
+    so the number of requests follows the number of characters rather than
+    the length of the document.
+    """
+    confirmed = set().union(*candidates.strong) if texts else set()
+    confirmed_tokens = {name_tokens(name) for name in confirmed}
+
+    chunks: List[CharacterChunk] = []
+    seen: Set[frozenset] = set()
+    batch: List[str] = []
+    names: Set[str] = set()
+    budget = 0
+
+    def flush():
+        new = {name for name in names if name_tokens(name) not in seen}
+        if new:
+            chunks.append(CharacterChunk(batch, set(names), new))
+            seen.update(name_tokens(name) for name in names)
+
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if batch and budget + cost > max_tokens:
+            flush()
+            batch, names, budget = [], set(), 0
+        batch.append(text)
+        names |= candidates.strong[i]
+        names |= {name for name in candidates.weak[i] if name_tokens(name) in confirmed_tokens}
+        budget += cost
+    if batch:
+        flush()
+    return chunks
+
+
+def merge_aliases(groups: Iterable[List[str]], mentions: Dict[str, int]) -> List[str]:
+    """Reduce per-chunk character lists into one list of distinct characters.
+
+    Each group holds a name followed by its aliases. Names are merged when a
+    chunk listed them as aliases (an alias that is part of several
+    characters' names is dropped), when they differ only in titles, or when
+    one name's words are part of exactly one longer name ("Harry" into
+    "Harry Potter", but "Potter" stays put next to "Harry" and "Lily
+    Potter"). Each character is reported under its most mentioned name,
+    most mentioned characters first.
+    """
+    parent: Dict[frozenset, frozenset] = {}
+    spellings: Dict[frozenset, Set[str]] = {}
+    listed: Counter = Counter()
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    def add(name: str) -> frozenset:
+        key = name_tokens(name) or frozenset(_name_words(name))
+        parent.setdefault(key, key)
+        spellings.setdefault(key, set()).add(name)
+        listed[name] += 1
+        return key
+
+    groups = [[_clean(name) for name in group if name and name.strip()] for group in groups]
+    primaries = {name_tokens(group[0]) for group in groups if group}
+
+    for group in groups:
+        if not group:
+            continue
+        head = add(group[0])
+        for alias in group[1:]:
+            # An alias shared by several characters ("Potter") belongs to none
+            if sum(name_tokens(alias) < primary for primary in primaries) <= 1:
+                parent[find(add(alias))] = find(head)
+
+    for key in list(parent):
+        longer = {find(other) for other in parent if key < other}
+        if len(longer) == 1:
+            target = longer.pop()
+            if find(key) != target:
+                parent[find(key)] = target
+
+    merged: Dict[frozenset, Counter] = {}
+    for key, names in spellings.items():
+        for name in names:
+            merged.setdefault(find(key), Counter())[name] = mentions.get(name, 0) + listed[name]
+    ranked = sorted(merged.values(), key=lambda names: -sum(names.values()))
+    return [max(names, key=lambda name: (names[name], len(name))) for names in ranked]
@@ -0,0 +1,244 @@
+from __future__ import annotations
+import base64
+import json
+import struct
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models import Page, Line, Word, WordDetail
+
+
+_MAGIC = b"BMW1"
+
+
+class WordColumns:
+    """Word boxes of one page stored as parallel typed arrays.
+
+    Instead of one ``Word`` model per token, a page keeps:
+
+    - ``line_starts``: index of the first word of each line (plus a final end)
+    - ``offsets``/``lengths``: where each word sits inside its line's text
+    - ``boxes``: ``(n, 4)`` float64 boxes, NaN rows for words without a box
+    - ``importance`` and ``characters`` (index into ``character_names``, -1 for None)
+    - ``keywords``: keyword flags, bit-packed on the wire
+
+    Words whose text cannot be located in the line text are kept verbatim in
+    ``texts`` so the conversion back to models is always lossless.
+    """
+
+    __slots__ = ("line_starts", "offsets", "lengths", "boxes", "importance",
+                 "characters", "keywords", "character_names", "texts")
+
+    def __init__(self, line_starts, offsets, lengths, boxes, importance,
+                 characters, keywords, character_names: List[str],
+                 texts: Optional[Dict[int, str]] = None):
+        self.line_starts = line_starts
+        self.offsets = offsets
+        self.lengths = lengths
+        self.boxes = boxes
+        self.importance = importance
+        self.characters = characters
+        self.keywords = keywords
+        self.character_names = character_names
+        self.texts = texts or {}
+
+    @property
+    def word_count(self) -> int:
+        return len(self.offsets)
+
+    @classmethod
+    def from_extracted(cls, line_words: Sequence[Optional[List[Tuple[str, tuple]]]]) -> "WordColumns":
+        """Build columns straight from extractor tuples, without creating models.
+
+        Each line's text is the space-joined words, so offsets follow from the
+        word lengths alone.
+        """
+        counts = [len(words) if words else 0 for words in line_words]
+        line_starts = np.zeros(len(counts) + 1, dtype=np.int32)
+        np.cumsum(counts, out=line_starts[1:])
+        n = int(line_starts[-1])
+
+        tokens = [t for words in line_words if words for t, _ in words]
+        boxes = np.array([b for words in line_words if words for _, b in words],
+                         dtype=np.float64).reshape(n, 4)
+        return cls.from_arrays(line_starts, tokens, boxes)
+
+    @classmethod
+    def from_arrays(cls, line_starts: np.ndarray, tokens: Sequence[str], boxes: np.ndarray) -> "WordColumns":
+        """Build columns from the words of space-joined lines, in order.
+
+        ``line_starts`` holds the index of each line's first word plus a
+        final end, ``boxes`` one row per word.
+        """
+        line_starts = np.asarray(line_starts, dtype=np.int32)
+        n = len(tokens)
+        lengths = np.fromiter(map(len, tokens), dtype=np.int32, count=n)
+        # Offset of a word = sum of the previous lengths + one space each
+        offsets = np.zeros(n, dtype=np.int32)
+        if n:
+            ends = np.cumsum(lengths + 1, dtype=np.int32)
+            offsets[1:] = ends[:-1]
+            offsets -= offsets[np.repeat(line_starts[:-1], np.diff(line_starts))]
+        return cls(line_starts, offsets, lengths, np.asarray(boxes, dtype=np.float64).reshape(n, 4),
+                   importance=np.full(n, 0.5),
+                   characters=np.full(n, -1, dtype=np.int32),
+                   keywords=np.zeros(n, dtype=bool),
+                   character_names=[])
+
+    @classmethod
+    def from_lines(cls, lines: Sequence[Line]) -> "WordColumns":
+        """Pack the ``Word`` models of ``lines`` into columns."""
+        counts = [len(line.words) for line in lines]
+        line_starts = np.zeros(len(counts) + 1, dtype=np.int32)
+        np.cumsum(counts, out=line_starts[1:])
+        n = int(line_starts[-1])
+
+        offsets = np.empty(n, dtype=np.int32)
+        lengths = np.empty(n, dtype=np.int32)
+        boxes = np.full((n, 4), np.nan)
+        importance = np.empty(n)
+        characters = np.empty(n, dtype=np.int32)
+        keywords = np.empty(n, dtype=bool)
+        names: Dict[str, int] = {}
+        texts: Dict[int, str] = {}
+
+        i = 0
+        for line in lines:
+            cursor = 0
+            for word in line.words:
+                pos = line.text.find(word.t, cursor)
+                if pos < 0:
+                    texts[i] = word.t
+                    offsets[i] = lengths[i] = 0
+                else:
+                    offsets[i] = pos
+                    lengths[i] = len(word.t)
+                    cursor = pos + len(word.t)
+                if word.bbox is not None:
+                    boxes[i] = word.bbox
+                importance[i] = word.importance_score
+                characters[i] = -1 if word.character is None else names.setdefault(word.character, len(names))
+                keywords[i] = word.is_keyword
+                i += 1
+
+        return cls(line_starts, offsets, lengths, boxes, importance,
+                   characters, keywords, list(names), texts)
+
+    def to_words(self, lines: Sequence[Line]) -> List[List[Word]]:
+        """Materialize ``Word`` models for each of ``lines`` (the lines the columns were built from)."""
+        offsets = self.offsets.tolist()
+        lengths = self.lengths.tolist()
+        has_box = ~np.isnan(self.boxes).any(axis=1)
+        boxes = [tuple(b) if ok else None for b, ok in zip(self.boxes.tolist(), has_box.tolist())]
+        importance = self.importance.tolist()
+        names = self.character_names
+        characters = [names[c] if c >= 0 else None for c in self.characters.tolist()]
+        keywords = self.keywords.tolist()
+        starts = self.line_starts.tolist()
+
+        result = []
+        for li, line in enumerate(lines):
+            words = []
+            for i in range(starts[li], starts[li + 1]):
+                t = self.texts.get(i)
+                if t is None:
+                    t = line.text[offsets[i]:offsets[i] + lengths[i]]
+                words.append(Word.model_construct(
+                    t=t, bbox=boxes[i], importance_score=importance[i],
+                    character=characters[i], is_keyword=keywords[i],
+                ))
+            result.append(words)
+        return result
+
+    def to_bytes(self) -> bytes:
+        """Compact binary encoding: a small JSON header followed by raw little-endian arrays."""
+        header = json.dumps({
+            "lines": len(self.line_starts) - 1,
+            "words": self.word_count,
+            "characters": self.character_names,
+            "texts": {str(i): t for i, t in self.texts.items()},
+        }).encode()
+        return b"".join([
+            _MAGIC,
+            struct.pack("<I", len(header)),
+            header,
+            self.line_starts.astype("<i4").tobytes(),
+            self.offsets.astype("<i4").tobytes(),
+            self.lengths.astype("<i4").tobytes(),
+            self.boxes.astype("<f8").tobytes(),
+            self.importance.astype("<f8").tobytes(),
+            self.characters.astype("<i4").tobytes(),
+            np.packbits(self.keywords).tobytes(),
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "WordColumns":
+        if data[:4] != _MAGIC:
+            raise ValueError("Not a compact word encoding")
+        (header_len,) = struct.unpack_from("<I", data, 4)
+        pos = 8 + header_len
+        header = json.loads(data[8:pos])
+        n_lines, n = header["lines"], header["words"]
+
+        def take(dtype: str, count: int) -> np.ndarray:
+            nonlocal pos
+            array = np.frombuffer(data, dtype=dtype, count=count, offset=pos)
+            pos += array.nbytes
+            return array
+
+        line_starts = take("<i4", n_lines + 1)
+        offsets = take("<i4", n)
+        lengths = take("<i4", n)
+        boxes = take("<f8", n * 4).reshape(n, 4)
+        importance = take("<f8", n)
+        characters = take("<i4", n)
+        keywords = np.unpackbits(take("u1", (n + 7) // 8), count=n).astype(bool)
+        return cls(line_starts, offsets, lengths, boxes, importance, characters,
+                   keywords, header["characters"],
+                   {int(i): t for i, t in header["texts"].items()})
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.to_bytes()).decode("ascii")
+
+    @classmethod
+    def from_base64(cls, data: str) -> "WordColumns":
+        return cls.from_bytes(base64.b64decode(data))
+
+
+def compact_page_words(page: Page) -> Page:
+    """Move the page's ``Word`` models into ``page.words_compact`` (in place)."""
+    if page.words_compact is None:
+        page.words_compact = WordColumns.from_lines(page.lines).to_base64()
+        for line in page.lines:
+            line.words = []
+    return page
+
+
+def expand_page_words(page: Page) -> Page:
+    """Inverse of ``compact_page_words``: rebuild ``Word`` models (in place)."""
+    if page.words_compact is not None:
+        columns = WordColumns.from_base64(page.words_compact)
+        for line, words in zip(page.lines, columns.to_words(page.lines)):
+            line.words = words
+        page.words_compact = None
+    return page
+
+
+def strip_page_words(page: Page) -> Page:
+    """Drop all per-word data from the page (in place)."""
+    page.words_compact = None
+    for line in page.lines:
+        line.words = []
+    return page
+
+
+def set_word_detail(pages: Iterable[Page], detail: WordDetail):
+    """Convert pages to the requested per-word representation, in place."""
+    convert = {
+        WordDetail.FULL: expand_page_words,
+        WordDetail.COMPACT: compact_page_words,
+        WordDetail.NONE: strip_page_words,
+    }[detail]
+    for page in pages:
+        convert(page)
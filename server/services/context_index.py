@@ -0,0 +1,232 @@
+from __future__ import annotations
+import base64
+import json
+import os
+import struct
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from models import DocumentLayout, Line
+from services.readability import tokenize
+
+
+# Number of earlier lines retrieved as context for a reading connection
+CONTEXT_TOP_K = int(os.getenv("CONTEXT_TOP_K", "5"))
+
+# Lines without a paragraph id are grouped into paragraphs of this many lines
+CONTEXT_PARAGRAPH_LINES = int(os.getenv("CONTEXT_PARAGRAPH_LINES", "5"))
+
+# Weight of a line's paragraph score relative to its own score
+PARAGRAPH_WEIGHT = 0.5
+
+_MAGIC = b"BMX1"
+_K1 = 1.2
+_B = 0.75
+_STOP_WORDS = frozenset("""
+a about after again all also am an and any are as at be because been before being but by can
+could did do does doing down for from had has have having he her here hers him his how i if in
+into is it its just me more most my no nor not now of off on once only or other our out over own
+same she should so some such than that the their them then there these they this those through
+to too under until up very was we were what when where which while who whom why will with would
+you your
+""".split())
+
+
+def index_terms(text: str) -> List[str]:
+    """Lowercase content words of a text, with plural and possessive endings removed"""
+    terms = []
+    for word in tokenize(text):
+        word = word.lower()
+        if word.endswith("'s"):
+            word = word[:-2]
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if word not in _STOP_WORDS and len(word) > 1:
+            terms.append(word)
+    return terms
+
+
+def _postings(term_ids: np.ndarray, unit_ids: np.ndarray, units: int, weights=None):
+    """CSR postings (term pointers, units, term frequencies) from per-token ids"""
+    keys = term_ids.astype(np.int64) * units + unit_ids
+    unique, inverse = np.unique(keys, return_inverse=True)
+    tf = np.bincount(inverse, weights).astype(np.float64)
+    terms = unique // units
+    return unique % units, tf, terms
+
+
+class ContextIndex:
+    """BM25 index over the lines and paragraphs of one document.
+
+    Postings are stored per term in CSR form (``term_starts`` into the
+    ``docs``/``tf`` arrays) with line positions in document order, so
+    restricting a query to the lines before the current one is a binary
+    search per term. Paragraph postings are derived from the line postings
+    when the index is loaded.
+    """
+
+    __slots__ = ("terms", "term_starts", "docs", "tf", "line_lengths", "paragraphs",
+                 "_vocabulary", "_avg_length", "_idf", "_para_starts", "_para_docs",
+                 "_para_tf", "_para_lengths", "_para_avg_length", "_para_idf", "_para_ends")
+
+    def __init__(self, terms: List[str], term_starts: np.ndarray, docs: np.ndarray,
+                 tf: np.ndarray, line_lengths: np.ndarray, paragraphs: np.ndarray):
+        self.terms = terms
+        self.term_starts = term_starts
+        self.docs = docs
+        self.tf = tf
+        self.line_lengths = line_lengths
+        self.paragraphs = paragraphs
+        self._vocabulary = {term: i for i, term in enumerate(terms)}
+
+        n = len(line_lengths)
+        document_frequency = np.diff(term_starts)
+        self._avg_length = max(float(line_lengths.mean()), 1.0) if n else 1.0
+        self._idf = np.log1p((n - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        # Paragraph postings: the line postings summed per paragraph
+        paragraph_count = int(paragraphs.max()) + 1 if n else 0
+        per_posting_terms = np.repeat(np.arange(len(terms)), document_frequency)
+        para_docs, para_tf, para_terms = _postings(
+            per_posting_terms, paragraphs[docs], max(paragraph_count, 1), tf)
+        self._para_docs = para_docs
+        self._para_tf = para_tf
+        self._para_starts = np.searchsorted(para_terms, np.arange(len(terms) + 1))
+        self._para_lengths = np.bincount(paragraphs, line_lengths, paragraph_count)
+        self._para_avg_length = max(float(self._para_lengths.mean()), 1.0) if paragraph_count else 1.0
+        para_frequency = np.diff(self._para_starts)
+        self._para_idf = np.log1p((paragraph_count - para_frequency + 0.5) / (para_frequency + 0.5))
+        # One past the last line of each paragraph
+        self._para_ends = np.zeros(paragraph_count, dtype=np.int64)
+        np.maximum.at(self._para_ends, paragraphs, np.arange(1, n + 1))
+
+    @property
+    def line_count(self) -> int:
+        return len(self.line_lengths)
+
+    @classmethod
+    def build(cls, lines: Sequence[Line], paragraph_lines: int = CONTEXT_PARAGRAPH_LINES) -> "ContextIndex":
+        """Index lines given in document order.
+
+        Lines are grouped into paragraphs by ``paragraph_id`` where the
+        extractor set one, otherwise into runs of ``paragraph_lines``.
+        """
+        vocabulary = {}
+        term_ids, line_ids, paragraphs = [], [], []
+        line_lengths = np.zeros(len(lines), dtype=np.int32)
+        paragraph, previous_id = -1, object()
+        for position, line in enumerate(lines):
+            if line.paragraph_id is not None:
+                if line.paragraph_id != previous_id:
+                    paragraph += 1
+            elif previous_id is not None or position % max(paragraph_lines, 1) == 0:
+                paragraph += 1
+            previous_id = line.paragraph_id
+            paragraphs.append(max(paragraph, 0))
+
+            terms = index_terms(line.text)
+            line_lengths[position] = len(terms)
+            term_ids.extend(vocabulary.setdefault(term, len(vocabulary)) for term in terms)
+            line_ids.extend([position] * len(terms))
+
+        docs, tf, terms = _postings(np.array(term_ids, dtype=np.int64),
+                                    np.array(line_ids, dtype=np.int64), max(len(lines), 1))
+        term_starts = np.searchsorted(terms, np.arange(len(vocabulary) + 1))
+        return cls(list(vocabulary), term_starts.astype(np.int32), docs.astype(np.int32),
+                   tf.astype(np.int32), line_lengths, np.array(paragraphs, dtype=np.int32))
+
+    @classmethod
+    def from_layout(cls, layout: DocumentLayout) -> "ContextIndex":
+        return cls.build([line for page in layout.pages for line in page.lines])
+
+    def _scores(self, term_ids: List[int], before: int, starts: np.ndarray, docs: np.ndarray,
+                tf: np.ndarray, lengths: np.ndarray, avg_length: float, idf: np.ndarray,
+                size: int) -> np.ndarray:
+        scores = np.zeros(size)
+        for term in term_ids:
+            start, end = starts[term], starts[term + 1]
+            end = start + np.searchsorted(docs[start:end], before)
+            if start == end:
+                continue
+            units = docs[start:end]
+            freq = tf[start:end]
+            norm = _K1 * (1 - _B + _B * lengths[units] / avg_length)
+            # Units are unique within a term's postings
+            scores[units] += idf[term] * freq * (_K1 + 1) / (freq + norm)
+        return scores
+
+    def search(self, text: str, before: Optional[int] = None, k: int = CONTEXT_TOP_K) -> List[int]:
+        """Positions of the ``k`` lines before ``before`` that best match ``text``.
+
+        Each line is scored by BM25 on its own text plus a weighted BM25 score
+        of its paragraph, counting only paragraphs that end before ``before``.
+        Results are ordered best first; lines that share no term with the
+        query are never returned.
+        """
+        before = self.line_count if before is None else min(before, self.line_count)
+        term_ids = list(dict.fromkeys(self._vocabulary[t] for t in index_terms(text) if t in self._vocabulary))
+        if not term_ids or before <= 0 or k <= 0:
+            return []
+
+        scores = self._scores(term_ids, before, self.term_starts, self.docs, self.tf,
+                              self.line_lengths, self._avg_length, self._idf, before)
+        paragraphs = self.paragraphs[:before]
+        closed = int(np.searchsorted(self._para_ends, before, side="right"))
+        if closed:
+            para_scores = self._scores(term_ids, closed, self._para_starts, self._para_docs,
+                                       self._para_tf, self._para_lengths, self._para_avg_length,
+                                       self._para_idf, len(self._para_ends))
+            scores += PARAGRAPH_WEIGHT * np.where(scores > 0, para_scores[paragraphs], 0.0)
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        return [int(i) for i in candidates[np.argsort(-scores[candidates], kind="stable")]]
+
+    def to_bytes(self) -> bytes:
+        """Compact binary encoding: a JSON header with the terms followed by raw arrays."""
+        header = json.dumps({
+            "terms": self.terms,
+            "lines": self.line_count,
+            "postings": len(self.docs),
+        }).encode()
+        return b"".join([
+            _MAGIC,
+            struct.pack("<I", len(header)),
+            header,
+            self.term_starts.astype("<i4").tobytes(),
+            self.docs.astype("<i4").tobytes(),
+            self.tf.astype("<i4").tobytes(),
+            self.line_lengths.astype("<i4").tobytes(),
+            self.paragraphs.astype("<i4").tobytes(),
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ContextIndex":
+        if data[:4] != _MAGIC:
+            raise ValueError("Not a context index encoding")
+        (header_len,) = struct.unpack_from("<I", data, 4)
+        pos = 8 + header_len
+        header = json.loads(data[8:pos])
+        n_lines, n = header["lines"], header["postings"]
+
+        def take(count: int) -> np.ndarray:
+            nonlocal pos
+            array = np.frombuffer(data, dtype="<i4", count=count, offset=pos)
+            pos += array.nbytes
+            return array
+
+        term_starts = take(len(header["terms"]) + 1)
+        docs = take(n)
+        tf = take(n)
+        line_lengths = take(n_lines)
+        paragraphs = take(n_lines)
+        return cls(header["terms"], term_starts, docs, tf, line_lengths, paragraphs)
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.to_bytes()).decode("ascii")
+
+    @classmethod
+    def from_base64(cls, data: str) -> "ContextIndex":
+        return cls.from_bytes(base64.b64decode(data))
@@ -0,0 +1,149 @@
+import os
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+
+class DiskLRUCache:
+    """Size-bounded directory of files, evicted least-recently-used first.
+
+    Each entry is one file named ``<key><suffix>``. The LRU order is kept in
+    memory and persisted through file mtimes, so it survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix) or name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, name[:len(name) - len(self.suffix)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._bytes += size
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Return the path of a cached entry (marking it recently used), or None."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            self.discard(key)
+            return None
+        return path
+
+    def put(self, key: str, data: bytes) -> Optional[str]:
+        """Atomically write an entry and evict old ones beyond the size budget."""
+        if len(data) > self.max_bytes:
+            return None
+        path = self.path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing cache entry {path}: {e}")
+            return None
+
+        self._add(key, len(data))
+        return path
+
+    def put_file(self, key: str, source: str) -> Optional[str]:
+        """Store a copy of a file (a hard link where possible) unless the key is present.
+
+        Concurrent stores of the same key each write their own temporary file
+        and the last one wins; the content is the same either way.
+        """
+        path = self.path(key)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return path
+        size = os.path.getsize(source)
+        if size > self.max_bytes:
+            return None
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            try:
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing cache entry {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+
+        self._add(key, size)
+        return path
+
+    def _add(self, key: str, size: int):
+        """Account for a written entry and evict old ones beyond the size budget."""
+        with self._lock:
+            self._bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            while self._bytes > self.max_bytes and self._entries:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+                try:
+                    os.remove(self.path(old_key))
+                except OSError:
+                    pass
+
+    def discard(self, key: str):
+        with self._lock:
+            self._bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+        for key in keys:
+            self.discard(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
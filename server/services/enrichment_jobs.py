@@ -0,0 +1,395 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from models import DocumentLayout, Line, WordDetail
+from services.gemini_service import get_gemini_service
+from services.mongodb_service import get_mongodb_service
+from services.layout_cache import get_layout_cache
+from services.compact_layout import compact_page_words, expand_page_words
+from services.context_index import ContextIndex
+from services.ws_manager import manager
+
+
+ENRICHMENT_WORKERS = int(os.getenv("ENRICHMENT_WORKERS", "2"))
+ENRICHMENT_JOB_DIR = os.getenv("ENRICHMENT_JOB_DIR", "storage/jobs")
+
+# Minimum seconds between layout checkpoints while pages are analyzed
+CHECKPOINT_INTERVAL = float(os.getenv("ENRICHMENT_CHECKPOINT_SECONDS", "5"))
+
+# Enrichment runs these stages in order; a resumed job restarts at its stage.
+# Visualizations are generated later, for the pages being read.
+STAGES = ("analysis", "metadata", "save")
+
+# Share of overall progress reached at the end of each stage
+_STAGE_PROGRESS = {"analysis": 0.85, "metadata": 0.95, "save": 1.0}
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def line_patch(line: Line) -> Dict[str, Any]:
+    """Enrichment fields of a line, without the (already sent) word boxes."""
+    return {
+        "index": line.index,
+        "importance_score": line.importance_score,
+        "character": line.character,
+        "key_concepts": line.key_concepts,
+        "reading_difficulty": line.reading_difficulty,
+        "keywords": [w.t for w in line.words if w.is_keyword],
+    }
+
+def document_event(layout: DocumentLayout) -> Dict[str, Any]:
+    return {
+        "type": "document",
+        "characters": layout.characters,
+        "genre": layout.genre,
+        "reading_level": layout.reading_level,
+    }
+
+def _progress_event(stage: str, done: int = 0, total: int = 0) -> Dict[str, Any]:
+    start = _STAGE_PROGRESS[STAGES[STAGES.index(stage) - 1]] if stage != STAGES[0] else 0.0
+    share = done / total if total else 0.0
+    return {
+        "type": "progress",
+        "stage": stage,
+        "done": done,
+        "total": total,
+        "progress": round(start + (_STAGE_PROGRESS[stage] - start) * share, 3),
+    }
+
+
+async def save_document(layout: DocumentLayout, file_name: Optional[str],
+                        file_size: int, user_id: str) -> Optional[str]:
+    try:
+        mongodb = await get_mongodb_service()
+        # Built once here so reading connections can retrieve earlier context
+        context_index = await asyncio.to_thread(lambda: ContextIndex.from_layout(layout).to_base64())
+        document_id = await mongodb.save_document(
+            user_id=user_id,
+            document=layout,
+            file_name=file_name,
+            file_size=file_size,
+            context_index=context_index
+        )
+        print(f"Document saved to MongoDB with ID: {document_id}")
+        return document_id
+    except Exception as db_error:
+        print(f"Error saving to MongoDB: {db_error}")
+        # Continue without failing the upload
+        return None
+
+
+async def enrich_layout(layout: DocumentLayout, words: WordDetail = WordDetail.FULL,
+                        stage: str = STAGES[0], pages_done: int = 0,
+                        failures: Optional[Dict[str, int]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Run the AI enrichment stages over an extracted layout, in place.
+
+    Yields ``lines`` and ``document`` patches as results arrive, and a
+    ``progress`` event after each unit of work. ``stage`` and ``pages_done``
+    resume a partially enriched layout; pages may finish out of order, so
+    only a leading run of finished pages is safe to resume after. Results that fell back to defaults
+    because a model call failed are counted into ``failures`` by kind.
+    Persisting the result (the ``save`` stage) is left to the caller.
+    """
+    gemini = get_gemini_service()
+    start = STAGES.index(stage)
+
+    if start <= STAGES.index("analysis"):
+        # Analyze the remaining pages together, so short pages share
+        # requests, and send each page's patch as soon as it is done
+        pages = layout.pages[pages_done:]
+        # Keyword flags live on the words, so compact pages are expanded
+        # for the duration of their analysis only
+        for page in pages:
+            expand_page_words(page)
+        async for position, lines in gemini.analyze_pages([page.lines for page in pages], failures):
+            page = pages[position]
+            page.lines = lines
+            yield {
+                "type": "lines",
+                "page_index": page.index,
+                "lines": [line_patch(line) for line in page.lines],
+            }
+            if words == WordDetail.COMPACT:
+                compact_page_words(page)
+            pages_done += 1
+            yield _progress_event("analysis", pages_done, len(layout.pages))
+
+    if start <= STAGES.index("metadata"):
+        all_lines = [line for page in layout.pages for line in page.lines]
+        # Identify characters and genre
+        characters = await gemini.identify_characters(all_lines, failures)
+        genre_info = await gemini.determine_genre_and_reading_level(all_lines, failures)
+
+        # Update layout with enhanced data
+        layout.characters = characters
+        layout.genre = genre_info.get("genre")
+        layout.reading_level = genre_info.get("reading_level")
+        yield document_event(layout)
+        yield _progress_event("metadata", 1, 1)
+
+
+async def persist_document(layout: DocumentLayout, cache_key: Optional[str], words: WordDetail,
+                           file_name: Optional[str], file_size: int, user_id: str,
+                           failures: Optional[Dict[str, int]] = None) -> Optional[str]:
+    """Store an enriched layout in the layout cache and MongoDB.
+
+    A layout with ``failures`` (degraded by model errors) is saved for this
+    upload but not cached, so a later upload of the file is enriched again.
+    """
+    if failures:
+        print(f"Not caching degraded enrichment ({failures})")
+    elif cache_key and words != WordDetail.NONE:
+        await asyncio.to_thread(get_layout_cache().put, cache_key, layout)
+    return await save_document(layout, file_name, file_size, user_id)
+
+
+class EnrichmentJobService:
+    """Runs document enrichment in the background.
+
+    Jobs are recorded in SQLite and the layout being enriched is checkpointed
+    to disk, so queued and interrupted jobs resume from their last stage
+    after a restart. Events are published over the WebSocket manager on the
+    topic ``job:<id>``.
+    """
+
+    def __init__(self, directory: str = ENRICHMENT_JOB_DIR, workers: int = ENRICHMENT_WORKERS):
+        self.directory = directory
+        self.workers = max(1, workers)
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "jobs.sqlite3"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                pages_done INTEGER NOT NULL DEFAULT 0,
+                progress REAL NOT NULL DEFAULT 0,
+                user_id TEXT NOT NULL,
+                file_name TEXT,
+                file_size INTEGER NOT NULL DEFAULT 0,
+                cache_key TEXT,
+                words TEXT NOT NULL,
+                document_id TEXT,
+                error TEXT,
+                failures INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "failures" not in columns:
+            # Job tables created before failures were tracked
+            self._db.execute("ALTER TABLE jobs ADD COLUMN failures INTEGER NOT NULL DEFAULT 0")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelled = set()
+
+    def topic(self, job_id: str) -> str:
+        return f"job:{job_id}"
+
+    def _layout_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _execute(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+            self._db.commit()
+            return rows
+
+    def _update(self, job_id: str, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _finish(self, job_id: str, status: str, **fields) -> bool:
+        """Move a job to a terminal status, unless it already has one.
+
+        Returns False if the job was no longer active, e.g. because it was
+        cancelled while finishing.
+        """
+        fields.update(status=status, updated=time.time())
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        rows = self._execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ? AND status IN (?, ?) RETURNING id",
+            (*fields.values(), job_id, *ACTIVE_STATUSES))
+        return bool(rows)
+
+    def _write_layout(self, job_id: str, layout: DocumentLayout):
+        path = self._layout_path(job_id)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(layout.model_dump_json())
+        os.replace(tmp, path)
+
+    def _read_layout(self, job_id: str) -> Optional[DocumentLayout]:
+        try:
+            with open(self._layout_path(job_id), encoding="utf-8") as f:
+                return DocumentLayout.model_validate_json(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _remove_layout(self, job_id: str):
+        try:
+            os.remove(self._layout_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    async def start(self):
+        """Start the worker pool and requeue jobs left over from a restart"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created", ACTIVE_STATUSES)
+        for row in rows:
+            print(f"Resuming enrichment job {row['id']}")
+            await asyncio.to_thread(self._update, row["id"], status="queued")
+            self._queue.put_nowait(row["id"])
+
+    async def stop(self):
+        """Stop the workers; running jobs stay recorded and resume on start"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def submit(self, layout: DocumentLayout, user_id: str, words: WordDetail,
+                     file_name: Optional[str] = None, file_size: int = 0,
+                     cache_key: Optional[str] = None) -> str:
+        """Queue an extracted layout for enrichment and return the job id"""
+        if self._queue is None:
+            await self.start()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        await asyncio.to_thread(self._write_layout, job_id, layout)
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs (id, status, stage, user_id, file_name, file_size, cache_key, words, created, updated) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, STAGES[0], user_id, file_name, file_size, cache_key, words.value, now, now))
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def get_job(self, job_id: str, include_layout: bool = False) -> Optional[Dict[str, Any]]:
+        rows = await asyncio.to_thread(self._execute, "SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        if include_layout:
+            layout = await asyncio.to_thread(self._read_layout, job_id)
+            job["layout"] = layout.model_dump(mode="json") if layout else None
+        return job
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; returns False if it already finished"""
+        if not await asyncio.to_thread(self._finish, job_id, "cancelled"):
+            return False
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancelled.add(job_id)
+            task.cancel()
+            await asyncio.wait([task])
+        await asyncio.to_thread(self._remove_layout, job_id)
+        await manager.publish(self.topic(job_id), {"type": "cancelled", "job_id": job_id})
+        return True
+
+    async def _publish(self, job_id: str, event: Dict[str, Any]):
+        await manager.publish(self.topic(job_id), {**event, "job_id": job_id})
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = await self.get_job(job_id)
+            if job is None or job["status"] != "queued":
+                continue
+            task = asyncio.create_task(self._run(job))
+            self._running[job_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                if job_id not in self._cancelled:
+                    # The worker itself is being stopped
+                    task.cancel()
+                    raise
+            except Exception as e:
+                print(f"Error in enrichment job {job_id}: {e}")
+                # Failed jobs are not resumed, so their checkpoint goes too
+                if await asyncio.to_thread(self._finish, job_id, "failed", error=str(e)):
+                    await asyncio.to_thread(self._remove_layout, job_id)
+                    await self._publish(job_id, {"type": "done", "document_id": None, "error": str(e)})
+            finally:
+                self._running.pop(job_id, None)
+                self._cancelled.discard(job_id)
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        # A job cancelled after it was dequeued is left alone
+        started = await asyncio.to_thread(
+            self._execute, "UPDATE jobs SET status = 'running', updated = ? "
+            "WHERE id = ? AND status = 'queued' RETURNING id", (time.time(), job_id))
+        if not started:
+            return
+        layout = await asyncio.to_thread(self._read_layout, job_id)
+        if layout is None:
+            raise RuntimeError("Job layout checkpoint is missing")
+        words = WordDetail(job["words"])
+        stage, pages_done = job["stage"], job["pages_done"]
+        if stage not in STAGES:
+            # A stage that was removed since the job was checkpointed
+            # (upload-time visualizations) came after all remaining ones
+            stage = "save"
+
+        # Failures before a restart are only known by their total
+        failures = {"checkpointed": job["failures"]} if job["failures"] else {}
+        if stage != "save":
+            last_checkpoint = time.monotonic()
+            finished = set()
+            async for event in enrich_layout(layout, words, stage, pages_done, failures):
+                await self._publish(job_id, event)
+                if event["type"] == "lines":
+                    # Resume after the pages finished in order so far
+                    finished.add(event["page_index"])
+                    while pages_done < len(layout.pages) and layout.pages[pages_done].index in finished:
+                        pages_done += 1
+                if event["type"] != "progress":
+                    continue
+                stage = event["stage"]
+                stage_done = event["done"] == event["total"]
+                # Checkpoint at stage boundaries, and periodically within
+                if stage_done or time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    next_stage = STAGES[STAGES.index(stage) + 1] if stage_done else stage
+                    await asyncio.to_thread(self._write_layout, job_id, layout)
+                    await asyncio.to_thread(self._update, job_id, stage=next_stage,
+                                            pages_done=pages_done, progress=event["progress"],
+                                            failures=sum(failures.values()))
+                    last_checkpoint = time.monotonic()
+
+        document_id = await persist_document(layout, job["cache_key"], words,
+                                             job["file_name"], job["file_size"], job["user_id"],
+                                             failures)
+        # A cancel that raced with saving has already cleaned up
+        if await asyncio.to_thread(self._finish, job_id, "completed", stage="save",
+                                   progress=1.0, document_id=document_id):
+            await asyncio.to_thread(self._remove_layout, job_id)
+            await self._publish(job_id, {"type": "done", "document_id": document_id})
+
+
+# Global instance
+enrichment_job_service = None
+
+def get_enrichment_job_service() -> EnrichmentJobService:
+    global enrichment_job_service
+    if enrichment_job_service is None:
+        enrichment_job_service = EnrichmentJobService()
+    return enrichment_job_service
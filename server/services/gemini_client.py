@@ -0,0 +1,160 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Optional
+import google.generativeai as genai
+from services.rate_limiter import RateLimiter, RetryPolicy, estimate_tokens, is_retryable, is_throttled
+from services.single_flight import SingleFlight, prompt_key
+
+
+# Upper bound on Gemini requests in flight across the whole process; the
+# adaptive limit backs off below it when the API throttles
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+# Per-request timeout, applied both to the SDK call and to the awaiting side
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+
+# Client-side quotas (0 disables a limit)
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "0"))
+GEMINI_TOKENS_PER_MINUTE = float(os.getenv("GEMINI_TOKENS_PER_MINUTE", "0"))
+
+# Retries for throttled, timed out and 5xx requests
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", "1"))
+GEMINI_RETRY_MAX_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_SECONDS", "30"))
+
+# Alternative API endpoint (e.g. a local fake server); implies REST transport
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+
+def configure_genai(api_key: str):
+    """Configure the Gemini SDK, honouring GEMINI_API_ENDPOINT"""
+    if GEMINI_API_ENDPOINT:
+        genai.configure(api_key=api_key, transport="rest",
+                        client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    else:
+        genai.configure(api_key=api_key)
+
+
+class GeminiClient:
+    """Runs blocking Gemini SDK calls off the event loop.
+
+    ``generate_content`` is synchronous, so calls go through a dedicated
+    thread pool sized to the concurrency limit. Each request is admitted by
+    the rate limiter, gets a timeout so a hung call cannot hold a slot
+    forever, and is retried with jittered backoff when the API throttles or
+    fails transiently.
+    """
+
+    def __init__(self, max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                 timeout: float = GEMINI_TIMEOUT_SECONDS,
+                 requests_per_minute: float = GEMINI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = GEMINI_TOKENS_PER_MINUTE,
+                 retry: Optional[RetryPolicy] = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix="gemini")
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute, self.max_concurrency)
+        self.retry = retry or RetryPolicy(GEMINI_MAX_RETRIES, GEMINI_RETRY_BASE_SECONDS,
+                                          GEMINI_RETRY_MAX_SECONDS)
+        self.single_flight = SingleFlight()
+        self.calls = 0
+        self.in_flight = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.throttled = 0
+        self.retries = 0
+        self.total_latency = 0.0
+
+    async def generate(self, model, contents: Any, timeout: Optional[float] = None,
+                       coalesce: bool = False, **kwargs):
+        """Call ``model.generate_content`` without blocking the event loop.
+
+        With ``coalesce``, concurrent calls with the same model and prompt
+        share one request and its response.
+        """
+        if coalesce and isinstance(contents, str) and not kwargs:
+            key = prompt_key(getattr(model, "model_name", ""), contents)
+            return await self.single_flight.do(key, self._generate, model, contents, timeout)
+        return await self._generate(model, contents, timeout, **kwargs)
+
+    async def _generate(self, model, contents: Any, timeout: Optional[float] = None, **kwargs):
+        timeout = timeout or self.timeout
+        call = partial(model.generate_content, contents,
+                       request_options={"timeout": timeout}, **kwargs)
+        tokens = estimate_tokens(contents) if isinstance(contents, str) else 0
+
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(call, timeout, tokens)
+            except Exception as e:
+                if attempt >= self.retry.max_retries or not is_retryable(e):
+                    raise
+                await asyncio.sleep(self.retry.delay(attempt))
+                attempt += 1
+                self.retries += 1
+
+    async def _attempt(self, call, timeout: float, tokens: int):
+        await self.limiter.acquire(tokens)
+        self.in_flight += 1
+        start = time.monotonic()
+        error = None
+        try:
+            loop = asyncio.get_running_loop()
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, call), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            error = asyncio.TimeoutError(f"Gemini request timed out after {timeout}s")
+            raise error from None
+        except Exception as e:
+            error = e
+            if is_throttled(e):
+                self.throttled += 1
+            else:
+                self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.calls += 1
+            self.total_latency += time.monotonic() - start
+            self.limiter.release(error)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get request statistics"""
+        return {
+            "timeout_seconds": self.timeout,
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "timeouts": self.timeouts,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "retries": self.retries,
+            "coalesced": self.single_flight.coalesced,
+            "avg_latency": self.total_latency / self.calls if self.calls else 0.0,
+            **self.limiter.get_stats(),
+        }
+
+    def shutdown(self):
+        """Stop the worker threads without waiting for pending calls"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Global instance
+gemini_client = None
+
+def get_gemini_client() -> GeminiClient:
+    global gemini_client
+    if gemini_client is None:
+        gemini_client = GeminiClient()
+    return gemini_client
+
+def shutdown_gemini_client():
+    """Release the client's worker threads, if it was ever created"""
+    global gemini_client
+    if gemini_client is not None:
+        gemini_client.shutdown()
+        gemini_client = None
@@ -1,12 +1,156 @@
 import os
 import base64
 import json
-from typing import List, Dict, Any, Optional
+import asyncio
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 import google.generativeai as genai
 from PIL import Image
 import io
 import requests
 from models import Line, Word, VisualizationType, VoiceType
+from services.gemini_client import configure_genai, get_gemini_client
+from services.rate_limiter import estimate_tokens
+from services.line_scorer import LINE_TRIAGE_MAX_IMPORTANCE, LINE_TRIAGE_MIN_IMPORTANCE, triage_lines
+from services.readability import reading_difficulty
+from services.context_index import ContextIndex
+from services.near_duplicates import get_visualization_reuse_index
+from services.characters import CharacterChunk, character_chunks, find_candidates, merge_aliases
+from services.analysis_cache import analysis_key, get_analysis_cache
+
+
+# Bump whenever a prompt or the parsing of its response changes, so that
+# cached analysis results produced by older prompts are invalidated.
+PROMPT_VERSION = "3"
+
+# Reading difficulty is computed locally by the readability engine; with
+# refinement enabled Gemini is asked for it too and its estimate wins
+READABILITY_GEMINI_REFINE = os.getenv("READABILITY_GEMINI_REFINE", "false").lower() in ("1", "true", "yes")
+
+# Identifies the shape of analysis results, for the caches that store them
+ANALYSIS_VERSION = f"{PROMPT_VERSION}-refined" if READABILITY_GEMINI_REFINE else PROMPT_VERSION
+
+_DIFFICULTY_FIELD = ("\n        - reading_difficulty: float (0-1, how difficult this line is to read)"
+                     if READABILITY_GEMINI_REFINE else "")
+
+# Line analysis packs consecutive lines into one request, bounded by both a
+# line count and a rough token budget for the line text. A batch size of 1
+# falls back to one request per line.
+ANALYSIS_BATCH_LINES = int(os.getenv("GEMINI_ANALYSIS_BATCH_LINES", "40"))
+ANALYSIS_BATCH_TOKENS = int(os.getenv("GEMINI_ANALYSIS_BATCH_TOKENS", "4000"))
+
+# Per-line overhead of the JSON framing in batch prompts, in tokens
+_LINE_TOKEN_OVERHEAD = 8
+
+
+def _analysis_batches(lines: List[Line]):
+    """Split lines into consecutive windows that fit the batch limits"""
+    batch, budget = [], 0
+    for line in lines:
+        cost = estimate_tokens(line.text) + _LINE_TOKEN_OVERHEAD
+        if batch and (len(batch) >= ANALYSIS_BATCH_LINES or budget + cost > ANALYSIS_BATCH_TOKENS):
+            yield batch
+            batch, budget = [], 0
+        batch.append(line)
+        budget += cost
+    if batch:
+        yield batch
+
+
+def _analysis_windows(lines: List[Line]) -> List[List[Line]]:
+    """Group lines into analysis requests: batches, or one line each"""
+    if ANALYSIS_BATCH_LINES <= 1:
+        return [[line] for line in lines]
+    return list(_analysis_batches(lines))
+
+
+def _request_count(line_count: int) -> int:
+    """Approximate number of analysis requests needed for this many lines"""
+    if ANALYSIS_BATCH_LINES <= 1:
+        return line_count
+    return -(-line_count // ANALYSIS_BATCH_LINES)
+
+
+def _parse_json(text: str) -> Any:
+    """Parse a JSON response, tolerating a surrounding markdown code fence"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return json.loads(text)
+
+
+def _is_score(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value <= 1
+
+
+def _is_string_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _valid_analysis(analysis: Dict[str, Any]) -> bool:
+    """Check that one line analysis from a batch response is well formed"""
+    return (_is_score(analysis.get('importance_score'))
+            and (_is_score(analysis.get('reading_difficulty')) or not READABILITY_GEMINI_REFINE)
+            and (analysis.get('character') is None or isinstance(analysis.get('character'), str))
+            and _is_string_list(analysis.get('key_concepts', []))
+            and _is_string_list(analysis.get('keywords', [])))
+
+
+def _record_failure(failures: Optional[Dict[str, int]], kind: str, count: int = 1):
+    """Count results that fell back to defaults because the model call failed"""
+    if failures is not None and count:
+        failures[kind] = failures.get(kind, 0) + count
+
+
+def _apply_analysis(line: Line, analysis: Dict[str, Any]) -> Line:
+    """Copy a line with an analysis result applied to it and its words"""
+    enhanced_line = line.model_copy()
+    enhanced_line.importance_score = analysis.get('importance_score', 0.5)
+    enhanced_line.character = analysis.get('character')
+    enhanced_line.key_concepts = analysis.get('key_concepts', [])
+    enhanced_line.reading_difficulty = analysis.get('reading_difficulty', 0.5)
+    
+    # Update words with keyword information
+    keywords = {kw.lower() for kw in analysis.get('keywords', [])}
+    for word in enhanced_line.words:
+        word.is_keyword = word.t.lower() in keywords
+        word.importance_score = enhanced_line.importance_score
+        word.character = enhanced_line.character
+    
+    return enhanced_line
+
+
+def _mock_analysis(lines: List[Line]) -> List[Line]:
+    """Mock enhancements used in development, without an API key"""
+    difficulty = reading_difficulty([line.text for line in lines])
+    enhanced_lines = []
+    for i, line in enumerate(lines):
+        enhanced_line = Line(
+            index=line.index,
+            text=line.text,
+            words=line.words,
+            character="narrator" if i % 3 == 0 else None,
+            importance_score=0.7 + (i % 3) * 0.1,
+            key_concepts=[f"concept{i}" for i in range(min(3, len(line.text.split())//3))],
+            reading_difficulty=round(float(difficulty[i]), 3),
+            visualization=None
+        )
+        enhanced_lines.append(enhanced_line)
+    return enhanced_lines
+
+
+async def _finish_lines(lines: List[Line], keys: List[str], analyses: Dict[str, Dict[str, Any]]) -> List[Line]:
+    """Apply the analyses found for a page's lines and score their difficulty"""
+    enhanced_lines = [_apply_analysis(line, analyses[key]) if key in analyses else line
+                      for key, line in zip(keys, lines)]
+
+    difficulty = await asyncio.to_thread(reading_difficulty, [line.text for line in lines])
+    for key, line, local_difficulty in zip(keys, enhanced_lines, difficulty):
+        refined = analyses.get(key, {}).get('reading_difficulty') if READABILITY_GEMINI_REFINE else None
+        line.reading_difficulty = refined if _is_score(refined) else round(float(local_difficulty), 3)
+
+    return enhanced_lines
 
 
 class GeminiService:
@@ -15,92 +159,235 @@ class GeminiService:
         if not self.api_key or self.api_key == "test_key_for_development":
             print("Warning: Using mock Gemini API key for development")
             self.api_key = "mock_key"
+            self.model_name = "mock"
             self.model = None
             self.vision_model = None
         else:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-pro')
+            configure_genai(self.api_key)
+            self.model_name = 'gemini-1.5-pro'
+            self.model = genai.GenerativeModel(self.model_name)
             self.vision_model = genai.GenerativeModel('gemini-1.5-pro-vision')
+        self.client = get_gemini_client()
+        self.triage_stats = {"lines_local": 0, "lines_sent": 0, "calls_avoided": 0}
     
-    async def analyze_document_content(self, lines: List[Line]) -> List[Line]:
-        """Analyze document content for ADHD-friendly features"""
+    async def analyze_document_content(self, lines: List[Line],
+                                       failures: Optional[Dict[str, int]] = None) -> List[Line]:
+        """Analyze document content for ADHD-friendly features.
+
+        Lines the model could not analyze are counted into ``failures["lines"]``.
+        """
+        results = [enhanced async for _, enhanced in self.analyze_pages([lines], failures)]
+        return results[0]
+
+    async def analyze_pages(self, pages: List[List[Line]],
+                            failures: Optional[Dict[str, int]] = None) -> AsyncIterator[Tuple[int, List[Line]]]:
+        """Analyze the lines of several pages, yielding ``(position, lines)`` per page.
+
+        All pages are looked up, triaged and packed into requests together,
+        so short pages share batches. The requests run concurrently and each
+        page is yielded as soon as the requests covering it are done, which
+        is not necessarily in order. Lines the model could not analyze are
+        counted into ``failures["lines"]``.
+        """
         # If using mock key, return lines with mock enhancements
         if self.api_key == "mock_key":
-            enhanced_lines = []
-            for i, line in enumerate(lines):
-                enhanced_line = Line(
-                    index=line.index,
-                    text=line.text,
-                    words=line.words,
-                    character="narrator" if i % 3 == 0 else None,
-                    importance_score=0.7 + (i % 3) * 0.1,
-                    key_concepts=[f"concept{i}" for i in range(min(3, len(line.text.split())//3))],
-                    reading_difficulty=0.5 + (i % 3) * 0.2,
-                    visualization=None
-                )
-                enhanced_lines.append(enhanced_line)
-            return enhanced_lines
+            for position, lines in enumerate(pages):
+                yield position, _mock_analysis(lines)
+            return
+
+        # Look up every line before making any request, so repeated lines
+        # (headers, boilerplate, lines seen in earlier documents) are free
+        cache = get_analysis_cache()
+        keys = [[analysis_key(line.text, self.model_name, ANALYSIS_VERSION) for line in lines]
+                for lines in pages]
+        all_keys = [key for page_keys in keys for key in page_keys]
+        analyses = await asyncio.to_thread(cache.get_many, all_keys) if cache else {}
+
+        # Each distinct line still missing is analyzed once
+        pending = {}
+        for key, line in zip(all_keys, (line for lines in pages for line in lines)):
+            if key not in analyses and key not in pending:
+                pending[key] = line
+
+        # Lines the local scorer is confident about either way skip the model
+        pending_keys = list(pending)
+        local = await asyncio.to_thread(triage_lines, [line.text for line in pending.values()])
+        for i, analysis in local.items():
+            analyses[pending_keys[i]] = analysis
+            del pending[pending_keys[i]]
+        if local:
+            self.triage_stats["lines_local"] += len(local)
+            self.triage_stats["calls_avoided"] += (_request_count(len(pending_keys))
+                                                   - _request_count(len(pending)))
+        self.triage_stats["lines_sent"] += len(pending)
+
+        # Requests run concurrently; the client bounds how many are in flight
+        tasks = {}
+        pending_keys = list(pending)
+        offset = 0
+        for window in _analysis_windows(list(pending.values())):
+            tasks[asyncio.ensure_future(self._analyze_window(window))] = pending_keys[offset:offset + len(window)]
+            offset += len(window)
+
+        waiting = {position: {key for key in page_keys if key in pending}
+                   for position, page_keys in enumerate(keys)}
+        try:
+            while True:
+                for position in [p for p, outstanding in waiting.items() if not outstanding]:
+                    del waiting[position]
+                    yield position, await _finish_lines(pages[position], keys[position], analyses)
+                if not tasks:
+                    break
+
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                fresh = []
+                failed = 0
+                for task in done:
+                    window_keys = tasks.pop(task)
+                    for key, (analysis, from_model) in zip(window_keys, task.result()):
+                        if analysis is not None:
+                            analyses[key] = analysis
+                        if from_model:
+                            fresh.append((key, analysis))
+                        else:
+                            failed += 1
+                    for outstanding in waiting.values():
+                        outstanding.difference_update(window_keys)
+                _record_failure(failures, "lines", failed)
+                if cache and fresh:
+                    await asyncio.to_thread(cache.put_many, fresh)
+        finally:
+            # The caller stopped early: drop the requests nobody will read
+            for task in tasks:
+                task.cancel()
+
+    def get_triage_stats(self) -> Dict[str, Any]:
+        """Report how many lines were scored locally instead of by the model"""
+        total = self.triage_stats["lines_local"] + self.triage_stats["lines_sent"]
+        return {
+            "max_importance": LINE_TRIAGE_MAX_IMPORTANCE,
+            "min_importance": LINE_TRIAGE_MIN_IMPORTANCE,
+            **self.triage_stats,
+            "local_ratio": self.triage_stats["lines_local"] / total if total else 0.0,
+        }
+
+    async def _analyze_window(self, lines: List[Line]) -> List[Tuple[Optional[Dict[str, Any]], bool]]:
+        """Analyze one window from ``_analysis_windows``.
+
+        Returns one ``(analysis, from_model)`` pair per line, in order; see
+        ``_analyze_line``.
+        """
+        if ANALYSIS_BATCH_LINES <= 1:
+            return list(await asyncio.gather(*(self._analyze_line(line) for line in lines)))
+
+        found = await self._analyze_batch(lines)
+        # Missing or invalid in the batch response: ask for those alone
+        retried = iter(await asyncio.gather(*(self._analyze_line(line) for i, line in enumerate(lines)
+                                              if i not in found)))
+        return [(found[i], True) if i in found else next(retried) for i in range(len(lines))]
+
+    async def _analyze_batch(self, lines: List[Line]) -> Dict[int, Dict[str, Any]]:
+        """Analyze a window of lines in one request.
+
+        Returns the valid analyses keyed by position in ``lines``; anything
+        the model skipped or got wrong is left out for the caller to retry.
+        """
+        numbered = json.dumps([{"index": i, "text": line.text} for i, line in enumerate(lines)],
+                              ensure_ascii=False)
+        analysis_prompt = f"""
+        Analyze these text lines for an ADHD-friendly reading platform.
+        Lines (JSON array of objects with index and text):
+        {numbered}
         
-        enhanced_lines = []
+        Return only a JSON array with one object per line, each with:
+        - index: integer (the index of the line as given above)
+        - importance_score: float (0-1, how important this line is for comprehension)
+        - character: string or null (if this line is spoken by a character)
+        - key_concepts: array of strings (important concepts in this line){_DIFFICULTY_FIELD}
+        - keywords: array of strings (key words that should be highlighted)
         
-        for line in lines:
-            # Analyze line for importance, characters, and key concepts
-            analysis_prompt = f"""
-            Analyze this text line for an ADHD-friendly reading platform:
-            Text: "{line.text}"
+        Focus on making this accessible for children with ADHD.
+        """
+
+        try:
+            response = await self.client.generate(self.model, analysis_prompt, coalesce=True)
+            items = _parse_json(response.text)
+        except Exception as e:
+            print(f"Error analyzing batch of {len(lines)} lines: {e}")
+            return {}
+
+        results = {}
+        if not isinstance(items, list):
+            return results
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            index = item.get('index')
+            if isinstance(index, int) and 0 <= index < len(lines) and _valid_analysis(item):
+                results[index] = item
+        return results
+
+    async def _analyze_line(self, line: Line) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Analyze a single line with its own request.
+
+        Returns the analysis and whether it came from the model (as opposed to
+        the local fallback). The analysis is None if the request failed.
+        """
+        # Analyze line for importance, characters, and key concepts
+        analysis_prompt = f"""
+        Analyze this text line for an ADHD-friendly reading platform:
+        Text: "{line.text}"
+        
+        Return a JSON object with:
+        - importance_score: float (0-1, how important this line is for comprehension)
+        - character: string or null (if this line is spoken by a character)
+        - key_concepts: array of strings (important concepts in this line){_DIFFICULTY_FIELD}
+        - keywords: array of strings (key words that should be highlighted)
+        
+        Focus on making this accessible for children with ADHD.
+        """
+        
+        try:
+            response = await self.client.generate(self.model, analysis_prompt, coalesce=True)
             
-            Return a JSON object with:
-            - importance_score: float (0-1, how important this line is for comprehension)
-            - character: string or null (if this line is spoken by a character)
-            - key_concepts: array of strings (important concepts in this line)
-            - reading_difficulty: float (0-1, how difficult this line is to read)
-            - keywords: array of strings (key words that should be highlighted)
+            # Try to parse JSON response, with fallback
+            try:
+                analysis = _parse_json(response.text)
+                if not isinstance(analysis, dict) or not _valid_analysis(analysis):
+                    raise json.JSONDecodeError("Expected a line analysis object", response.text, 0)
+                return analysis, True
+            except json.JSONDecodeError:
+                # Fallback: create basic analysis if JSON parsing fails
+                analysis = {
+                    'importance_score': 0.5,
+                    'character': None,
+                    'key_concepts': [],
+                    'reading_difficulty': 0.5,
+                    'keywords': line.text.split()[:3]  # Use first 3 words as keywords
+                }
             
-            Focus on making this accessible for children with ADHD.
-            """
+            return analysis, False
             
-            try:
-                response = self.model.generate_content(analysis_prompt)
-                
-                # Try to parse JSON response, with fallback
-                try:
-                    analysis = json.loads(response.text.strip())
-                except json.JSONDecodeError:
-                    # Fallback: create basic analysis if JSON parsing fails
-                    analysis = {
-                        'importance_score': 0.5,
-                        'character': None,
-                        'key_concepts': [],
-                        'reading_difficulty': 0.5,
-                        'keywords': line.text.split()[:3]  # Use first 3 words as keywords
-                    }
-                
-                # Update line with analysis
-                enhanced_line = line.model_copy()
-                enhanced_line.importance_score = analysis.get('importance_score', 0.5)
-                enhanced_line.character = analysis.get('character')
-                enhanced_line.key_concepts = analysis.get('key_concepts', [])
-                enhanced_line.reading_difficulty = analysis.get('reading_difficulty', 0.5)
-                
-                # Update words with keyword information
-                keywords = analysis.get('keywords', [])
-                for word in enhanced_line.words:
-                    word.is_keyword = word.t.lower() in [kw.lower() for kw in keywords]
-                    word.importance_score = enhanced_line.importance_score
-                    word.character = enhanced_line.character
-                
-                enhanced_lines.append(enhanced_line)
-                
-            except Exception as e:
-                print(f"Error analyzing line: {e}")
-                enhanced_lines.append(line)
-        
-        return enhanced_lines
+        except Exception as e:
+            print(f"Error analyzing line: {e}")
+            return None, False
     
     async def generate_visualization(self, text: str, line_index: int, 
                                   visualization_type: VisualizationType = VisualizationType.IMAGE,
-                                  context: Optional[str] = None) -> Dict[str, Any]:
-        """Generate visual content to help with comprehension"""
+                                  context: Optional[str] = None,
+                                  document_id: Optional[str] = None) -> Dict[str, Any]:
+        """Generate visual content to help with comprehension.
+
+        A line that nearly duplicates one visualized before (in
+        ``document_id``, or anywhere at a stricter threshold) reuses its
+        visualization instead of prompting again.
+        """
+        reuse = get_visualization_reuse_index()
+        namespace = ("visualization", visualization_type.value)
+        match = reuse.find(namespace, text, document_id)
+        if match is not None:
+            visualization, similarity = match
+            return {**visualization, "reused_similarity": round(similarity, 3)}
         
         prompt = f"""
         Create a {visualization_type.value} description for this text to help a child with ADHD understand and visualize what they're reading:
@@ -123,13 +410,17 @@ class GeminiService:
         """
         
         try:
-            response = self.model.generate_content(prompt)
+            response = await self.client.generate(self.model, prompt, coalesce=True)
             
             # Try to parse JSON response, with fallback
+            from_model = True
             try:
-                visualization_data = json.loads(response.text.strip())
+                visualization_data = _parse_json(response.text)
+                if not isinstance(visualization_data, dict):
+                    raise json.JSONDecodeError("Expected a visualization object", response.text, 0)
             except json.JSONDecodeError:
                 # Fallback: create basic visualization data if JSON parsing fails
+                from_model = False
                 visualization_data = {
                     "description": f"Visual representation of: {text[:100]}...",
                     "style": "cartoon",
@@ -140,7 +431,7 @@ class GeminiService:
             
             # For now, return the description and metadata
             # In a full implementation, you'd generate actual images/videos
-            return {
+            visualization = {
                 "type": visualization_type.value,
                 "description": visualization_data.get("description", ""),
                 "style": visualization_data.get("style", "cartoon"),
@@ -149,6 +440,10 @@ class GeminiService:
                 "mood": visualization_data.get("mood", "neutral"),
                 "confidence": 0.8
             }
+            # Only the model's own visualizations are worth reusing
+            if from_model:
+                reuse.add(namespace, text, visualization, document_id)
+            return visualization
             
         except Exception as e:
             print(f"Error generating visualization: {e}")
@@ -162,44 +457,76 @@ class GeminiService:
                 "confidence": 0.3
             }
     
-    async def identify_characters(self, lines: List[Line]) -> List[str]:
-        """Identify characters in the text for voice switching"""
+    async def identify_characters(self, lines: List[Line],
+                                  failures: Optional[Dict[str, int]] = None) -> List[str]:
+        """Identify characters in the text for voice switching.
+
+        Map-reduce over the whole document: chunks that introduce new
+        candidate names are sent to Gemini concurrently, and the per-chunk
+        lists are merged into distinct characters locally. Chunks the model
+        could not process are counted into ``failures["characters"]``.
+        """
         # If using mock key, return mock characters
         if self.api_key == "mock_key":
             return ["narrator", "protagonist", "friend"]
         
-        text_sample = " ".join([line.text for line in lines[:10]])  # First 10 lines
+        texts = [line.text for line in lines]
+        candidates = await asyncio.to_thread(find_candidates, texts)
+        chunks = await asyncio.to_thread(character_chunks, texts, candidates)
+        results = await asyncio.gather(*(self._identify_chunk_characters(chunk) for chunk in chunks))
+        _record_failure(failures, "characters", sum(1 for result in results if result is None))
         
+        groups = [group for result in results if result for group in result]
+        if not groups:
+            # Fallback: the locally found names, or just a narrator
+            groups = [[name] for chunk in chunks for name in sorted(chunk.new_names)]
+        characters = merge_aliases(groups, candidates.mentions)
+        return characters if characters else ["Narrator"]
+    
+    async def _identify_chunk_characters(self, chunk: CharacterChunk) -> Optional[List[List[str]]]:
+        """Characters of one chunk as [name, *aliases] groups, or None on failure"""
+        passage = " ".join(chunk.texts)
+        names = ", ".join(sorted(chunk.names))
         prompt = f"""
-        Identify all characters mentioned in this text sample:
-        "{text_sample}"
+        Identify all characters in this passage from a longer text:
+        "{passage}"
         
-        Return a JSON array of character names. Include:
-        - Main characters
-        - Supporting characters
-        - Any narrator or speaker roles
+        Names found in the passage that may belong to characters: {names}
         
+        Return a JSON array with one object per character:
+        - name: string (the character's fullest name in the passage)
+        - aliases: array of strings (other names, nicknames or titles used for the same character)
+        
+        Include main and supporting characters and any narrator or speaker roles.
         Focus on characters that would have distinct voices in an audiobook.
+        Return [] if there are none.
         """
         
         try:
-            response = self.model.generate_content(prompt)
-            
-            # Try to parse JSON response, with fallback
-            try:
-                characters = json.loads(response.text.strip())
-                return characters if isinstance(characters, list) else ["Narrator"]
-            except json.JSONDecodeError:
-                # Fallback: extract potential character names from text
-                words = text_sample.split()
-                potential_chars = [word for word in words if word.istitle() and len(word) > 2][:5]
-                return potential_chars if potential_chars else ["Narrator"]
+            response = await self.client.generate(self.model, prompt, coalesce=True)
+            characters = _parse_json(response.text)
         except Exception as e:
             print(f"Error identifying characters: {e}")
-            return ["Narrator"]
+            return None
+        
+        if not isinstance(characters, list):
+            return None
+        groups = []
+        for character in characters:
+            if isinstance(character, str):
+                groups.append([character])
+            elif isinstance(character, dict) and isinstance(character.get("name"), str):
+                aliases = character.get("aliases")
+                groups.append([character["name"], *(aliases if _is_string_list(aliases) else [])])
+        return groups
     
-    async def determine_genre_and_reading_level(self, lines: List[Line]) -> Dict[str, str]:
-        """Determine the genre and reading level of the document"""
+    async def determine_genre_and_reading_level(self, lines: List[Line],
+                                                failures: Optional[Dict[str, int]] = None) -> Dict[str, str]:
+        """Determine the genre and reading level of the document.
+
+        A fallback guess instead of a model answer is counted into
+        ``failures["genre"]``.
+        """
         # If using mock key, return mock genre info
         if self.api_key == "mock_key":
             return {
@@ -224,13 +551,16 @@ class GeminiService:
         """
         
         try:
-            response = self.model.generate_content(prompt)
+            response = await self.client.generate(self.model, prompt, coalesce=True)
             
             # Try to parse JSON response, with fallback
             try:
-                analysis = json.loads(response.text.strip())
+                analysis = _parse_json(response.text)
+                if not isinstance(analysis, dict):
+                    raise json.JSONDecodeError("Expected a genre object", response.text, 0)
             except json.JSONDecodeError:
                 # Fallback: basic analysis based on text characteristics
+                _record_failure(failures, "genre")
                 word_count = len(text_sample.split())
                 analysis = {
                     "genre": "fiction" if any(word in text_sample.lower() for word in ["he", "she", "said", "went"]) else "non-fiction",
@@ -245,18 +575,31 @@ class GeminiService:
             }
         except Exception as e:
             print(f"Error analyzing genre/level: {e}")
+            _record_failure(failures, "genre")
             return {
                 "genre": "unknown",
                 "reading_level": "elementary",
                 "target_age": "8-12 years"
             }
     
-    async def generate_reading_connections(self, current_line: Line, previous_lines: List[Line]) -> List[Dict[str, Any]]:
-        """Generate connections between current line and previous content"""
+    async def generate_reading_connections(self, current_line: Line, previous_lines: List[Line],
+                                           context_index: Optional[ContextIndex] = None) -> List[Dict[str, Any]]:
+        """Generate connections between current line and previous content.
+
+        ``previous_lines`` are all lines before the current one in document
+        order. With the document's ``context_index`` the prompt gets the most
+        relevant earlier lines plus the line just before; without it, the
+        last 3 lines.
+        """
         if not previous_lines:
             return []
         
-        context = " ".join([line.text for line in previous_lines[-3:]])  # Last 3 lines
+        if context_index is not None:
+            positions = set(context_index.search(current_line.text, before=len(previous_lines)))
+            positions.add(len(previous_lines) - 1)
+            context = " ... ".join(previous_lines[i].text for i in sorted(positions))
+        else:
+            context = " ".join([line.text for line in previous_lines[-3:]])  # Last 3 lines
         current_text = current_line.text
         
         prompt = f"""
@@ -273,8 +616,8 @@ class GeminiService:
         """
         
         try:
-            response = self.model.generate_content(prompt)
-            connections = json.loads(response.text.strip())
+            response = await self.client.generate(self.model, prompt)
+            connections = _parse_json(response.text)
             return connections if isinstance(connections, list) else []
         except Exception as e:
             print(f"Error generating connections: {e}")
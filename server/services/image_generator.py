@@ -7,7 +7,24 @@ from PIL import Image
 import io
 import requests
 import json
+import hashlib
 from datetime import datetime
+from services.analysis_cache import normalize_line_text
+from services.bounded_cache import BoundedCache
+from services.gemini_client import configure_genai, get_gemini_client
+from services.near_duplicates import get_visualization_reuse_index
+
+
+# Bounds on the in-memory cache of generated images
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+IMAGE_CACHE_TTL_SECONDS = int(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+
+def image_cache_key(line_text: str, context: Optional[str], style: str) -> str:
+    """Cache key for a line's image; independent of where the line appears"""
+    material = f"{style}\0{normalize_line_text(context or '')}\0{normalize_line_text(line_text)}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
 
 
 class ImageGeneratorService:
@@ -17,12 +34,14 @@ class ImageGeneratorService:
             print("Warning: Using mock Gemini API key for development")
             self.api_key = "mock_key"
         
-        genai.configure(api_key=self.api_key)
+        configure_genai(self.api_key)
         self.model = genai.GenerativeModel('gemini-1.5-pro-vision')
         self.text_model = genai.GenerativeModel('gemini-1.5-pro')
+        self.client = get_gemini_client()
         
         # Image generation cache
-        self.image_cache = {}
+        self.image_cache = BoundedCache(IMAGE_CACHE_MAX_ENTRIES, IMAGE_CACHE_MAX_BYTES,
+                                        IMAGE_CACHE_TTL_SECONDS)
         self.generation_queue = asyncio.Queue()
         
         # Start background image generation worker
@@ -31,17 +50,39 @@ class ImageGeneratorService:
     async def generate_image_for_line(self, line_text: str, 
                                     line_index: int, 
                                     context: Optional[str] = None,
-                                    style: str = "cartoon") -> Dict[str, Any]:
-        """Generate an image for a specific line of text"""
+                                    style: str = "cartoon",
+                                    document_id: Optional[str] = None) -> Dict[str, Any]:
+        """Generate an image for a specific line of text.
+
+        Near-duplicates of a line already illustrated in the same style reuse
+        its image (see ``VisualizationReuseIndex``).
+        """
         
-        # Create cache key
-        cache_key = f"{line_text}_{line_index}_{style}"
-        if cache_key in self.image_cache:
-            return self.image_cache[cache_key]
+        # Identical text anywhere in any document shares an entry
+        cache_key = image_cache_key(line_text, context, style)
+        cached = self.image_cache.get(cache_key)
+        if cached is not None:
+            return {**cached, "line_index": line_index, "line_text": line_text}
+        
+        reuse = get_visualization_reuse_index()
+        namespace = ("image", style)
+        match = reuse.find(namespace, line_text, document_id)
+        if match is not None:
+            image, similarity = match
+            return {
+                **image,
+                "line_index": line_index,
+                "line_text": line_text,
+                "metadata": {**image["metadata"], "reused_from": image["line_text"],
+                             "similarity": round(similarity, 3)},
+            }
         
         try:
             # Generate image description using Gemini
             image_description = await self._generate_image_description(line_text, context, style)
+            generated = image_description is not None
+            if not generated:
+                image_description = f"A colorful {style} illustration showing: {line_text[:100]}..."
             
             # For now, return the description and metadata
             # In a full implementation, you would generate actual images
@@ -60,8 +101,10 @@ class ImageGeneratorService:
                 }
             }
             
-            # Cache the result
-            self.image_cache[cache_key] = result
+            # Cache the result, unless it is only the placeholder
+            if generated:
+                self.image_cache.put(cache_key, result)
+                reuse.add(namespace, line_text, result, document_id)
             
             return result
             
@@ -84,8 +127,8 @@ class ImageGeneratorService:
     
     async def _generate_image_description(self, line_text: str, 
                                         context: Optional[str] = None, 
-                                        style: str = "cartoon") -> str:
-        """Generate a detailed image description using Gemini"""
+                                        style: str = "cartoon") -> Optional[str]:
+        """Generate a detailed image description using Gemini; None if it failed"""
         
         # If using mock key, return a mock description
         if self.api_key == "mock_key":
@@ -116,11 +159,11 @@ class ImageGeneratorService:
         """
         
         try:
-            response = self.text_model.generate_content(prompt)
+            response = await self.client.generate(self.text_model, prompt, coalesce=True)
             return response.text.strip()
         except Exception as e:
             print(f"Error generating image description: {e}")
-            return f"A colorful {style} illustration showing: {line_text[:100]}..."
+            return None
     
     async def batch_generate_images(self, lines: List[Dict[str, Any]], 
                                   style: str = "cartoon") -> List[Dict[str, Any]]:
@@ -226,8 +269,8 @@ class ImageGeneratorService:
     async def get_cache_stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
         return {
-            "cache_size": len(self.image_cache),
-            "cache_keys": list(self.image_cache.keys())[:10]  # First 10 keys
+            **self.image_cache.get_stats(),
+            "reuse": get_visualization_reuse_index().get_stats(),
         }
 
 
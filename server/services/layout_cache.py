@@ -0,0 +1,68 @@
+import os
+import shutil
+from typing import Dict, Any, Optional
+from models import DocumentLayout
+from services.disk_cache import DiskLRUCache
+from services.pdf_extractor import EXTRACTOR_VERSION
+from services.gemini_service import ANALYSIS_VERSION, get_gemini_service
+
+
+class LayoutCache:
+    """Content-addressed disk cache of enriched document layouts.
+
+    Entries are keyed by the SHA-256 of the uploaded file and live in a
+    directory named after the extractor version, prompt version and model.
+    Directories of any other version are deleted on startup, so bumping
+    ``EXTRACTOR_VERSION`` or ``ANALYSIS_VERSION`` invalidates the cache.
+    Total size is bounded by least-recently-used eviction.
+    """
+
+    def __init__(self):
+        self.root = os.getenv("LAYOUT_CACHE_DIR", "cache/layouts")
+        max_bytes = int(os.getenv("LAYOUT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        model_name = get_gemini_service().model_name
+        self.version = f"x{EXTRACTOR_VERSION}-p{ANALYSIS_VERSION}-{model_name}"
+
+        os.makedirs(self.root, exist_ok=True)
+        self._purge_stale_versions()
+        self.store = DiskLRUCache(os.path.join(self.root, self.version), max_bytes, suffix=".json")
+
+    def _purge_stale_versions(self):
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name != self.version and os.path.isdir(path):
+                print(f"Invalidating layout cache for {name}")
+                shutil.rmtree(path, ignore_errors=True)
+
+    def get(self, key: str) -> Optional[DocumentLayout]:
+        """Return the cached layout for ``key``, or None on a miss."""
+        path = self.store.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as fp:
+                return DocumentLayout.model_validate_json(fp.read())
+        except Exception as e:
+            print(f"Error reading layout cache entry {key}: {e}")
+            self.store.discard(key)
+            return None
+
+    def put(self, key: str, layout: DocumentLayout):
+        """Store an enriched layout, evicting old entries beyond the size budget."""
+        self.store.put(key, layout.model_dump_json().encode())
+
+    def clear(self):
+        self.store.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"version": self.version, **self.store.get_stats()}
+
+
+# Global instance
+layout_cache = None
+
+def get_layout_cache() -> LayoutCache:
+    global layout_cache
+    if layout_cache is None:
+        layout_cache = LayoutCache()
+    return layout_cache
@@ -0,0 +1,90 @@
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from services.readability import readability, tokenize, tokenize_corpus, word_features
+
+
+# Lines scored locally below MAX or at or above MIN importance are confidently
+# unimportant or important and skip Gemini entirely; only the band between
+# goes to the model. Widening the local ranges saves more calls at the cost
+# of accuracy on borderline lines. MAX of 0 and MIN above 1 send every line
+# to Gemini.
+LINE_TRIAGE_MAX_IMPORTANCE = float(os.getenv("LINE_TRIAGE_MAX_IMPORTANCE", "0.3"))
+LINE_TRIAGE_MIN_IMPORTANCE = float(os.getenv("LINE_TRIAGE_MIN_IMPORTANCE", "0.85"))
+
+_QUOTE = re.compile(r"[\"“”]")
+_SPEECH_VERBS = "said|asked|replied|shouted|whispered|cried|called|answered"
+_SPEAKER = re.compile(rf"\b(?:{_SPEECH_VERBS})\s+([A-Z][a-z]+)\b|\b([A-Z][a-z]+)\s+(?:{_SPEECH_VERBS})\b")
+
+
+class LineScores(NamedTuple):
+    """Per-line heuristic scores, one array entry per input line"""
+    importance: np.ndarray
+    difficulty: np.ndarray
+    word_counts: np.ndarray
+
+
+def score_lines(texts: List[str]) -> LineScores:
+    """Estimate importance and reading difficulty for many lines at once.
+
+    Word features are gathered into flat arrays and reduced per line with
+    NumPy, so the cost is one pass over the words of the whole document.
+    """
+    corpus = tokenize_corpus(texts)
+    metrics = readability(corpus)
+    counts = corpus.counts
+    n = np.maximum(counts, 1).astype(np.float64)
+
+    # Capitalized words other than the first of a line look like names
+    first = np.zeros(len(corpus.words), dtype=bool)
+    first[np.cumsum(counts)[counts > 0] - counts[counts > 0]] = True
+    capitalized = np.fromiter((w[0].isupper() for w in corpus.words), dtype=bool, count=len(corpus.words))
+    entity_fraction = corpus.per_line((capitalized & ~first).astype(np.float64)) / n
+    dialogue = np.fromiter((bool(_QUOTE.search(t)) for t in texts), dtype=np.float64, count=len(texts))
+
+    importance = (0.15
+                  + 0.35 * np.clip(counts / 12.0, 0.0, 1.0)
+                  + 0.30 * metrics.unfamiliar_fraction
+                  + 0.25 * np.clip(entity_fraction * 3.0, 0.0, 1.0)
+                  + 0.10 * dialogue)
+    importance = np.where(counts == 0, 0.0, np.clip(importance, 0.0, 1.0))
+
+    return LineScores(importance, metrics.difficulty, counts)
+
+
+def local_analysis(text: str, importance: float, difficulty: float) -> Dict[str, Any]:
+    """Build a line analysis, in the shape Gemini returns, from local scores"""
+    words = tokenize(text)
+    speaker = _SPEAKER.search(text) if _QUOTE.search(text) else None
+    character: Optional[str] = None
+    if speaker:
+        character = speaker.group(1) or speaker.group(2)
+    names = [w for i, w in enumerate(words) if i and w[0].isupper()]
+    rare = sorted({w for w in words if not word_features(w.lower())[1]}, key=len, reverse=True)
+    return {
+        "importance_score": round(float(importance), 3),
+        "character": character,
+        "key_concepts": list(dict.fromkeys(names))[:3],
+        "reading_difficulty": round(float(difficulty), 3),
+        "keywords": rare[:3],
+    }
+
+
+def triage_lines(texts: List[str], max_importance: float = LINE_TRIAGE_MAX_IMPORTANCE,
+                 min_importance: float = LINE_TRIAGE_MIN_IMPORTANCE) -> Dict[int, Dict[str, Any]]:
+    """Analyze the plainly unimportant and plainly important lines locally.
+
+    Returns local analyses keyed by position in ``texts`` for the lines
+    scored below ``max_importance`` or at least ``min_importance``; the
+    ambiguous band between is left for the model.
+    """
+    if (max_importance <= 0 and min_importance > 1) or not texts:
+        return {}
+    scores = score_lines(texts)
+    confident = np.flatnonzero((scores.importance < max_importance)
+                               | (scores.importance >= min_importance))
+    return {int(i): local_analysis(texts[i], scores.importance[i], scores.difficulty[i])
+            for i in confident}
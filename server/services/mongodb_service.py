@@ -2,6 +2,7 @@ import os
 import asyncio
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo.errors import ConnectionFailure
 from models import DocumentLayout, ReadingProgress, SolanaTransaction, ADHDReadingSettings
@@ -72,8 +73,9 @@ class MongoDBService:
             print(f"Error creating indexes: {e}")
     
     async def save_document(self, user_id: str, document: DocumentLayout, 
-                          file_name: str, file_size: int) -> str:
-        """Save document layout to MongoDB"""
+                          file_name: str, file_size: int,
+                          context_index: Optional[str] = None) -> str:
+        """Save document layout to MongoDB, with its serialized context index"""
         if not self.db:
             # Return a mock document ID for development
             return "mock_doc_id_123"
@@ -87,6 +89,7 @@ class MongoDBService:
                 "characters": document.characters,
                 "genre": document.genre,
                 "reading_level": document.reading_level,
+                "context_index": context_index,
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             }
@@ -98,13 +101,21 @@ class MongoDBService:
             print(f"Error saving document: {e}")
             raise
     
+    @staticmethod
+    def _document_filter(document_id: str, user_id: str) -> Dict[str, Any]:
+        """Match a document by its (ObjectId or legacy string) ID and owner"""
+        return {
+            "_id": ObjectId(document_id) if ObjectId.is_valid(document_id) else document_id,
+            "user_id": user_id
+        }
+    
     async def get_document(self, document_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """Get document by ID and user"""
         try:
-            document = await self.db[self.collections["documents"]].find_one({
-                "_id": document_id,
-                "user_id": user_id
-            })
+            document = await self.db[self.collections["documents"]].find_one(
+                self._document_filter(document_id, user_id),
+                {"context_index": 0}
+            )
             
             if document:
                 document["_id"] = str(document["_id"])
@@ -115,6 +126,104 @@ class MongoDBService:
             print(f"Error getting document: {e}")
             return None
     
+    async def get_document_context(self, document_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a document's line texts and serialized context index, without word data"""
+        if self.db is None:
+            return None
+        
+        try:
+            document = await self.db[self.collections["documents"]].find_one(
+                self._document_filter(document_id, user_id),
+                {"pages.index": 1, "pages.lines.index": 1, "pages.lines.text": 1, "context_index": 1}
+            )
+            
+            if document:
+                document["_id"] = str(document["_id"])
+            
+            return document
+            
+        except Exception as e:
+            print(f"Error getting document context: {e}")
+            return None
+    
+    async def get_document_manifest(self, document_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get document metadata and per-page line counts without loading pages"""
+        if self.db is None:
+            return None
+        
+        try:
+            pipeline = [
+                {"$match": self._document_filter(document_id, user_id)},
+                {"$project": {
+                    "file_name": 1,
+                    "characters": 1,
+                    "genre": 1,
+                    "reading_level": 1,
+                    "created_at": 1,
+                    "page_count": {"$size": "$pages"},
+                    "line_counts": {
+                        "$map": {"input": "$pages", "as": "page", "in": {"$size": "$$page.lines"}}
+                    }
+                }}
+            ]
+            result = await self.db[self.collections["documents"]].aggregate(pipeline).to_list(1)
+            if not result:
+                return None
+            
+            manifest = result[0]
+            manifest["_id"] = str(manifest["_id"])
+            return manifest
+            
+        except Exception as e:
+            print(f"Error getting document manifest: {e}")
+            return None
+    
+    async def get_document_pages(self, document_id: str, user_id: str,
+                               start: int, count: int) -> Optional[Dict[str, Any]]:
+        """Get a slice of a document's pages; only that slice is read and sent by the server"""
+        if self.db is None:
+            return None
+        
+        try:
+            pipeline = [
+                {"$match": self._document_filter(document_id, user_id)},
+                {"$project": {
+                    "page_count": {"$size": "$pages"},
+                    "pages": {"$slice": ["$pages", start, count]}
+                }}
+            ]
+            result = await self.db[self.collections["documents"]].aggregate(pipeline).to_list(1)
+            if not result:
+                return None
+            
+            document = result[0]
+            document["_id"] = str(document["_id"])
+            return document
+            
+        except Exception as e:
+            print(f"Error getting document pages: {e}")
+            return None
+    
+    async def set_line_visualization(self, document_id: str, user_id: str, page_position: int,
+                                     line_position: int, visualization: Dict[str, Any]) -> bool:
+        """Store a visualization on one line of a saved document, without rewriting the rest"""
+        if self.db is None:
+            return False
+        
+        try:
+            result = await self.db[self.collections["documents"]].update_one(
+                self._document_filter(document_id, user_id),
+                {"$set": {
+                    f"pages.{page_position}.lines.{line_position}.visualization": visualization,
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+            return result.matched_count > 0
+            
+        except Exception as e:
+            print(f"Error saving line visualization: {e}")
+            return False
+    
     async def list_user_documents(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
         """List documents for a user"""
         try:
@@ -0,0 +1,223 @@
+import os
+import re
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+# Estimated Jaccard similarity of two lines' shingles above which a
+# visualization is reused. Within a document lines usually describe the same
+# story, so the global (cross-document) threshold is stricter.
+VISUALIZATION_REUSE_THRESHOLD = float(os.getenv("VISUALIZATION_REUSE_THRESHOLD", "0.7"))
+VISUALIZATION_REUSE_GLOBAL_THRESHOLD = float(os.getenv("VISUALIZATION_REUSE_GLOBAL_THRESHOLD", "0.9"))
+
+# Bounds on what the reuse index remembers
+VISUALIZATION_REUSE_MAX_ENTRIES = int(os.getenv("VISUALIZATION_REUSE_MAX_ENTRIES", "50000"))
+VISUALIZATION_REUSE_MAX_DOCUMENTS = int(os.getenv("VISUALIZATION_REUSE_MAX_DOCUMENTS", "100"))
+
+# MinHash signature length and its split into LSH bands. 16 bands of 4 rows
+# make pairs with similarity around 0.5 and up likely to share a bucket; the
+# threshold is then checked against the signature estimate.
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MERSENNE = np.uint64(_MERSENNE_PRIME)
+_LOW_32 = np.uint64((1 << 32) - 1)
+_LOW_29 = np.uint64((1 << 29) - 1)
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> List[str]:
+    """Overlapping character shingles of the normalized text"""
+    text = _NON_WORD.sub(" ", text.lower()).strip()
+    if len(text) <= size:
+        return [text] if text else []
+    return [text[i:i + size] for i in range(len(text) - size + 1)]
+
+
+def _mul_mod_mersenne(a: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """``(a * x) mod (2**61 - 1)`` for ``a`` below the prime and ``x`` below 2**32.
+
+    The 93-bit product does not fit in 64 bits, so ``a`` is split into 32-bit
+    halves and the high part reduced using ``2**61 = 1 (mod p)``.
+    """
+    low = (a & _LOW_32) * x                     # below 2**64
+    high = (a >> np.uint64(32)) * x             # below 2**61, to be shifted up 32 bits
+    # high * 2**32 = (high >> 29) * 2**61 + (high & (2**29 - 1)) * 2**32
+    shifted = (high >> np.uint64(29)) + ((high & _LOW_29) << np.uint64(32))
+    low = (low & _MERSENNE) + (low >> np.uint64(61))
+    return (low + shifted) % _MERSENNE
+
+
+class MinHasher:
+    """MinHash signatures from universal hashes ``(a*x + b) mod p`` of shingle CRCs,
+    with ``a`` and ``b`` drawn over the whole field of the prime ``p = 2**61 - 1``"""
+
+    def __init__(self, num_permutations: int = NUM_PERMUTATIONS, seed: int = 1):
+        rnd = np.random.RandomState(seed)
+        self.a = rnd.randint(1, _MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+        self.b = rnd.randint(0, _MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Signature of a text, or None if it has no content to compare"""
+        items = set(shingles(text))
+        if not items:
+            return None
+        x = np.fromiter((zlib.crc32(s.encode()) for s in items), dtype=np.uint64, count=len(items))
+        hashes = (_mul_mod_mersenne(self.a[:, None], x[None, :]) + self.b[:, None]) % _MERSENNE
+        return hashes.min(axis=1)
+
+
+class NearDuplicateIndex:
+    """LSH index over MinHash signatures, keeping the most recent entries.
+
+    Each signature is split into bands; entries sharing any band are
+    candidates, and the best candidate is accepted if the fraction of equal
+    signature positions (the Jaccard estimate) reaches the threshold.
+    """
+
+    def __init__(self, threshold: float, max_entries: int = VISUALIZATION_REUSE_MAX_ENTRIES,
+                 bands: int = LSH_BANDS):
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.bands = bands
+        self._entries: "OrderedDict[int, Tuple[np.ndarray, Any]]" = OrderedDict()
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [band.tobytes() for band in np.array_split(signature, self.bands)]
+
+    def add(self, signature: np.ndarray, value: Any):
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (signature, value)
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(key, []).append(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        signature, _ = self._entries.pop(entry_id)
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            ids = bucket.get(key)
+            if ids is not None:
+                ids.remove(entry_id)
+                if not ids:
+                    del bucket[key]
+
+    def find(self, signature: np.ndarray) -> Optional[Tuple[Any, float]]:
+        """Most similar entry at or above the threshold, with its similarity"""
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for entry_id in candidates:
+            other, value = self._entries[entry_id]
+            similarity = float(np.mean(other == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = entry_id, similarity
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        return self._entries[best][1], best_similarity
+
+
+class VisualizationReuseIndex:
+    """Reuses visualizations of near-duplicate lines.
+
+    Results are indexed per document and globally, under a namespace that
+    separates kinds of output (visualization type, image style). A lookup
+    tries the document first and then the stricter global index.
+    """
+
+    def __init__(self, threshold: float = VISUALIZATION_REUSE_THRESHOLD,
+                 global_threshold: float = VISUALIZATION_REUSE_GLOBAL_THRESHOLD,
+                 max_entries: int = VISUALIZATION_REUSE_MAX_ENTRIES,
+                 max_documents: int = VISUALIZATION_REUSE_MAX_DOCUMENTS):
+        self.threshold = threshold
+        self.global_threshold = global_threshold
+        self.max_entries = max_entries
+        self.max_documents = max(1, max_documents)
+        self.hasher = MinHasher()
+        self._global: Dict[Hashable, NearDuplicateIndex] = {}
+        self._documents: "OrderedDict[Tuple[str, Hashable], NearDuplicateIndex]" = OrderedDict()
+        self.lookups = 0
+        self.document_reuses = 0
+        self.global_reuses = 0
+
+    def _document_index(self, namespace: Hashable, document_id: str, create: bool) -> Optional[NearDuplicateIndex]:
+        key = (document_id, namespace)
+        index = self._documents.get(key)
+        if index is None and create:
+            index = self._documents[key] = NearDuplicateIndex(self.threshold, self.max_entries)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        if index is not None:
+            self._documents.move_to_end(key)
+        return index
+
+    def find(self, namespace: Hashable, text: str,
+             document_id: Optional[str] = None) -> Optional[Tuple[Any, float]]:
+        """A stored result for a line similar to ``text``, with the similarity"""
+        self.lookups += 1
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return None
+        if document_id is not None:
+            index = self._document_index(namespace, document_id, create=False)
+            match = index.find(signature) if index is not None else None
+            if match is not None:
+                self.document_reuses += 1
+                return match
+        index = self._global.get(namespace)
+        match = index.find(signature) if index is not None else None
+        if match is not None:
+            self.global_reuses += 1
+        return match
+
+    def add(self, namespace: Hashable, text: str, value: Any, document_id: Optional[str] = None):
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return
+        if document_id is not None:
+            self._document_index(namespace, document_id, create=True).add(signature, value)
+        index = self._global.get(namespace)
+        if index is None:
+            index = self._global[namespace] = NearDuplicateIndex(self.global_threshold, self.max_entries)
+        index.add(signature, value)
+
+    def clear(self):
+        self._global.clear()
+        self._documents.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        reuses = self.document_reuses + self.global_reuses
+        return {
+            "threshold": self.threshold,
+            "global_threshold": self.global_threshold,
+            "lookups": self.lookups,
+            "reuses": reuses,
+            "document_reuses": self.document_reuses,
+            "global_reuses": self.global_reuses,
+            "reuse_rate": reuses / self.lookups if self.lookups else 0.0,
+            "global_entries": sum(len(index) for index in self._global.values()),
+            "documents": len(self._documents),
+        }
+
+
+# Global instance
+visualization_reuse_index = None
+
+def get_visualization_reuse_index() -> VisualizationReuseIndex:
+    global visualization_reuse_index
+    if visualization_reuse_index is None:
+        visualization_reuse_index = VisualizationReuseIndex()
+    return visualization_reuse_index
@@ -0,0 +1,120 @@
+import os
+import re
+import asyncio
+from typing import Dict, Any, Optional
+
+try:
+    import fitz # PyMuPDF
+except Exception: # pragma: no cover
+    fitz = None
+
+from PIL import Image
+
+from services.disk_cache import DiskLRUCache
+from services.pdf_extractor import run_in_pdf_worker
+from services.single_flight import SingleFlight
+
+
+# Fixed render zoom levels (1.0 = 72 dpi)
+ZOOM_LEVELS = {
+    "thumbnail": 0.25,
+    "medium": 1.0,
+    "full": 2.0,
+}
+WEBP_QUALITY = 80
+
+_SOURCE_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+def zoom_for_scale(scale: float) -> str:
+    """Snap a requested scale to the smallest fixed zoom level that covers it."""
+    for name, zoom in sorted(ZOOM_LEVELS.items(), key=lambda item: item[1]):
+        if zoom >= scale:
+            return name
+    return max(ZOOM_LEVELS, key=ZOOM_LEVELS.get)
+
+
+def page_image_url(source_id: str, page_index: int, zoom: str = "medium") -> str:
+    return f"/documents/sources/{source_id}/pages/{page_index}/image?zoom={zoom}"
+
+
+def _render_page(source_path: str, page_index: int, zoom: float) -> bytes:
+    """Worker entry point: render one PDF page to WebP bytes."""
+    import io
+    with fitz.open(source_path) as doc:
+        pix = doc[page_index].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    out = io.BytesIO()
+    image.save(out, format="WEBP", quality=WEBP_QUALITY)
+    return out.getvalue()
+
+
+class PageRendererService:
+    """Renders original PDF pages on demand into a content-addressed WebP cache.
+
+    Uploaded PDFs are kept under their SHA-256 (the source id), in their own
+    size-bounded LRU store; a source evicted from it can no longer be
+    rendered, but renders already cached are still served. Rendered pages are
+    cached per (source, page, zoom level), rendering runs in the PDF workers,
+    and concurrent requests for the same image share one render.
+    """
+
+    def __init__(self):
+        source_max_bytes = int(os.getenv("DOCUMENT_SOURCE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.sources = DiskLRUCache(os.getenv("DOCUMENT_SOURCE_DIR", "storage/sources"),
+                                    source_max_bytes, suffix=".pdf")
+        max_bytes = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.cache = DiskLRUCache(os.getenv("RENDER_CACHE_DIR", "cache/renders"), max_bytes, suffix=".webp")
+        self._renders = SingleFlight()
+        self.renders = 0
+
+    def store_source(self, path: str, source_id: str):
+        """Keep a copy of an uploaded PDF so its pages can be rendered later."""
+        if _SOURCE_ID.match(source_id):
+            self.sources.put_file(source_id, path)
+
+    async def render(self, source_id: str, page_index: int, zoom: str) -> Optional[str]:
+        """Return the path of the cached WebP rendering, rendering it if needed.
+
+        Returns None if the source is unknown or the page does not exist.
+        """
+        if not _SOURCE_ID.match(source_id) or zoom not in ZOOM_LEVELS or page_index < 0:
+            return None
+        key = f"{source_id}-{page_index}-{zoom}"
+
+        path = await asyncio.to_thread(self.cache.lookup, key)
+        if path is not None:
+            return path
+
+        return await self._renders.do(key, self._render_to_cache, key, source_id,
+                                      page_index, ZOOM_LEVELS[zoom])
+
+    async def _render_to_cache(self, key: str, source_id: str, page_index: int, zoom: float) -> Optional[str]:
+        source_path = await asyncio.to_thread(self.sources.lookup, source_id)
+        if source_path is None:
+            return None
+        try:
+            data = await run_in_pdf_worker(_render_page, source_path, page_index, zoom)
+        except IndexError:
+            return None
+        except Exception:
+            # The source may have been evicted since it was looked up
+            if not os.path.exists(source_path):
+                return None
+            raise
+        self.renders += 1
+        return await asyncio.to_thread(self.cache.put, key, data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"renders": self.renders, "coalesced": self._renders.coalesced, **self.cache.get_stats(),
+                "sources": self.sources.get_stats()}
+
+
+# Global instance
+page_renderer_service = None
+
+def get_page_renderer_service() -> PageRendererService:
+    global page_renderer_service
+    if page_renderer_service is None:
+        page_renderer_service = PageRendererService()
+    return page_renderer_service
@@ -1,7 +1,12 @@
 from __future__ import annotations
+import asyncio
+import codecs
 import io
-from typing import Dict, Any, List
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, AsyncIterator, BinaryIO, Iterator, List, Optional, Tuple
 
+import numpy as np
 
 try:
     import fitz # PyMuPDF
@@ -9,79 +14,327 @@ except Exception: # pragma: no cover
     fitz = None
 
 
-from models import DocumentLayout, Page, Line, Word
+from models import DocumentLayout, Page, Line, Word, WordDetail
+from services.compact_layout import WordColumns
 
 
-def extract_layout(file_bytes: bytes) -> DocumentLayout:
-    """Return a normalized layout with pages, lines, and optional word boxes.
+# Bump whenever extraction output changes, to invalidate cached layouts
+EXTRACTOR_VERSION = "2"
+
+# Text files are decoded incrementally in chunks of this many bytes and
+# split into synthetic pages of this many (non-blank) lines
+TEXT_CHUNK_SIZE = 1024 * 1024
+TEXT_PAGE_LINES = max(1, int(os.getenv("TEXT_PAGE_LINES", "50")))
+
+# Parallel extraction settings
+EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or (os.cpu_count() or 1)
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+PAGES_PER_SHARD = max(1, int(os.getenv("PDF_PAGES_PER_SHARD", "8")))
+
+# Plain-tuple page representation, cheap to pickle between processes:
+# (page_no, width, height, [(text, bbox, [(word, bbox), ...] or None), ...],
+#  compact word columns or None)
+# Pages extracted for compact or no word detail carry no per-word tuples.
+PageData = Tuple[int, Optional[float], Optional[float], List[tuple], Optional[str]]
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_serial_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _iter_text_lines(fp: BinaryIO) -> Iterator[str]:
+    """Decode a binary stream incrementally and yield its lines.
+
+    Equivalent to ``fp.read().decode(errors="ignore").splitlines()`` but only
+    holds one chunk (plus a partial line) in memory at a time.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending = ""
+    while True:
+        chunk = fp.read(TEXT_CHUNK_SIZE)
+        final = not chunk
+        pending += decoder.decode(chunk, final=final)
+        parts = pending.splitlines(keepends=True)
+        pending = ""
+        if not final and parts:
+            last = parts[-1]
+            # Keep an unterminated line, or a '\r' that may start a '\r\n'
+            if last.endswith("\r") or last.splitlines()[0] == last:
+                pending = parts.pop()
+        for part in parts:
+            yield part.splitlines()[0]
+        if final:
+            return
+
+
+def _text_pages(fp: BinaryIO) -> Iterator[Page]:
+    """Split a text stream on newlines into synthetic pages of ``TEXT_PAGE_LINES`` lines.
+
+    Pages are yielded as soon as they fill up, so memory use does not depend
+    on the size of the file.
+    """
+    pno = 0
+    lines: List[Line] = []
+    for text in _iter_text_lines(fp):
+        if not text.strip():
+            continue
+        lines.append(Line(index=len(lines), text=text))
+        if len(lines) == TEXT_PAGE_LINES:
+            yield Page(index=pno, lines=lines)
+            pno += 1
+            lines = []
+    if lines or pno == 0:
+        yield Page(index=pno, lines=lines)
+
+
+def _cluster_words(words: List[tuple],
+                   detail: WordDetail = WordDetail.FULL) -> Tuple[List[tuple], Optional[WordColumns]]:
+    """Group PyMuPDF word tuples into lines by (approx) y line buckets.
+
+    Words are ordered by (2pt y bucket, x0) and a new line starts wherever
+    the bucket changes; line boxes are the min/max of their word boxes.
+    Per-word tuples are only built for ``WordDetail.FULL``; compact pages
+    get their word columns straight from the sorted arrays instead.
+    """
+    word_boxes = [w[:4] for w in words]
+    boxes = np.array(word_boxes, dtype=np.float64)
+    buckets = np.round(boxes[:, 1] / 2) * 2
+    order = np.lexsort((boxes[:, 0], buckets))
+    boxes = boxes[order]
+    # Buckets are multiples of 2, so any change is a line break
+    starts = np.flatnonzero(np.diff(buckets[order], prepend=np.nan) != 0)
+    stops = np.append(starts[1:], len(words))
+
+    x0 = np.minimum(np.minimum.reduceat(boxes[:, 0], starts), 1e9).tolist()
+    y0 = np.minimum(np.minimum.reduceat(boxes[:, 1], starts), 1e9).tolist()
+    x1 = np.maximum(np.maximum.reduceat(boxes[:, 2], starts), -1e9).tolist()
+    y1 = np.maximum(np.maximum.reduceat(boxes[:, 3], starts), -1e9).tolist()
+
+    order = order.tolist()
+    texts = [words[i][4] for i in order]
+    full = detail == WordDetail.FULL
+    if full:
+        word_boxes = [word_boxes[i] for i in order]
+    line_items = []
+    for li, (start, stop) in enumerate(zip(starts.tolist(), stops.tolist())):
+        line_words = texts[start:stop]
+        bbox = (x0[li], y0[li], x1[li], y1[li]) if x0[li] < 1e9 else None
+        line_items.append((" ".join(line_words), bbox,
+                           list(zip(line_words, word_boxes[start:stop])) if full else None))
+
+    columns = None
+    if detail == WordDetail.COMPACT:
+        columns = WordColumns.from_arrays(np.append(starts, len(words)), texts, boxes)
+    return line_items, columns
+
+
+def _page_data(pno: int, page, detail: WordDetail = WordDetail.FULL) -> PageData:
+    """Cluster the words of a single PyMuPDF page into lines."""
+    width, height = page.rect.width, page.rect.height
+    line_items: List[tuple] = []
+    columns = None
+
+    # Extract words with boxes and then cluster into lines by y coordinate
+    words = page.get_text("words") # [x0,y0,x1,y1, word, block_no, line_no, word_no]
+    if not words:
+        # blocks fallback
+        for b in page.get_text("blocks"):
+            x0, y0, x1, y1, txt, *_ = b
+            for li, raw in enumerate(txt.splitlines()):
+                if raw.strip():
+                    line_items.append((raw, (x0,y0,x1,y1), None))
+        if detail == WordDetail.COMPACT:
+            columns = WordColumns.from_extracted([None] * len(line_items))
+    else:
+        line_items, columns = _cluster_words(words, detail)
+    return (pno, width, height, line_items, columns.to_base64() if columns is not None else None)
+
+
+def _build_page(data: PageData) -> Page:
+    """Materialize models from extracted page data (already validated shapes).
+
+    Word models are only created for pages extracted with per-word tuples;
+    compact pages already carry their encoded word columns.
+    """
+    pno, width, height, line_items, words_compact = data
+    lines = []
+    for index, (text, bbox, line_words) in enumerate(line_items):
+        if line_words is None:
+            lines.append(Line.model_construct(index=index, text=text, bbox=bbox))
+        else:
+            lines.append(Line.model_construct(
+                index=index, text=text, bbox=bbox,
+                words=[Word.model_construct(t=t, bbox=wb) for t, wb in line_words],
+            ))
+    page = Page.model_construct(index=pno, width=width, height=height, lines=lines)
+    if words_compact is not None:
+        page.words_compact = words_compact
+    return page
+
+
+def _extract_page(pno: int, page) -> Page:
+    return _build_page(_page_data(pno, page))
+
+
+def is_pdf(path: str) -> bool:
+    with open(path, "rb") as fp:
+        return fp.read(5) == b'%PDF-'
+
+
+def iter_pages(file_bytes: bytes) -> Iterator[Page]:
+    """Yield normalized pages one at a time, as soon as each is extracted.
     Falls back to a naive line split if PyMuPDF is unavailable or for non-PDF files.
     """
     try:
         # Try to detect if it's a PDF by checking the header
         if not file_bytes.startswith(b'%PDF-'):
             # Not a PDF file, treat as text
-            text = file_bytes.decode(errors="ignore")
-            lines = [Line(index=i, text=t) for i, t in enumerate(text.splitlines()) if t.strip()]
-            return DocumentLayout(pages=[Page(index=0, lines=lines)])
-        
+            yield from _text_pages(io.BytesIO(file_bytes))
+            return
+
         if fitz is None:
             # Fallback: naive single-page, split on newlines
-            text = file_bytes.decode(errors="ignore")
-            lines = [Line(index=i, text=t) for i, t in enumerate(text.splitlines()) if t.strip()]
-            return DocumentLayout(pages=[Page(index=0, lines=lines)])
+            yield from _text_pages(io.BytesIO(file_bytes))
+            return
 
         doc = fitz.open(stream=file_bytes, filetype="pdf")
     except Exception as e:
         # If PDF processing fails, fall back to text processing
         print(f"PDF processing failed, falling back to text: {e}")
-        text = file_bytes.decode(errors="ignore")
-        lines = [Line(index=i, text=t) for i, t in enumerate(text.splitlines()) if t.strip()]
-        return DocumentLayout(pages=[Page(index=0, lines=lines)])
-    pages: List[Page] = []
-
-    for pno, page in enumerate(doc):
-        width, height = page.rect.width, page.rect.height
-        line_items: List[Line] = []
-
-        # Extract words with boxes and then cluster into lines by y coordinate
-        words = page.get_text("words") # [x0,y0,x1,y1, word, block_no, line_no, word_no]
-        if not words:
-            # blocks fallback
-            for b in page.get_text("blocks"):
-                x0, y0, x1, y1, txt, *_ = b
-                for li, raw in enumerate(txt.splitlines()):
-                    if raw.strip():
-                        line_items.append(Line(index=len(line_items), text=raw, bbox=(x0,y0,x1,y1)))
-        else:
-            # group by (approx) y line buckets
-            words_sorted = sorted(words, key=lambda w: (round(w[1] / 2) * 2, w[0]))
-            current_y = None
-            current_line_words: List[Word] = []
-            current_bbox = [1e9,1e9,-1e9,-1e9]
-
-            def flush():
-                nonlocal current_line_words, current_bbox
-                if not current_line_words:
-                    return
-                text = " ".join(w.t for w in current_line_words)
-                bbox = tuple(current_bbox) if current_bbox[0] < 1e9 else None
-                line_items.append(Line(index=len(line_items), text=text, bbox=bbox, words=current_line_words))
-                current_line_words = []
-                current_bbox[:] = [1e9,1e9,-1e9,-1e9]
-
-            for x0,y0,x1,y1,w, *_ in words_sorted:
-                y_bucket = round(y0 / 2) * 2
-                if current_y is None:
-                    current_y = y_bucket
-                if abs(y_bucket - current_y) > 1.5: # new line
-                    flush()
-                    current_y = y_bucket
-                current_line_words.append(Word(t=w, bbox=(x0,y0,x1,y1)))
-                current_bbox[0] = min(current_bbox[0], x0)
-                current_bbox[1] = min(current_bbox[1], y0)
-                current_bbox[2] = max(current_bbox[2], x1)
-                current_bbox[3] = max(current_bbox[3], y1)
-            flush()
-        pages.append(Page(index=pno, width=width, height=height, lines=line_items))
-
-    return DocumentLayout(pages=pages)
\ No newline at end of file
+        yield from _text_pages(io.BytesIO(file_bytes))
+        return
+
+    with doc:
+        for pno, page in enumerate(doc):
+            yield _extract_page(pno, page)
+
+
+def extract_layout(file_bytes: bytes) -> DocumentLayout:
+    """Return a normalized layout with pages, lines, and optional word boxes.
+    Falls back to a naive line split if PyMuPDF is unavailable or for non-PDF files.
+    """
+    return DocumentLayout(pages=list(iter_pages(file_bytes)))
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+    return _process_pool
+
+
+def _get_serial_executor() -> ThreadPoolExecutor:
+    # PyMuPDF is not thread-safe, so all in-process work shares one thread
+    global _serial_executor
+    if _serial_executor is None:
+        _serial_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-extract")
+    return _serial_executor
+
+
+def shutdown_executor(wait: bool = False):
+    """Stop the extraction workers, if they were started."""
+    global _process_pool, _serial_executor
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=wait, cancel_futures=True)
+        _process_pool = None
+    if _serial_executor is not None:
+        _serial_executor.shutdown(wait=wait, cancel_futures=True)
+        _serial_executor = None
+
+
+async def run_in_pdf_worker(func, *args):
+    """Run a PyMuPDF job off the event loop.
+
+    Uses the process pool on multi-core hosts and the single extraction
+    thread otherwise; ``func`` must be a picklable module-level function.
+    """
+    executor = _get_process_pool() if EXTRACT_WORKERS >= 2 else _get_serial_executor()
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+def _page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def _extract_page_range(path: str, start: int, stop: int,
+                        words: WordDetail = WordDetail.FULL) -> List[PageData]:
+    """Worker entry point: extract pages ``[start, stop)`` of the PDF at ``path``."""
+    with fitz.open(path) as doc:
+        return [_page_data(pno, doc[pno], words) for pno in range(start, stop)]
+
+
+def _build_pages(shard: List[PageData]) -> List[Page]:
+    return [_build_page(data) for data in shard]
+
+
+def _shard_ranges(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    # Keep shards small enough that every worker gets one and the first
+    # pages come back quickly, but large enough to amortize the IPC cost.
+    per_worker = -(-page_count // workers)
+    size = max(1, min(PAGES_PER_SHARD, per_worker))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+async def _iter_shards(path: str, page_count: int, words: WordDetail) -> AsyncIterator[List[PageData]]:
+    loop = asyncio.get_running_loop()
+    if EXTRACT_WORKERS < 2 or page_count < PARALLEL_MIN_PAGES:
+        executor = _get_serial_executor()
+        for start, stop in _shard_ranges(page_count, 1):
+            yield await loop.run_in_executor(executor, _extract_page_range, path, start, stop, words)
+        return
+
+    executor = _get_process_pool()
+    futures = [
+        loop.run_in_executor(executor, _extract_page_range, path, start, stop, words)
+        for start, stop in _shard_ranges(page_count, EXTRACT_WORKERS)
+    ]
+    try:
+        for future in futures:
+            yield await future
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+async def _aiter_text_pages(path: str) -> AsyncIterator[Page]:
+    # Produce one page per thread hop so pages stream out as they are decoded
+    with open(path, "rb") as fp:
+        pages = _text_pages(fp)
+        while True:
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                return
+            yield page
+
+
+async def aiter_pages(path: str, words: WordDetail = WordDetail.FULL) -> AsyncIterator[Page]:
+    """Async variant of ``iter_pages`` for a file on disk that never blocks the event loop.
+
+    PDFs are opened by path; the page ranges of large ones are sharded across
+    a process pool and pages are yielded in document order as soon as each
+    shard completes. Text files are decoded incrementally off the loop thread.
+    ``words`` selects how per-word boxes are represented.
+    """
+    loop = asyncio.get_running_loop()
+    if fitz is None or not await asyncio.to_thread(is_pdf, path):
+        async for page in _aiter_text_pages(path):
+            yield page
+        return
+
+    try:
+        page_count = await loop.run_in_executor(_get_serial_executor(), _page_count, path)
+    except Exception as e:
+        # If PDF processing fails, fall back to text processing
+        print(f"PDF processing failed, falling back to text: {e}")
+        async for page in _aiter_text_pages(path):
+            yield page
+        return
+
+    async for shard in _iter_shards(path, page_count, words):
+        for page in await asyncio.to_thread(_build_pages, shard):
+            yield page
+
+
+async def extract_layout_async(path: str, words: WordDetail = WordDetail.FULL) -> DocumentLayout:
+    """Awaitable layout extraction of a file on disk, backed by the parallel extraction pool."""
+    return DocumentLayout(pages=[page async for page in aiter_pages(path, words)])
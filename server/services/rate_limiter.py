@@ -0,0 +1,200 @@
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status carried by an SDK error, if any"""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    # requests.HTTPError and similar keep it on the response
+    response = getattr(error, "response", None)
+    code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_throttled(error: BaseException) -> bool:
+    """Whether the server asked us to slow down (quota or overload)"""
+    return status_code(error) in (429, 503)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed request is worth trying again"""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    code = status_code(error)
+    return code is not None and (code in (408, 429) or code >= 500)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate_per_minute``.
+
+    A rate of zero disables the bucket. Requests larger than the capacity
+    are clamped to it so they can still go through once the bucket is full.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        """Take ``amount`` tokens if they are available now"""
+        if self.rate <= 0:
+            return True
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    async def acquire(self, amount: float = 1.0):
+        """Wait until ``amount`` tokens are available and take them"""
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrencyLimit:
+    """Concurrency limit adjusted by additive increase, multiplicative decrease.
+
+    Each success grows the limit by roughly one per limit's worth of
+    completed requests; a throttling response halves it, at most once per
+    ``cooldown`` seconds so a burst of 429s counts as a single signal.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, initial: Optional[int] = None,
+                 decrease_factor: float = 0.5, cooldown: float = 1.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial if initial is not None else self.max_limit)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.decreases = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed a slot just as we got cancelled; pass it on
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def on_success(self):
+        self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.decreases += 1
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter"""
+
+    def __init__(self, max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retry number ``attempt`` (starting at 0)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class RateLimiter:
+    """Client-side admission control for an API with RPM and TPM quotas.
+
+    A request first waits for the request and token buckets, then for a slot
+    under the adaptive concurrency limit. ``queued`` counts requests waiting
+    at either stage.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 max_concurrency: int, min_concurrency: int = 1):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrencyLimit(max_concurrency, min_concurrency)
+        self.queued = 0
+        self.max_queued = 0
+
+    async def acquire(self, tokens: int = 0):
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await self.requests.acquire(1)
+            if tokens:
+                await self.tokens.acquire(tokens)
+            await self.concurrency.acquire()
+        finally:
+            self.queued -= 1
+
+    def release(self, error: Optional[BaseException] = None):
+        """Give back a slot, feeding the outcome into the concurrency limit"""
+        if error is None:
+            self.concurrency.on_success()
+        elif is_throttled(error):
+            self.concurrency.on_throttle()
+        self.concurrency.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queued,
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "max_concurrency": self.concurrency.max_limit,
+            "limit_decreases": self.concurrency.decreases,
+            "requests_per_minute": self.requests.rate * 60,
+            "tokens_per_minute": self.tokens.rate * 60,
+        }
@@ -0,0 +1,116 @@
+import os
+import re
+from functools import lru_cache
+from typing import FrozenSet, List, NamedTuple
+
+import numpy as np
+
+
+_WORDS_PATH = os.path.join(os.path.dirname(__file__), "data", "familiar_words.txt")
+
+_WORD = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+_VOWEL_GROUP = re.compile(r"[aeiouy]+")
+_SENTENCE_END = re.compile(r"[.!?]+(?:\s|$)")
+_SUFFIXES = ("'s", "ing", "ed", "es", "s", "ly", "er", "est")
+
+
+@lru_cache(maxsize=1)
+def familiar_words() -> FrozenSet[str]:
+    """Common words a young reader is expected to know"""
+    with open(_WORDS_PATH, encoding="utf-8") as f:
+        return frozenset(line.strip() for line in f if line.strip())
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall(text)
+
+
+@lru_cache(maxsize=65536)
+def word_features(word: str):
+    """(syllables, is_familiar) for a lowercase word"""
+    syllables = len(_VOWEL_GROUP.findall(word))
+    if word.endswith("e") and syllables > 1 and not word.endswith("le"):
+        syllables -= 1
+    known = familiar_words()
+    familiar = word in known or any(
+        word.endswith(suffix) and word[:-len(suffix)] in known for suffix in _SUFFIXES)
+    return max(1, syllables), familiar
+
+
+class Corpus(NamedTuple):
+    """Lines tokenized into flat per-word arrays.
+
+    ``owner`` maps every word to its line; per-line values are reduced from
+    the word arrays with ``np.bincount``.
+    """
+    words: List[str]
+    owner: np.ndarray
+    counts: np.ndarray
+    sentences: np.ndarray
+    syllables: np.ndarray
+    familiar: np.ndarray
+
+    def per_line(self, values: np.ndarray) -> np.ndarray:
+        """Sum a per-word array for each line"""
+        return np.bincount(self.owner, values, len(self.counts))
+
+
+def tokenize_corpus(texts: List[str]) -> Corpus:
+    """Tokenize lines and look up word features once per distinct word"""
+    line_count = len(texts)
+    tokens = [tokenize(text) for text in texts]
+    counts = np.fromiter((len(t) for t in tokens), dtype=np.int64, count=line_count)
+    words = [word for line in tokens for word in line]
+    owner = np.repeat(np.arange(line_count), counts)
+    sentences = np.fromiter((max(1, len(_SENTENCE_END.findall(t))) for t in texts),
+                            dtype=np.float64, count=line_count)
+
+    # Features are computed per distinct word and gathered back by index
+    vocabulary = {}
+    inverse = np.fromiter((vocabulary.setdefault(w.lower(), len(vocabulary)) for w in words),
+                          dtype=np.int64, count=len(words))
+    features = [word_features(word) for word in vocabulary]
+    syllables = np.fromiter((f[0] for f in features), dtype=np.float64, count=len(features))
+    familiar = np.fromiter((f[1] for f in features), dtype=bool, count=len(features))
+
+    return Corpus(words, owner, counts, sentences, syllables[inverse], familiar[inverse])
+
+
+class Readability(NamedTuple):
+    """Standard readability metrics, one array entry per line"""
+    words_per_sentence: np.ndarray
+    syllables_per_word: np.ndarray
+    unfamiliar_fraction: np.ndarray
+    flesch_kincaid_grade: np.ndarray
+    dale_chall_score: np.ndarray
+    difficulty: np.ndarray
+
+
+def readability(corpus: Corpus) -> Readability:
+    """Compute readability metrics for every line of a corpus at once.
+
+    ``difficulty`` folds Flesch-Kincaid grade, the Dale-Chall-style score
+    (against the bundled familiar word list) and sentence length into 0-1,
+    with empty lines at 0.
+    """
+    n = np.maximum(corpus.counts, 1).astype(np.float64)
+    words_per_sentence = corpus.counts / corpus.sentences
+    syllables_per_word = corpus.per_line(corpus.syllables) / n
+    unfamiliar = corpus.per_line((~corpus.familiar).astype(np.float64)) / n
+
+    grade = 0.39 * words_per_sentence + 11.8 * syllables_per_word - 15.59
+    dale_chall = 15.79 * unfamiliar + 0.0496 * words_per_sentence + np.where(unfamiliar > 0.05, 3.6365, 0.0)
+
+    # Grade 12+, a Dale-Chall score of 10+ (college) and 25+ word sentences
+    # each read as fully difficult
+    difficulty = (0.4 * np.clip(grade / 12.0, 0.0, 1.0)
+                  + 0.4 * np.clip((dale_chall - 4.0) / 6.0, 0.0, 1.0)
+                  + 0.2 * np.clip(words_per_sentence / 25.0, 0.0, 1.0))
+    difficulty = np.where(corpus.counts == 0, 0.0, difficulty)
+
+    return Readability(words_per_sentence, syllables_per_word, unfamiliar, grade, dale_chall, difficulty)
+
+
+def reading_difficulty(texts: List[str]) -> np.ndarray:
+    """Deterministic 0-1 reading difficulty for each line"""
+    return readability(tokenize_corpus(texts)).difficulty
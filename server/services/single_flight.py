@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+def prompt_key(*parts: str) -> str:
+    """Hash the parts of a prompt (model name, prompt text, ...) into a key"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the work as a task; callers arriving
+    while it runs await the same task and get the same result or exception.
+    The task is shielded from its callers, so a caller going away (e.g. a
+    client disconnecting) does not cancel the work for everyone else; it is
+    cancelled once the last caller waiting for it has gone away.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        # Callers currently awaiting each task
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        task = self._tasks.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.calls += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._leave(key, task)
+
+    def _leave(self, key: Hashable, task: asyncio.Task):
+        waiters = self._waiters.pop(task) - 1
+        if waiters:
+            self._waiters[task] = waiters
+        elif not task.done():
+            # Nobody wants the result any more; new callers start afresh
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+            task.cancel()
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the outcome retrieved so failures nobody waited for are not
+        # reported as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": self.in_flight}
@@ -0,0 +1,72 @@
+import os
+import re
+import asyncio
+import hashlib
+import tempfile
+from typing import Optional
+from fastapi import HTTPException, UploadFile
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def parse_size(value: str) -> int:
+    """Parse sizes such as ``50MB``, ``512KB`` or a plain byte count."""
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?B?)\s*", value.upper())
+    if not match:
+        raise ValueError(f"Invalid size: {value!r}")
+    number, unit = match.groups()
+    return int(number) * {"": 1, "B": 1, "K": 1024, "KB": 1024,
+                          "M": 1024 ** 2, "MB": 1024 ** 2,
+                          "G": 1024 ** 3, "GB": 1024 ** 3}[unit]
+
+
+MAX_DOCUMENT_SIZE = parse_size(os.getenv("MAX_DOCUMENT_SIZE", "50MB"))
+
+
+class SpooledUpload:
+    """An uploaded file streamed to a temporary file on disk.
+
+    The content is never held in memory as a whole; extraction works from
+    ``path``. ``sha256`` is computed while spooling.
+    """
+
+    def __init__(self, path: str, filename: Optional[str], size: int, sha256: str):
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+async def spool_upload(file: UploadFile, max_size: int = MAX_DOCUMENT_SIZE) -> SpooledUpload:
+    """Copy an upload to a temporary file in fixed-size chunks.
+
+    Raises a 413 as soon as more than ``max_size`` bytes have been received
+    and a 400 for empty files.
+    """
+    fd, path = tempfile.mkstemp(prefix="upload_")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(413, f"File too large (limit {max_size} bytes)")
+                hasher.update(chunk)
+                await asyncio.to_thread(fp.write, chunk)
+        if size == 0:
+            raise HTTPException(400, "Empty file")
+    except BaseException:
+        os.unlink(path)
+        raise
+    return SpooledUpload(path, file.filename, size, hasher.hexdigest())
@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.gemini_service import get_gemini_service
+from services.mongodb_service import get_mongodb_service
+from services.ws_manager import manager
+
+
+# Pages around the reader's position whose visualizations are generated
+VISUALIZATION_PREFETCH_AHEAD = int(os.getenv("VISUALIZATION_PREFETCH_AHEAD", "2"))
+VISUALIZATION_PREFETCH_BEHIND = int(os.getenv("VISUALIZATION_PREFETCH_BEHIND", "0"))
+
+# Lines above this importance get a visualization
+VISUALIZATION_MIN_IMPORTANCE = float(os.getenv("VISUALIZATION_MIN_IMPORTANCE", "0.7"))
+
+# Visualizations generated at the same time, across all readers
+VISUALIZATION_WORKERS = int(os.getenv("VISUALIZATION_WORKERS", "4"))
+
+# A reader who has not reported a position for this long no longer keeps
+# their window's work alive
+VISUALIZATION_VIEWER_TTL = float(os.getenv("VISUALIZATION_VIEWER_TTL_SECONDS", "300"))
+
+# (document id, page position, line position)
+LineKey = Tuple[str, int, int]
+
+
+def document_topic(document_id: str) -> str:
+    return f"document:{document_id}"
+
+
+class VisualizationScheduler:
+    """Generates visualizations for the pages readers are looking at.
+
+    Each reader (a WebSocket session, or the user) reports a position; the
+    scheduler keeps a prefetch window of pages around it and generates
+    visualizations for the important lines inside, a bounded number at a
+    time. Work on pages that left every reader's window is cancelled.
+    Results are written back onto the stored document and published on the
+    topic ``document:<id>``.
+    """
+
+    def __init__(self, ahead: int = VISUALIZATION_PREFETCH_AHEAD,
+                 behind: int = VISUALIZATION_PREFETCH_BEHIND,
+                 min_importance: float = VISUALIZATION_MIN_IMPORTANCE,
+                 workers: int = VISUALIZATION_WORKERS):
+        self.ahead = max(0, ahead)
+        self.behind = max(0, behind)
+        self.min_importance = min_importance
+        self.workers = max(1, workers)
+        # document id -> viewer -> (first page, last page, expiry)
+        self._windows: Dict[str, Dict[str, Tuple[int, int, float]]] = {}
+        self._tasks: Dict[LineKey, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def _window(self, page: int) -> Tuple[int, int]:
+        return max(0, page - self.behind), page + self.ahead
+
+    def _expire_windows(self) -> int:
+        """Forget readers of any document who stopped reporting, cancelling
+        work only they needed"""
+        now = time.monotonic()
+        cancelled = 0
+        for document_id, viewers in list(self._windows.items()):
+            if any(expires < now for _, _, expires in viewers.values()):
+                cancelled += self._cancel_outside(document_id)
+        return cancelled
+
+    def _active_windows(self, document_id: str) -> List[Tuple[int, int]]:
+        now = time.monotonic()
+        viewers = self._windows.get(document_id, {})
+        for viewer, (_, _, expires) in list(viewers.items()):
+            if expires < now:
+                del viewers[viewer]
+        if not viewers:
+            self._windows.pop(document_id, None)
+        return [(first, last) for first, last, _ in viewers.values()]
+
+    async def update_position(self, document_id: str, user_id: str, page: int,
+                              viewer: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Record a reader's page position and reschedule work around it.
+
+        Positions past the end of the document are clamped to its last page.
+        Returns None if the document does not exist.
+        """
+        viewer = viewer or user_id
+        mongodb = await get_mongodb_service()
+        first, last = self._window(page)
+        document = await mongodb.get_document_pages(document_id, user_id, first, last - first + 1)
+        if document is None:
+            return None
+        page_count = document["page_count"]
+        if page_count == 0:
+            return {"page": 0, "window": None, "scheduled": 0,
+                    "cancelled": self.leave(document_id, viewer), "pending": 0}
+        if page >= page_count:
+            page = page_count - 1
+            first, last = self._window(page)
+            document = await mongodb.get_document_pages(document_id, user_id, first, last - first + 1)
+            if document is None:
+                return None
+        last = min(last, page_count - 1)
+
+        self._expire_windows()
+        self._windows.setdefault(document_id, {})[viewer] = (
+            first, last, time.monotonic() + VISUALIZATION_VIEWER_TTL)
+
+        scheduled = 0
+        for page_position, page_data in enumerate(document["pages"], first):
+            for line_position, line in enumerate(page_data.get("lines", [])):
+                key = (document_id, page_position, line_position)
+                if (line.get("visualization") is None
+                        and line.get("importance_score", 0) > self.min_importance
+                        and key not in self._tasks):
+                    self._tasks[key] = asyncio.create_task(
+                        self._generate(key, user_id, page_data["index"], line))
+                    scheduled += 1
+        self.scheduled += scheduled
+
+        cancelled = self._cancel_outside(document_id)
+        pending = sum(1 for key in self._tasks if key[0] == document_id)
+        return {"page": page, "window": [first, last],
+                "scheduled": scheduled, "cancelled": cancelled, "pending": pending}
+
+    def _cancel_outside(self, document_id: str) -> int:
+        """Cancel work on pages no reader of the document is near"""
+        windows = self._active_windows(document_id)
+        cancelled = 0
+        for key, task in list(self._tasks.items()):
+            if key[0] == document_id and not any(first <= key[1] <= last for first, last in windows):
+                task.cancel()
+                del self._tasks[key]
+                cancelled += 1
+        self.cancelled += cancelled
+        return cancelled
+
+    def leave(self, document_id: str, viewer: str) -> int:
+        """Forget a reader's window, cancelling work only they needed"""
+        self._windows.get(document_id, {}).pop(viewer, None)
+        return self._cancel_outside(document_id)
+
+    async def _generate(self, key: LineKey, user_id: str, page_index: int, line: Dict[str, Any]):
+        document_id, page_position, line_position = key
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        try:
+            async with self._semaphore:
+                visualization = await get_gemini_service().generate_visualization(
+                    line["text"], line["index"], document_id=document_id)
+            mongodb = await get_mongodb_service()
+            await mongodb.set_line_visualization(document_id, user_id, page_position,
+                                                 line_position, visualization)
+            await manager.publish(document_topic(document_id), {
+                "type": "visualization",
+                "document_id": document_id,
+                "page_index": page_index,
+                "line_index": line["index"],
+                "visualization": visualization,
+            })
+            self.completed += 1
+        except Exception as e:
+            print(f"Error generating visualization for {document_id} page {page_index}: {e}")
+            self.failed += 1
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._expire_windows()
+        return {
+            "pending": len(self._tasks),
+            "readers": sum(len(viewers) for viewers in self._windows.values()),
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+        }
+
+    async def shutdown(self):
+        """Cancel all pending work"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Global instance
+visualization_scheduler = None
+
+def get_visualization_scheduler() -> VisualizationScheduler:
+    global visualization_scheduler
+    if visualization_scheduler is None:
+        visualization_scheduler = VisualizationScheduler()
+    return visualization_scheduler
@@ -1,17 +1,20 @@
 from __future__ import annotations
-from typing import Dict
+from typing import Dict, Set
 from fastapi import WebSocket
 
 class WSManager:
     def __init__(self):
         self.active: Dict[str, WebSocket] = {}
+        # topic -> session ids that receive its messages, and the reverse
+        self.subscriptions: Dict[str, Set[str]] = {}
+        self.session_topics: Dict[str, Set[str]] = {}
 
     async def connect(self, session_id: str, websocket: WebSocket):
         await websocket.accept()
         self.active[session_id] = websocket
 
     async def disconnect(self, session_id: str):
-        ws = self.active.pop(session_id, None)
+        ws = self._forget(session_id)
         if ws:
             try:
                 await ws.close()
@@ -23,4 +26,46 @@ class WSManager:
         if ws:
             await ws.send_json(data)
 
-manager = WSManager()
\ No newline at end of file
+    async def broadcast_json(self, data):
+        for session_id in list(self.active):
+            await self._send_quietly(session_id, data)
+
+    def subscribe(self, session_id: str, topic: str) -> bool:
+        """Subscribe a connected session; unknown session ids are ignored"""
+        if session_id not in self.active:
+            return False
+        self.subscriptions.setdefault(topic, set()).add(session_id)
+        self.session_topics.setdefault(session_id, set()).add(topic)
+        return True
+
+    def unsubscribe(self, session_id: str, topic: str):
+        sessions = self.subscriptions.get(topic)
+        if sessions is not None:
+            sessions.discard(session_id)
+            if not sessions:
+                del self.subscriptions[topic]
+        topics = self.session_topics.get(session_id)
+        if topics is not None:
+            topics.discard(topic)
+            if not topics:
+                del self.session_topics[session_id]
+
+    def _forget(self, session_id: str):
+        """Drop a session and its subscriptions, returning its socket"""
+        for topic in list(self.session_topics.get(session_id, ())):
+            self.unsubscribe(session_id, topic)
+        return self.active.pop(session_id, None)
+
+    async def publish(self, topic: str, data):
+        """Send to every session subscribed to ``topic``"""
+        for session_id in list(self.subscriptions.get(topic, ())):
+            await self._send_quietly(session_id, data)
+
+    async def _send_quietly(self, session_id: str, data):
+        # A dead socket must not break delivery to the others
+        try:
+            await self.send_json(session_id, data)
+        except Exception:
+            self._forget(session_id)
+
+manager = WSManager()
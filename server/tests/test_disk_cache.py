@@ -0,0 +1,49 @@
+import os
+import threading
+
+from services.disk_cache import DiskLRUCache
+
+
+def write(path, size):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def test_concurrent_put_file_of_same_key(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / "cache"), 1024 * 1024, suffix=".pdf")
+    sources = [write(str(tmp_path / f"upload{i}"), 1000) for i in range(8)]
+    results, errors = [], []
+    barrier = threading.Barrier(len(sources))
+
+    def store(source):
+        barrier.wait()
+        try:
+            results.append(cache.put_file("source", source))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=store, args=(source,)) for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == [cache.path("source")] * len(sources)
+    assert cache.get_stats()["bytes"] == 1000
+    assert os.listdir(tmp_path / "cache") == ["source.pdf"]
+
+
+def test_put_file_evicts_least_recently_used(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / "cache"), 2500, suffix=".pdf")
+    for key in ("a", "b"):
+        cache.put_file(key, write(str(tmp_path / key), 1000))
+    cache.lookup("a")
+    cache.put_file("c", write(str(tmp_path / "c"), 1000))
+
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") is not None
+    assert sorted(os.listdir(tmp_path / "cache")) == ["a.pdf", "c.pdf"]
+    # Entries survive a restart
+    assert DiskLRUCache(str(tmp_path / "cache"), 2500, suffix=".pdf").get_stats()["bytes"] == 2000
@@ -0,0 +1,126 @@
+import asyncio
+from types import SimpleNamespace
+
+import services.enrichment_jobs as enrichment_jobs
+import services.gemini_service as gemini_module
+from benchmarks.fake_gemini import canned_response
+from models import DocumentLayout, Line, Page, WordDetail
+
+
+LINES = [
+    '"We have to find the map before sunset," said Harriet Vane.',
+    "Peter Wimsey unfolded the letter and read it twice by the window.",
+    "The storm had washed away the only bridge across the river.",
+]
+
+
+class FakeClient:
+    def __init__(self, fail: bool, latency: float = 0.0, fenced: bool = False):
+        self.fail = fail
+        self.latency = latency
+        self.fenced = fenced
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def generate(self, model, prompt, coalesce=False):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        if self.fail:
+            raise RuntimeError("429 Resource has been exhausted")
+        text = canned_response(prompt)
+        if self.fenced:
+            text = f"```json\n{text}\n```"
+        return SimpleNamespace(text=text)
+
+
+class FakeLayoutCache:
+    def __init__(self):
+        self.stored = {}
+
+    def put(self, key, layout):
+        self.stored[key] = layout
+
+
+def run_enrichment(monkeypatch, fail: bool, fenced: bool = False):
+    gemini = gemini_module.GeminiService()
+    gemini.api_key = "test"
+    gemini.model_name = "test"
+    gemini.client = FakeClient(fail, fenced=fenced)
+    cache = FakeLayoutCache()
+
+    async def save_document(layout, file_name, file_size, user_id):
+        return "document"
+
+    monkeypatch.setattr(gemini_module, "get_analysis_cache", lambda: None)
+    monkeypatch.setattr(gemini_module, "triage_lines", lambda texts: {})
+    monkeypatch.setattr(enrichment_jobs, "get_gemini_service", lambda: gemini)
+    monkeypatch.setattr(enrichment_jobs, "get_layout_cache", lambda: cache)
+    monkeypatch.setattr(enrichment_jobs, "save_document", save_document)
+
+    layout = DocumentLayout(pages=[Page(index=0, lines=[Line(index=i, text=text)
+                                                         for i, text in enumerate(LINES)])])
+
+    async def enrich():
+        failures = {}
+        async for _ in enrichment_jobs.enrich_layout(layout, WordDetail.FULL, failures=failures):
+            pass
+        document_id = await enrichment_jobs.persist_document(
+            layout, "sha256", WordDetail.FULL, "book.pdf", 100, "user", failures)
+        return failures, document_id
+
+    failures, document_id = asyncio.run(enrich())
+    assert gemini.client.calls > 0
+    return failures, document_id, cache
+
+
+def test_failed_enrichment_is_not_cached(monkeypatch):
+    failures, document_id, cache = run_enrichment(monkeypatch, fail=True)
+    assert failures["lines"] == len(LINES)
+    assert failures["genre"] == 1
+    assert failures.get("characters", 0) >= 1
+    # The degraded document is still saved for this upload
+    assert document_id == "document"
+    assert cache.stored == {}
+
+
+def test_successful_enrichment_is_cached(monkeypatch):
+    failures, document_id, cache = run_enrichment(monkeypatch, fail=False)
+    assert failures == {}
+    assert document_id == "document"
+    assert list(cache.stored) == ["sha256"]
+
+
+def test_fenced_replies_are_not_failures(monkeypatch):
+    failures, document_id, cache = run_enrichment(monkeypatch, fail=False, fenced=True)
+    assert failures == {}
+    assert cache.stored["sha256"].genre in ("fiction", "non-fiction")
+
+
+def test_pages_are_analyzed_concurrently_in_shared_batches(monkeypatch):
+    gemini = gemini_module.GeminiService()
+    gemini.api_key = "test"
+    gemini.model_name = "test"
+    gemini.client = FakeClient(fail=False, latency=0.05)
+    monkeypatch.setattr(gemini_module, "get_analysis_cache", lambda: None)
+    monkeypatch.setattr(gemini_module, "triage_lines", lambda texts: {})
+    monkeypatch.setattr(gemini_module, "ANALYSIS_BATCH_LINES", 6)
+
+    # Ten short pages, each well under one batch
+    pages = [[Line(index=i, text=f"{text} (page {page})") for i, text in enumerate(LINES)]
+             for page in range(10)]
+
+    async def analyze():
+        return [item async for item in gemini.analyze_pages(pages)]
+
+    results = asyncio.run(analyze())
+    assert sorted(position for position, _ in results) == list(range(10))
+    assert all(line.importance_score is not None for _, lines in results for line in lines)
+    # Two pages per request, and the requests overlap
+    assert gemini.client.calls == 5
+    assert gemini.client.max_in_flight > 1
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+import services.enrichment_jobs as enrichment_jobs
+from models import DocumentLayout, Line, Page, WordDetail
+
+
+def make_layout():
+    return DocumentLayout(pages=[Page(index=0, lines=[Line(index=0, text="The storm broke.")])])
+
+
+async def wait_for_status(service, job_id, statuses):
+    for _ in range(200):
+        job = await service.get_job(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job stayed {job['status']}")
+
+
+def test_failed_job_removes_its_checkpoint(monkeypatch, tmp_path):
+    async def enrich_layout(layout, words, stage, pages_done, failures):
+        raise RuntimeError("model unavailable")
+        yield
+
+    monkeypatch.setattr(enrichment_jobs, "enrich_layout", enrich_layout)
+    service = enrichment_jobs.EnrichmentJobService(str(tmp_path), workers=1)
+
+    async def run():
+        job_id = await service.submit(make_layout(), "user", WordDetail.FULL)
+        job = await wait_for_status(service, job_id, ("failed",))
+        await service.stop()
+        return job_id, job
+
+    job_id, job = asyncio.run(run())
+    assert job["error"] == "model unavailable"
+    assert not os.path.exists(service._layout_path(job_id))
+
+
+def test_cancel_during_save_is_not_overwritten(monkeypatch, tmp_path):
+    service = enrichment_jobs.EnrichmentJobService(str(tmp_path), workers=1)
+
+    async def enrich_layout(layout, words, stage, pages_done, failures):
+        return
+        yield
+
+    async def persist_document(layout, cache_key, words, file_name, file_size, user_id, failures):
+        # The cancel lands while the document is being saved
+        job_id = next(iter(service._running))
+        assert await asyncio.to_thread(service._finish, job_id, "cancelled")
+        return "document"
+
+    monkeypatch.setattr(enrichment_jobs, "enrich_layout", enrich_layout)
+    monkeypatch.setattr(enrichment_jobs, "persist_document", persist_document)
+
+    async def run():
+        job_id = await service.submit(make_layout(), "user", WordDetail.FULL)
+        await wait_for_status(service, job_id, ("cancelled", "completed"))
+        await asyncio.sleep(0.05)
+        job = await service.get_job(job_id)
+        await service.stop()
+        return job
+
+    job = asyncio.run(run())
+    assert job["status"] == "cancelled"
+    assert job["document_id"] is None
+    assert not asyncio.run(service.cancel(job["id"]))
@@ -0,0 +1,23 @@
+from services.line_scorer import score_lines, triage_lines
+
+
+LINES = [
+    "He went home.",
+    "It was a bright cold day in April, and the clocks were striking thirteen.",
+    '"Professor McGonagall!" whispered Hermione Granger urgently across the Gryffindor common room.',
+]
+
+
+def test_triage_keeps_only_the_ambiguous_band_for_the_model():
+    low, middle, high = score_lines(LINES).importance
+    assert low < 0.3 <= middle < 0.85 <= high
+
+    local = triage_lines(LINES, max_importance=0.3, min_importance=0.85)
+    assert sorted(local) == [0, 2]
+    assert local[2]["importance_score"] >= 0.85
+    assert local[2]["character"] == "Hermione"
+
+
+def test_triage_can_be_disabled():
+    assert triage_lines(LINES, max_importance=0, min_importance=1.01) == {}
+    assert sorted(triage_lines(LINES, max_importance=0, min_importance=0.85)) == [2]
@@ -0,0 +1,144 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import numpy as np
+
+import services.gemini_service as gemini_module
+import services.image_generator as image_module
+from benchmarks.fake_gemini import canned_response
+from services.near_duplicates import (
+    MinHasher,
+    VisualizationReuseIndex,
+    _MERSENNE_PRIME,
+    _mul_mod_mersenne,
+    shingles,
+)
+
+
+WORDS = ("the cat sat on a mat while dog ran far away into dark forest "
+         "where an old wizard lived quietly alone").split()
+
+
+def exact_jaccard(a: str, b: str) -> float:
+    sa, sb = set(shingles(a)), set(shingles(b))
+    return len(sa & sb) / len(sa | sb)
+
+
+def estimated_jaccard(hasher: MinHasher, a: str, b: str) -> float:
+    return float(np.mean(hasher.signature(a) == hasher.signature(b)))
+
+
+def test_mul_mod_matches_exact_arithmetic():
+    rnd = random.Random(0)
+    a = np.array([rnd.randrange(1, _MERSENNE_PRIME) for _ in range(1000)], dtype=np.uint64)
+    x = np.array([rnd.randrange(0, 1 << 32) for _ in range(1000)], dtype=np.uint64)
+    result = _mul_mod_mersenne(a, x)
+    assert [int(r) for r in result] == [int(ai) * int(xi) % _MERSENNE_PRIME for ai, xi in zip(a, x)]
+
+
+def test_estimate_tracks_exact_jaccard():
+    hasher = MinHasher()
+    rnd = random.Random(1)
+    errors = []
+    for _ in range(300):
+        words = rnd.choices(WORDS, k=10)
+        edited = list(words)
+        for _ in range(rnd.randint(0, 6)):
+            edited[rnd.randrange(len(edited))] = rnd.choice(WORDS)
+        a, b = " ".join(words), " ".join(edited)
+        errors.append(estimated_jaccard(hasher, a, b) - exact_jaccard(a, b))
+    errors = np.array(errors)
+    # 64 permutations give a standard error of at most sqrt(0.25 / 64) = 0.0625
+    assert abs(errors.mean()) < 0.02
+    assert errors.std() < 0.075
+    assert np.abs(errors).max() < 0.25
+
+
+def test_dissimilar_lines_are_not_reused():
+    index = VisualizationReuseIndex()
+    index.add("image", "Harry opened the door", {"scene": "open door"}, "doc")
+    index.add("image", "The dog did not bark at the stranger.", {"scene": "quiet dog"}, "doc")
+
+    for line in ("Harry closed the door", "The dog barked at the stranger."):
+        match = index.find("image", line, "doc")
+        assert match is None
+
+
+def test_near_duplicate_is_reused():
+    index = VisualizationReuseIndex()
+    index.add("image", "Harry opened the heavy wooden door slowly.", {"scene": "door"}, "doc")
+    match = index.find("image", "Harry opened the heavy wooden door slowly!", "doc")
+    assert match is not None
+    assert match[0] == {"scene": "door"}
+
+
+class ReplyClient:
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = 0
+
+    async def generate(self, model, prompt, coalesce=False):
+        self.calls += 1
+        return SimpleNamespace(text=self.reply(prompt))
+
+
+def visualize_twice(monkeypatch, reply):
+    gemini = gemini_module.GeminiService()
+    gemini.api_key = "test"
+    gemini.client = ReplyClient(reply)
+    index = VisualizationReuseIndex()
+    monkeypatch.setattr(gemini_module, "get_visualization_reuse_index", lambda: index)
+
+    async def visualize():
+        first = await gemini.generate_visualization("Harry opened the heavy wooden door slowly.", 0,
+                                                    document_id="doc")
+        second = await gemini.generate_visualization("Harry opened the heavy wooden door slowly!", 1,
+                                                     document_id="doc")
+        return first, second
+
+    first, second = asyncio.run(visualize())
+    return gemini.client.calls, first, second
+
+
+def test_fenced_visualization_is_parsed_and_reused(monkeypatch):
+    calls, first, second = visualize_twice(
+        monkeypatch, lambda prompt: f"```json\n{canned_response(prompt)}\n```")
+    assert first["description"].startswith("A simple picture of")
+    assert calls == 1
+    assert "reused_similarity" in second
+
+
+def test_fallback_visualization_is_not_reused(monkeypatch):
+    calls, first, second = visualize_twice(monkeypatch, lambda prompt: "Sorry, I can't help with that.")
+    assert first["description"].startswith("Visual representation of")
+    assert calls == 2
+    assert "reused_similarity" not in second
+
+
+def test_placeholder_image_is_not_cached_or_reused(monkeypatch):
+    class FailingClient:
+        calls = 0
+
+        async def generate(self, model, prompt, coalesce=False):
+            FailingClient.calls += 1
+            raise RuntimeError("429 Resource has been exhausted")
+
+    index = VisualizationReuseIndex()
+    monkeypatch.setattr(image_module, "get_visualization_reuse_index", lambda: index)
+
+    async def generate():
+        generator = image_module.ImageGeneratorService()
+        generator.api_key = "test"
+        generator.client = FailingClient()
+        first = await generator.generate_image_for_line("The storm washed the bridge away.", 0,
+                                                        document_id="doc")
+        second = await generator.generate_image_for_line("The storm washed the bridge away.", 1,
+                                                         document_id="doc")
+        return generator, first, second
+
+    generator, first, second = asyncio.run(generate())
+    assert first["image_description"].startswith("A colorful cartoon illustration")
+    assert FailingClient.calls == 2
+    assert len(generator.image_cache) == 0
+    assert "reused_from" not in second["metadata"]
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import os
+
+from models import WordDetail
+from services.compact_layout import expand_page_words
+from services.pdf_extractor import aiter_pages, extract_layout
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# golden.json is the layout of golden.pdf as produced by the original
+# per-word extractor; extraction changes must keep it byte-identical
+# (or regenerate it deliberately and bump EXTRACTOR_VERSION).
+
+
+def load_fixture():
+    with open(os.path.join(FIXTURES, "golden.pdf"), "rb") as f:
+        data = f.read()
+    with open(os.path.join(FIXTURES, "golden.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    return data, expected
+
+
+def test_extract_layout_matches_golden():
+    data, expected = load_fixture()
+    assert extract_layout(data).model_dump(mode="json") == expected
+
+
+def test_aiter_pages_matches_golden():
+    _, expected = load_fixture()
+
+    async def extract():
+        return [page.model_dump(mode="json")
+                async for page in aiter_pages(os.path.join(FIXTURES, "golden.pdf"))]
+
+    assert asyncio.run(extract()) == expected["pages"]
+
+
+def test_compact_words_expand_to_golden():
+    _, expected = load_fixture()
+
+    async def extract():
+        pages = [page async for page in aiter_pages(os.path.join(FIXTURES, "golden.pdf"),
+                                                    WordDetail.COMPACT)]
+        for page in pages:
+            expand_page_words(page)
+        return [page.model_dump(mode="json") for page in pages]
+
+    assert asyncio.run(extract()) == expected["pages"]
@@ -0,0 +1,104 @@
+import asyncio
+
+import services.visualization_scheduler as scheduler_module
+from services.single_flight import SingleFlight
+from services.visualization_scheduler import VisualizationScheduler
+
+
+class FakeMongo:
+    def __init__(self, page_count: int, lines=()):
+        self.page_count = page_count
+        self.lines = lines
+
+    async def get_document_pages(self, document_id, user_id, start, count):
+        if document_id != "book":
+            return None
+        pages = [{"index": i, "lines": list(self.lines)}
+                 for i in range(start, min(start + count, self.page_count))]
+        return {"_id": document_id, "page_count": self.page_count, "pages": pages}
+
+
+def use_mongo(monkeypatch, page_count: int, lines=()):
+    mongo = FakeMongo(page_count, lines)
+
+    async def get_mongodb_service():
+        return mongo
+
+    monkeypatch.setattr(scheduler_module, "get_mongodb_service", get_mongodb_service)
+
+
+def test_unknown_document_records_no_window(monkeypatch):
+    use_mongo(monkeypatch, 10)
+    scheduler = VisualizationScheduler(ahead=2, behind=0)
+    assert asyncio.run(scheduler.update_position("missing", "user", 3, "reader")) is None
+    assert scheduler.get_stats()["readers"] == 0
+
+
+def test_position_is_clamped_to_the_last_page(monkeypatch):
+    use_mongo(monkeypatch, 10)
+    scheduler = VisualizationScheduler(ahead=2, behind=1)
+    result = asyncio.run(scheduler.update_position("book", "user", 50, "reader"))
+    assert result["page"] == 9
+    assert result["window"] == [8, 9]
+
+    result = asyncio.run(scheduler.update_position("book", "user", 8, "reader"))
+    assert result["window"] == [7, 9]
+
+
+def test_expired_windows_are_dropped_for_every_document(monkeypatch):
+    use_mongo(monkeypatch, 10)
+    monkeypatch.setattr(scheduler_module, "VISUALIZATION_VIEWER_TTL", -1.0)
+    scheduler = VisualizationScheduler()
+    asyncio.run(scheduler.update_position("book", "user", 0, "first"))
+    asyncio.run(scheduler.update_position("book", "user", 0, "second"))
+    # Each reader's window has already expired by the time it is counted
+    assert scheduler.get_stats()["readers"] == 0
+    assert scheduler._windows == {}
+
+
+class SlowGemini:
+    """Generates visualizations through a coalesced call that never returns"""
+
+    def __init__(self):
+        self.single_flight = SingleFlight()
+        self.started = 0
+        self.cancelled = 0
+
+    async def _call(self):
+        self.started += 1
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+    async def generate_visualization(self, text, line_index, document_id=None):
+        return await self.single_flight.do(text, self._call)
+
+
+def test_leaving_the_window_cancels_the_model_call(monkeypatch):
+    use_mongo(monkeypatch, 10, lines=[{"index": 0, "text": "The dragon woke.", "importance_score": 0.9}])
+    gemini = SlowGemini()
+    monkeypatch.setattr(scheduler_module, "get_gemini_service", lambda: gemini)
+    scheduler = VisualizationScheduler(ahead=0, behind=0)
+
+    async def read():
+        # The same line on two pages shares one call
+        await scheduler.update_position("book", "user", 0, "first")
+        await scheduler.update_position("book", "user", 5, "second")
+        await asyncio.sleep(0.01)
+        assert gemini.started == 1
+
+        # Page 0 is dropped, but page 5 still waits on the call
+        result = await scheduler.update_position("book", "user", 5, "first")
+        await asyncio.sleep(0.01)
+        assert result["cancelled"] == 1
+        assert gemini.cancelled == 0
+
+        scheduler.leave("book", "first")
+        assert scheduler.leave("book", "second") == 1
+        await asyncio.sleep(0.01)
+        assert gemini.cancelled == 1
+        assert gemini.single_flight.in_flight == 0
+
+    asyncio.run(read())
@@ -0,0 +1,60 @@
+import asyncio
+
+from services.ws_manager import WSManager
+
+
+class FakeWebSocket:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def send_json(self, data):
+        if self.fail:
+            raise RuntimeError("connection closed")
+        self.sent.append(data)
+
+
+def test_unknown_sessions_are_not_subscribed():
+    manager = WSManager()
+    assert manager.subscribe("never-connected", "job:1") is False
+    assert manager.subscriptions == {}
+
+
+def test_disconnect_removes_empty_topics():
+    manager = WSManager()
+    socket = FakeWebSocket()
+
+    async def run():
+        await manager.connect("reader", socket)
+        assert manager.subscribe("reader", "job:1")
+        assert manager.subscribe("reader", "document:1")
+        await manager.publish("job:1", {"type": "progress"})
+        await manager.disconnect("reader")
+
+    asyncio.run(run())
+    assert socket.sent == [{"type": "progress"}]
+    assert manager.subscriptions == {}
+    assert manager.session_topics == {}
+
+
+def test_dead_sockets_are_forgotten_on_publish():
+    manager = WSManager()
+    alive, dead = FakeWebSocket(), FakeWebSocket(fail=True)
+
+    async def run():
+        await manager.connect("alive", alive)
+        await manager.connect("dead", dead)
+        manager.subscribe("alive", "job:1")
+        manager.subscribe("dead", "job:1")
+        await manager.publish("job:1", {"type": "done"})
+
+    asyncio.run(run())
+    assert alive.sent == [{"type": "done"}]
+    assert manager.subscriptions == {"job:1": {"alive"}}
+    assert "dead" not in manager.active